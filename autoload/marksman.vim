@@ -74,77 +74,109 @@ function! s:addPadding(numSpaces)
     return message
 endfunction
 
-function! marksman#run(...)
-    let projectRootPath = len(a:000) ? a:1 : getcwd()
-    let requestId = len(a:000) > 1 ? a:2 : ''
-    let offset = len(a:000) > 2 ? a:3 : 0
-
-    let pageSize = 15
-    let leftIndent = 10
-    let rightIndent = 15
-    let currentPath = expand('%:p')
+" The search that is currently shown.  Empty when marksman#run isn't running
+let s:search = {}
+let s:leftIndent = 10
+let s:rightIndent = 15
 
-    while 1
-        " Necessary to avoid putting CPU at 100%
-        sleep 50m
+function! s:render()
+    let result = s:search.result
+    let requestId = s:search.requestId
+    let leftIndent = s:leftIndent
+    let rightIndent = s:rightIndent
 
-        let result = MarksmanUpdateSearch(projectRootPath, requestId, offset, pageSize, currentPath)
-        let offset = max([0, min([offset, result.matchesCount - 1])])
+    redraw
+    " echo ''
+    echon strpart(requestId, 0, leftIndent)
+    echohl Cursor
+    echon ' '
+    echohl NONE
 
-        redraw
-        " echo ''
-        echon strpart(requestId, 0, leftIndent)
-        echohl Cursor
-        echon ' '
-        echohl NONE
+    " Keep the same indent regardless of the size of request id
+    echon s:addPadding(leftIndent - strlen(requestId))
 
-        " Keep the same indent regardless of the size of request id
-        echon s:addPadding(leftIndent - strlen(requestId))
+    let message = ''
 
-        let message = ''
+    let footerStart = &columns - rightIndent - leftIndent
+    let progressLength = 4
 
-        let footerStart = &columns - rightIndent - leftIndent
-        let progressLength = 4
+    let maxMatchesStrLen = footerStart - leftIndent - progressLength
+    let candidates = result.matches
 
-        let maxMatchesStrLen = footerStart - leftIndent - progressLength
-        let matchesStr = s:getMatchListString(result.matches, offset > 0, maxMatchesStrLen)
-        let matchesStrLen = strlen(matchesStr)
+    if empty(candidates)
+        " Nothing has exactly these humps, so show where the deeper matches are instead
+        let candidates = map(copy(result.continuations), {_, x -> {'name': x.letter . ':' . x.name}})
+    endif
 
-        call s:assert(matchesStrLen <= maxMatchesStrLen, string(matchesStrLen) . " <= " . string(maxMatchesStrLen))
+    let matchesStr = s:getMatchListString(candidates, s:search.offset > 0, maxMatchesStrLen)
+    let matchesStrLen = strlen(matchesStr)
 
-        let message .= matchesStr
-        let message .= s:addPadding(matchesStrLen - maxMatchesStrLen)
+    call s:assert(matchesStrLen <= maxMatchesStrLen, string(matchesStrLen) . " <= " . string(maxMatchesStrLen))
 
-        if result.isUpdating
-            let elapsed = reltimefloat(reltime(s:lastProgressTime))
+    let message .= matchesStr
+    let message .= s:addPadding(matchesStrLen - maxMatchesStrLen)
 
-            if elapsed > g:Mm_ProgressUpdateInterval
-                let s:progressIndex = float2nr(fmod(s:progressIndex + 1, 3))
-                let s:lastProgressTime = reltime()
-            endif
+    if result.isUpdating
+        let elapsed = reltimefloat(reltime(s:lastProgressTime))
 
-            let message .= ' '
-            for i in range(0, s:progressIndex)
-                let message .= '.'
-            endfor
+        if elapsed > g:Mm_ProgressUpdateInterval
+            let s:progressIndex = float2nr(fmod(s:progressIndex + 1, 3))
+            let s:lastProgressTime = reltime()
         endif
 
-        let message .= s:addPadding(footerStart - strlen(message))
+        let message .= ' '
+        for i in range(0, s:progressIndex)
+            let message .= '.'
+        endfor
+    endif
 
-        let footer = string(result.matchesCount) . '/' . string(result.totalCount)
+    let message .= s:addPadding(footerStart - strlen(message))
 
-        let message .= footer
-        echon message
+    let footer = string(result.matchesCount)
 
-        " for debugging
-        " echon s:addPadding(rightIndent - strlen(footer) - 3) . '|'
+    if result.prefixMatchesCount > 0
+        let footer .= '+' . string(result.prefixMatchesCount)
+    endif
 
-        let charNo = getchar(1)
+    let footer .= '/' . string(result.totalCount)
 
-        if !type(charNo) && charNo == 0
-            continue
-        endif
+    let message .= footer
+    echon message
+
+    " for debugging
+    " echon s:addPadding(rightIndent - strlen(footer) - 3) . '|'
+endfunction
 
+function! s:requestUpdate()
+    let s:search.result = MarksmanUpdateSearch(
+        \ s:search.projectRootPath, s:search.requestId, s:search.offset, s:search.pageSize, s:search.currentPath)
+
+    let offset = max([0, min([s:search.offset, s:search.result.matchesCount - 1])])
+
+    if offset != s:search.offset
+        let s:search.offset = offset
+        return s:requestUpdate()
+    endif
+
+    call s:render()
+endfunction
+
+" Called by the python side whenever the results for the current search change
+function! marksman#onUpdate(result)
+    " Ignore anything that was sent before the last key press
+    if empty(s:search) || a:result.requestId !=# s:search.requestId || a:result.offset != s:search.offset
+        return
+    endif
+
+    let s:search.result = a:result
+    call s:render()
+endfunction
+
+function! s:runSearch()
+    call s:requestUpdate()
+
+    while 1
+        " Blocks until a key is pressed.  Updates are drawn by marksman#onUpdate in the meantime
         let charNo = getchar()
         let char = nr2char(charNo)
 
@@ -154,30 +186,35 @@ function! marksman#run(...)
         endif
 
         if char ==# g:Mm_KeyMaps['refresh'] || charNo ==# g:Mm_KeyMaps['refresh']
-            call MarksmanForceRefresh(projectRootPath)
+            call MarksmanForceRefresh(s:search.projectRootPath)
+            call s:requestUpdate()
             continue
         endif
 
         if char ==# g:Mm_KeyMaps['delete_character'] || charNo ==# g:Mm_KeyMaps['delete_character']
-            let requestId = strpart(requestId, 0, strlen(requestId)-1)
+            let s:search.requestId = strpart(s:search.requestId, 0, strlen(s:search.requestId)-1)
+            call s:requestUpdate()
             continue
         endif
 
         if char ==# g:Mm_KeyMaps['delete_word'] || charNo ==# g:Mm_KeyMaps['delete_word']
-            let requestId = ''
+            let s:search.requestId = ''
+            call s:requestUpdate()
             continue
         endif
 
         if char ==# g:Mm_KeyMaps['scroll_right'] || charNo ==# g:Mm_KeyMaps['scroll_right']
-            if offset < result.matchesCount - 1
-                let offset += 1
+            if s:search.offset < s:search.result.matchesCount - 1
+                let s:search.offset += 1
+                call s:requestUpdate()
             endif
             continue
         endif
 
         if char ==# g:Mm_KeyMaps['scroll_left'] || charNo ==# g:Mm_KeyMaps['scroll_left']
-            if offset > 0
-                let offset -= 1
+            if s:search.offset > 0
+                let s:search.offset -= 1
+                call s:requestUpdate()
             endif
             continue
         endif
@@ -185,8 +222,8 @@ function! marksman#run(...)
         if char ==# g:Mm_KeyMaps['open'] || charNo ==# g:Mm_KeyMaps['open']
             call s:clearEcho()
 
-            if !empty(result.matches)
-                let filePath = result.matches[0].path
+            if !empty(s:search.result.matches)
+                let filePath = s:search.result.matches[0].path
                 if filereadable(filePath)
                     exec 'e ' . filePath
                 else
@@ -197,10 +234,28 @@ function! marksman#run(...)
             break
         endif
 
-        let requestId = requestId . char
+        let s:search.requestId = s:search.requestId . char
+        call s:requestUpdate()
     endwhile
 endfunction
 
+function! marksman#run(...)
+    let s:search = {
+        \ 'projectRootPath': len(a:000) ? a:1 : getcwd(),
+        \ 'requestId': len(a:000) > 1 ? a:2 : '',
+        \ 'offset': len(a:000) > 2 ? a:3 : 0,
+        \ 'pageSize': 15,
+        \ 'currentPath': expand('%:p'),
+        \ }
+
+    try
+        call s:runSearch()
+    finally
+        let s:search = {}
+        call MarksmanEndSearch()
+    endtry
+endfunction
+
 function! s:InitVar(var, value)
     if !exists(a:var)
         exec 'let '.a:var.'='.string(a:value)
@@ -235,5 +290,16 @@ call s:InitVar('g:Mm_IgnoreDirectoryPatterns', [])
 call s:InitVar('g:Mm_IgnoreFilePatterns', [])
 call s:InitVar('g:Mm_ShowHidden', 0)
 call s:InitVar('g:Mm_ProgressUpdateInterval', 0.25)
-call s:InitVar('g:Mm_SearchPreferenceOrder', ['custom', 'git', 'hg', 'rg', 'pt', 'ag', 'find', 'python'])
+call s:InitVar('g:Mm_EnablePersistentCache', 1)
+call s:InitVar('g:Mm_CacheDirectory', stdpath('cache') . '/marksman')
+call s:InitVar('g:Mm_EnableFileWatcher', 1)
+call s:InitVar('g:Mm_FileWatcherPollInterval', 2.0)
+call s:InitVar('g:Mm_StatThreadCount', 8)
+call s:InitVar('g:Mm_IngestProcessCount', 0)
+call s:InitVar('g:Mm_ScanThreadCount', 2)
+call s:InitVar('g:Mm_AutoSelectSearchType', 0)
+call s:InitVar('g:Mm_LazyModificationTimes', 0)
+call s:InitVar('g:Mm_UseDaemon', 0)
+call s:InitVar('g:Mm_DaemonSocketPath', '')
+call s:InitVar('g:Mm_SearchPreferenceOrder', ['custom', 'gitindex', 'git', 'hg', 'rg', 'pt', 'ag', 'find', 'python'])
 
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Measures how the Marksman engine performs on synthetic trees, without Neovim.
+
+For every tree size and search type this runs a separate worker process (so that
+the peak memory of each one can be measured) that:
+
+    * Scans the tree the same way the plugin does, and records the total time and
+      the time until the first results were available
+    * Times updateSearch for a sample of real and partial humps (p50/p99/max)
+    * Repeats the scan one phase at a time to break it down into listing the files,
+      ingesting them into the index, looking up modification times and sorting
+
+Example:
+
+    python benchmark/Benchmark.py --sizes 10000 100000 1000000 --git --output results.json
+
+The output file holds the results along with the commit they were measured at, so
+that runs can be compared between commits
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+_benchmarkDir = os.path.dirname(os.path.abspath(__file__))
+_repoRoot = os.path.dirname(_benchmarkDir)
+sys.path.insert(0, os.path.join(_repoRoot, 'rplugin', 'python3'))
+sys.path.insert(0, _benchmarkDir)
+
+from SyntheticTree import createSyntheticTree
+from marksman.engine.MarksmanEngine import MarksmanEngine
+from marksman.engine.Settings import createSettings
+from marksman.engine.QueryBenchmark import sampleQueries, measureQueries
+from marksman.util.ConsoleLog import ConsoleLog
+
+DefaultSearchTypes = ['gitindex', 'git', 'hg', 'rg', 'pt', 'ag', 'find', 'python']
+# Number of distinct humps sampled from the index to search for
+SearchSampleSize = 200
+MaxSearchResults = 20
+ScanTimeout = 3600.0
+
+def _getPeakMemoryMb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on windows
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on mac, kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+
+    return peak / 1024.0
+
+def _isSupported(engine, searchType, rootPath):
+    """ Checks without running anything, so that nothing else is using the disk during the scan """
+    commandBuilder = engine._searchCommandBuilder
+
+    if searchType == 'python':
+        return True
+
+    if searchType in ('git', 'gitindex'):
+        return commandBuilder.tryBuildGitSearchCommands(rootPath, False) is not None
+
+    return commandBuilder.tryBuildExternalSearchCommand(searchType, rootPath, False) is not None
+
+def _measureScan(engine, log, rootPath):
+    startTime = time.time()
+    projectInfo = engine._getProjectInfo(rootPath)
+    firstResultsTime = None
+
+    while projectInfo.isUpdating.getValue():
+        if log.errors:
+            raise RuntimeError(f'Scanning "{rootPath}" failed: {log.errors}')
+
+        if firstResultsTime is None and projectInfo.index.totalCount > 0:
+            firstResultsTime = time.time() - startTime
+
+        if time.time() - startTime > ScanTimeout:
+            raise RuntimeError(f'Timed out scanning "{rootPath}"')
+
+        time.sleep(0.005)
+
+    totalTime = time.time() - startTime
+
+    if firstResultsTime is None:
+        firstResultsTime = totalTime
+
+    return projectInfo, totalTime, firstResultsTime
+
+def _measurePhases(engine, rootPath, statThreadCount):
+    """ Runs the steps of a scan one after the other, so that each can be timed on its own """
+    from marksman.util.PathIngester import PathIngester, splitRecords
+    from marksman.util.ProjectIndex import ProjectIndexBuilder
+    from marksman.util.ModificationTimeCollector import ModificationTimeCollector
+
+    timings = {}
+
+    startTime = time.time()
+    result = engine._scanForFiles(rootPath, False)
+    batches = list(result.iterBatches())
+    timings['list'] = time.time() - startTime
+
+    builder = ProjectIndexBuilder()
+    ingester = PathIngester(rootPath, 0)
+    statIndices = []
+
+    startTime = time.time()
+    for batch in batches:
+        paths, modTimes = splitRecords(batch)
+        statIndices.extend(builder.addFiles(ingester.ingest(paths), modTimes))
+    timings['ingest'] = time.time() - startTime
+
+    modTimeCollector = ModificationTimeCollector(builder.fileTable, statThreadCount)
+
+    startTime = time.time()
+    try:
+        for fileIndex in statIndices:
+            modTimeCollector.add(fileIndex)
+
+        modTimeCollector.flush()
+
+        while modTimeCollector.hasOutstanding():
+            for fileIndex, modTime in modTimeCollector.takeResults(1.0):
+                builder.setModificationTime(fileIndex, modTime)
+    finally:
+        modTimeCollector.shutdown()
+    timings['stat'] = time.time() - startTime
+
+    startTime = time.time()
+    builder.sortBuckets()
+    builder.publish()
+    timings['sort'] = time.time() - startTime
+
+    return timings, len(statIndices)
+
+def runWorker(searchType, rootPath, seed):
+    """ Benchmarks one search type on one tree.  Returns a dict of the results """
+    settings = createSettings({
+        'g:Mm_SearchPreferenceOrder': [searchType],
+        'g:Mm_EnablePersistentCache': 0,
+        'g:Mm_EnableFileWatcher': 0,
+    })
+    log = ConsoleLog(False)
+    engine = MarksmanEngine(settings, log)
+
+    if not _isSupported(engine, searchType, rootPath):
+        return {'searchType': searchType, 'error': 'not supported'}
+
+    projectInfo, scanTime, firstResultsTime = _measureScan(engine, log, rootPath)
+    index = projectInfo.index
+
+    results = {
+        'searchType': searchType,
+        'scannedCount': projectInfo.scannedCount,
+        'indexedCount': index.totalCount,
+        'scanSeconds': scanTime,
+        'firstResultsSeconds': firstResultsTime,
+        'search': measureQueries(engine, rootPath, sampleQueries(index, SearchSampleSize, seed), MaxSearchResults),
+        # Measured before the phases below, which hold everything in memory at once
+        'peakMemoryMb': _getPeakMemoryMb(),
+        # The phases as they were interleaved in the real scan
+        'stats': engine.getStats(rootPath)[0],
+    }
+
+    phaseSeconds, statCount = _measurePhases(engine, rootPath, settings['g:Mm_StatThreadCount'])
+    results['phaseSeconds'] = phaseSeconds
+    results['statCount'] = statCount
+
+    if log.errors:
+        results['errors'] = log.errors
+
+    return results
+
+def _runWorkerProcess(searchType, rootPath, seed):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', searchType, rootPath, '--seed', str(seed)],
+        stdout=subprocess.PIPE, universal_newlines=True)
+
+    if output.returncode != 0:
+        return {'searchType': searchType, 'error': f'worker exited with code {output.returncode}'}
+
+    return json.loads(output.stdout)
+
+def _getCommit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=_repoRoot, stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _formatSeconds(value):
+    return f'{value:8.2f}' if value is not None else ' ' * 8
+
+def _printResult(fileCount, result):
+    if 'error' in result:
+        print(f'{fileCount:>8} {result["searchType"]:>9}  {result["error"]}')
+        return
+
+    phases = result['phaseSeconds']
+    search = result['search']
+    print(f'{fileCount:>8} {result["searchType"]:>9} {_formatSeconds(result["scanSeconds"])}'
+        f'{_formatSeconds(result["firstResultsSeconds"])}'
+        + ''.join(_formatSeconds(phases[x]) for x in ('list', 'ingest', 'stat', 'sort'))
+        + f'{search["p50Ms"] or 0:8.3f}{search["p99Ms"] or 0:8.3f}{result["peakMemoryMb"] or 0:9.1f}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Marksman on synthetic trees without Neovim')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='Number of files in each tree')
+    parser.add_argument('--search-types', nargs='+', default=DefaultSearchTypes, help='Search types to benchmark')
+    parser.add_argument('--tree-dir', default=os.path.join(tempfile.gettempdir(), 'marksman-benchmark'),
+        help='Where the synthetic trees are created.  They are reused by later runs')
+    parser.add_argument('--git', action='store_true', help='Make the trees git repositories, for the git search types')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this json file')
+    parser.add_argument('--worker', nargs=2, metavar=('SEARCH_TYPE', 'ROOT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(runWorker(args.worker[0], args.worker[1], args.seed), sys.stdout)
+        return
+
+    results = []
+
+    print(f'{"files":>8} {"type":>9} {"scan":>8}{"first":>8}{"list":>8}{"ingest":>8}{"stat":>8}{"sort":>8}'
+        f'{"p50 ms":>8}{"p99 ms":>8}{"peak MB":>9}')
+
+    for fileCount in args.sizes:
+        rootPath = os.path.join(args.tree_dir, f'tree-{fileCount}-{args.seed}' + ('-git' if args.git else ''))
+        createSyntheticTree(rootPath, fileCount, args.seed, args.git)
+
+        for searchType in args.search_types:
+            result = _runWorkerProcess(searchType, rootPath, args.seed)
+            result['fileCount'] = fileCount
+            results.append(result)
+            _printResult(fileCount, result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': _getCommit(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpuCount': os.cpu_count(),
+                'results': results,
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
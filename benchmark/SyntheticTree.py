@@ -0,0 +1,138 @@
+
+import os
+import random
+import subprocess
+
+_words = (
+    'app account action adapter api asset async auth base batch buffer build cache call channel '
+    'client code config connection context controller core data database debug default device '
+    'dialog document editor entity event factory feature file filter format frame graph handler '
+    'helper history image index input item job key layout list loader lock log manager map '
+    'message model module monitor mount node object option output package page panel parser '
+    'path player plugin pool port process profile project provider proxy query queue reader '
+    'record registry render request resource response result route rule runner scene schema '
+    'screen search server service session setting shader socket source state storage store '
+    'stream style sync system table task template test text theme thread token tool tree type '
+    'user util validator value view widget window worker writer').split()
+
+_directoryNames = (
+    'src lib test tests core utils internal common api models views components services '
+    'handlers include docs scripts tools platform editor runtime server client shared').split()
+
+# Names that show up over and over again in real projects
+_commonNames = [
+    'index.js', '__init__.py', 'README.md', 'Makefile', 'CMakeLists.txt', 'package.json',
+    'index.ts', 'mod.rs', 'BUILD', 'setup.py', 'main.go', 'utils.py', 'types.ts', 'constants.js',
+]
+
+# (extensions, how the words are joined)
+_languages = [
+    (['.py'], 'snake'),
+    (['.js', '.ts', '.tsx', '.jsx'], 'camel'),
+    (['.cs', '.java'], 'pascal'),
+    (['.cpp', '.h', '.c', '.hpp'], 'snake'),
+    (['.css', '.html', '.json', '.yml'], 'kebab'),
+    (['.go', '.rs'], 'snake'),
+]
+
+def _joinWords(words, style):
+    if style == 'snake':
+        return '_'.join(words)
+
+    if style == 'kebab':
+        return '-'.join(words)
+
+    if style == 'camel':
+        return words[0] + ''.join(x.capitalize() for x in words[1:])
+
+    return ''.join(x.capitalize() for x in words)
+
+def _generateFileName(rng, language):
+    if rng.random() < 0.06:
+        return rng.choice(_commonNames)
+
+    extensions, style = language
+    words = rng.sample(_words, rng.choice((1, 2, 2, 2, 3, 3, 4)))
+    return _joinWords(words, style) + rng.choice(extensions)
+
+def generateSyntheticPaths(fileCount, seed=0):
+    """
+    Returns fileCount relative file paths with a mix of naming conventions, nesting
+    and repeated names that looks roughly like a real source tree.  The same
+    arguments always give the same paths
+    """
+    rng = random.Random(seed)
+    paths = []
+    # Directories that can still get files, and their language
+    directories = [('', rng.choice(_languages), 0)]
+    # Directory -> names already used in it
+    usedNames = {}
+
+    while len(paths) < fileCount:
+        dirPath, language, depth = directories[-1] if rng.random() < 0.7 else rng.choice(directories)
+
+        if depth < 10 and rng.random() < 0.3:
+            name = rng.choice(_directoryNames + _words)
+
+            # Sub projects sometimes switch language
+            if rng.random() < 0.1:
+                language = rng.choice(_languages)
+
+            directories.append((os.path.join(dirPath, f'{name}{len(directories)}'), language, depth + 1))
+            continue
+
+        names = usedNames.setdefault(dirPath, set())
+        newNames = set()
+
+        for _ in range(min(int(rng.expovariate(1 / 12.0)) + 1, fileCount - len(paths))):
+            name = _generateFileName(rng, language)
+
+            if name not in names:
+                newNames.add(name)
+
+        names.update(newNames)
+        paths.extend(os.path.join(dirPath, x) for x in sorted(newNames))
+
+    return paths
+
+def createSyntheticTree(rootPath, fileCount, seed=0, withGit=False):
+    """
+    Creates the tree under rootPath unless a previous call already finished creating
+    the same one, since the larger trees take a while
+    """
+    markerPath = f'{rootPath}.complete'
+
+    if os.path.exists(markerPath):
+        return
+
+    createdDirectories = set()
+
+    for path in generateSyntheticPaths(fileCount, seed):
+        fullPath = os.path.join(rootPath, path)
+        dirPath = os.path.dirname(fullPath)
+
+        if dirPath not in createdDirectories:
+            os.makedirs(dirPath, exist_ok=True)
+            createdDirectories.add(dirPath)
+
+        open(fullPath, 'w').close()
+
+    if withGit:
+        subprocess.check_call(['git', 'init', '-q', '.'], cwd=rootPath)
+        subprocess.check_call(['git', 'add', '-A'], cwd=rootPath)
+
+    with open(markerPath, 'w'):
+        pass
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    paths = generateSyntheticPaths(1000, seed=3)
+    assertIsEqual(len(paths), 1000)
+    assertIsEqual(generateSyntheticPaths(1000, seed=3), paths)
+    assertIsEqual(len(set(paths)), len(paths))
+
+    print("Tests passed")
@@ -1,37 +1,19 @@
 
 import pynvim
 import os
-from marksman.util.StringHumpsFinder import getStringHumps
-from marksman.util.AsyncCommandExecutor import AsyncCommandExecutor
-from marksman.util.PythonSearchHandler import PythonSearchHandler
-from marksman.util.SearchExternalCommandBuilder import SearchExternalCommandBuilder, SearchTypes as ExternalSearchTypes
-from marksman.util.LockableValue import LockableValue
-from marksman.util.ReadWriteLockableValue import ReadWriteLockableValue
+from marksman.engine.MarksmanEngine import MarksmanEngine
+from marksman.engine.Settings import SettingNames, EvaluatedNames
+from marksman.daemon.DaemonClient import tryConnectToDaemon
+from marksman.util.StringHumpsFinder import getFileNameHumps
 from marksman.util.Log import Log
-from datetime import datetime
-import threading
-from queue import Queue
-import traceback
-import time
-
-SearchTypes = ExternalSearchTypes + ["python", "custom"]
-WaitingForSearchTimeout = 5.0
-
-class ProjectInfo:
-    def __init__(self):
-        self.idMap = ReadWriteLockableValue({})
-        self.nameMap = ReadWriteLockableValue({})
-        self.totalCount = LockableValue(0)
-        self.isUpdating = LockableValue(True)
-
-class FileInfo:
-    def __init__(self, path, name):
-        self.path = path
-        self.name = name
-        self.modificationTime = ReadWriteLockableValue(datetime.min)
 
 @pynvim.plugin
 class Marksman(object):
+    """
+    Connects neovim to MarksmanEngine, which does all of the actual work, either in
+    this process or in the shared daemon when g:Mm_UseDaemon is set.  This only reads
+    the settings, converts arguments and results, and runs editor commands
+    """
     def __init__(self, nvim):
         self._nvim = nvim
         self._hasInitialized = False
@@ -42,24 +24,7 @@ class Marksman(object):
 
         assert len(args) == 1, 'Wrong number of arguments to MarksmanForceRefresh'
 
-        rootPath = self._getCanonicalPath(args[0])
-
-        info = self._getProjectInfo(rootPath)
-
-        if info.isUpdating.getValue():
-            return
-
-        info.isUpdating.setValue(True)
-        self._refreshQueue.put(rootPath)
-
-    def _waitForProjectToInitialize(self, projectInfo):
-        elapsed = 0
-
-        while projectInfo.isUpdating.getValue():
-            time.sleep(0.05)
-            elapsed += 0.05
-            if elapsed > WaitingForSearchTimeout:
-                raise RuntimeError(f"Timeout waiting to update project in Marksman!")
+        self._callEngine('forceRefresh', args[0])
 
     @pynvim.command('MarksmanOpenFirstMatch', nargs='1', range='', sync=True)
     def openFirstMatch(self, args, _):
@@ -67,23 +32,15 @@ class Marksman(object):
 
         assert len(args) == 2 or len(args) == 1, 'Wrong number of arguments to MarksmanOpenNextMatch'
 
-        rootPath = self._getCanonicalPath(args[0])
-
-        assert os.path.isdir(rootPath), f"Could not find directory '{rootPath}'"
-
         if len(args) == 1:
             id = ''
         else:
             id = args[1]
 
-        projectInfo = self._getProjectInfo(rootPath)
-
-        self._waitForProjectToInitialize(projectInfo)
-
-        matchesSlice, _ = self._lookupMatchesSlice(projectInfo, id, 0, 1, None)
+        matchesSlice, _ = self._callEngine('getMatches', args[0], id, 0, 1)
 
         if len(matchesSlice) > 0:
-            self._nvim.command('e ' + matchesSlice[0].path)
+            self._nvim.command(self._toVimString('e ' + matchesSlice[0]))
         else:
             self._nvim.command('echo "Could not find match"')
 
@@ -93,21 +50,13 @@ class Marksman(object):
 
         assert len(args) == 1, 'Wrong number of arguments to MarksmanOpenNextMatch'
 
-        rootPath = self._getCanonicalPath(args[0])
-
-        assert os.path.isdir(rootPath), f"Could not find directory '{rootPath}'"
-
-        projectInfo = self._getProjectInfo(rootPath)
-
-        self._waitForProjectToInitialize(projectInfo)
+        currentPath = os.path.abspath(self._nvim.eval('expand("%:p")'))
+        id = getFileNameHumps(os.path.basename(currentPath))
 
-        currentPath = self._getCanonicalPath(self._nvim.eval('expand("%:p")'))
-        id = self._getFileNameHumps(os.path.basename(currentPath))
-
-        matchesSlice, _ = self._lookupMatchesSlice(projectInfo, id, 0, 1, currentPath)
+        matchesSlice, _ = self._callEngine('getMatches', args[0], id, 0, 1, currentPath)
 
         if len(matchesSlice) > 0:
-            self._nvim.command('e ' + matchesSlice[0].path)
+            self._nvim.command(self._toVimString('e ' + matchesSlice[0]))
         else:
             self._nvim.command('echo "Could not find alternative path"')
 
@@ -115,33 +64,8 @@ class Marksman(object):
     def profileSearchMethods(self, args, _):
         self._lazyInit()
 
-        dirPath = self._getCanonicalPath(args[0])
-
-        for i in range(2):
-            self._log.info(f'Round {i+1}:')
-
-            invalidTypes = []
-
-            for searchType in SearchTypes:
-                startTime = datetime.now()
-
-                fileIterator = self._tryScanForFilesUsingSearchType(searchType, dirPath, False)
-
-                if not fileIterator:
-                    invalidTypes.append(searchType)
-                    continue
-
-                for path in fileIterator:
-                    pass
-
-                elapsed = (datetime.now() - startTime).total_seconds()
-                self._log.info(f'Searching with "{searchType}" took {elapsed:0.2f} seconds')
-                time.sleep(0.001)
-
-        if len(invalidTypes) > 0:
-            self._log.info(f'The following were attempted but not supported: {invalidTypes}')
-
-        self._log.info(f'Done profiling')
+        for line in self._callEngine('profileSearchMethods', args[0]):
+            self._log.info(line)
 
     @pynvim.function('MarksmanLookupByFileName', sync=True)
     def lookupByFileName(self, args):
@@ -149,23 +73,7 @@ class Marksman(object):
 
         assert len(args) == 2, 'Wrong number of arguments to MarksmanTryOpenByFileName'
 
-        rootPath = self._getCanonicalPath(args[0])
-
-        assert os.path.isdir(rootPath), f"Could not find directory '{rootPath}'"
-
-        fileName = args[1]
-        projectInfo = self._getProjectInfo(rootPath)
-
-        self._waitForProjectToInitialize(projectInfo)
-
-        with projectInfo.nameMap.readLock:
-            pathList = projectInfo.nameMap.value.get(fileName)
-
-            if not pathList:
-                return []
-
-            with pathList.readLock:
-                return [x for x in pathList.value]
+        return [self._toVimString(x) for x in self._callEngine('lookupByFileName', args[0], args[1])]
 
     @pynvim.function('MarksmanUpdateSearch', sync=True)
     def updateSearch(self, args):
@@ -173,285 +81,114 @@ class Marksman(object):
 
         assert len(args) == 5, 'Wrong number of arguments to MarksmanUpdateSearch'
 
-        rootPath = self._getCanonicalPath(args[0])
+        # We could pass args[4] as the ignorePath here to hide the current project, but
+        # I find that in practice this is more annoying than it is useful
+        return self._toVimResult(self._callEngine('updateSearch', args[0], args[1], args[2], args[3]))
 
-        assert os.path.isdir(rootPath), f"Could not find directory '{rootPath}'"
+    @pynvim.function('MarksmanStats', sync=True)
+    def getStats(self, args):
+        """
+        Returns a list with the counters and timings of each project, or just of the
+        project at args[0] if it is given
+        """
+        self._lazyInit()
 
-        requestId = args[1]
-        offset = args[2]
-        maxAmount = args[3]
-        # We could use ignorePath here to hide the current project, but I find that
-        # in practice this is more annoying than it is useful
-        # ignorePath = self._getCanonicalPath(args[4])
-        ignorePath = None
+        assert len(args) <= 1, 'Wrong number of arguments to MarksmanStats'
 
-        projectInfo = self._getProjectInfo(rootPath)
-        matchesSlice, totalMatchesCount = self._lookupMatchesSlice(
-            projectInfo, requestId, offset, maxAmount, ignorePath)
+        stats = self._callEngine('getStats', args[0] if len(args) == 1 else None)
 
-        return {
-            'totalCount': projectInfo.totalCount.getValue(),
-            'isUpdating': projectInfo.isUpdating.getValue(),
-            'matchesCount': totalMatchesCount,
-            'matches': [self._convertToFileInfoDictionary(x) for x in matchesSlice],
-        }
+        for projectStats in stats:
+            projectStats['rootPath'] = self._toVimString(projectStats['rootPath'])
 
-    def _getFileNameHumps(self, fileName):
-        fileNameWithoutExtension = os.path.splitext(os.path.basename(fileName))[0]
-        return getStringHumps(fileNameWithoutExtension)
+        return stats
 
-    def _getCanonicalPath(self, path):
-        return os.path.abspath(path)
+    @pynvim.function('MarksmanEndSearch')
+    def endSearch(self, args):
+        self._lazyInit()
+        self._callEngine('endSearch')
 
     def _lazyInit(self):
         if self._hasInitialized:
+            if self._daemonClient and not self._daemonClient.isConnected:
+                self._fallBackToLocalEngine()
+
             return
 
         self._hasInitialized = True
-        self._vimSettings = self._getSettings()
-        self._log = Log(self._nvim, self._vimSettings['g:Mm_EnableDebugLogging'] != 0)
-        self._lastOpenTimes = ReadWriteLockableValue({})
-        self._refreshQueue = Queue()
-        self._projectMap = ReadWriteLockableValue({})
-        self._pythonSearchHandler = PythonSearchHandler(self._vimSettings)
-        self._searchCommandBuilder = SearchExternalCommandBuilder(self._vimSettings)
-        self._printQueue = Queue()
-
-        searchThread = threading.Thread(target=self._searchThread)
-        # die when the main thread dies
-        searchThread.daemon = True
-        searchThread.start()
-
-    def _getSettings(self):
-        variables = [
-            'g:Mm_IgnoreDirectoryPatterns', 'g:Mm_IgnoreFilePatterns', 'g:Mm_FollowLinks',
-            'g:Mm_CustomSearchCommand', 'g:Mm_ShowHidden', 'g:Mm_SearchPreferenceOrder',
-            'g:Mm_EnableDebugLogging'
-        ]
-
-        evalNames = [
-            "exists('g:Mm_CustomSearchCommand')", "get(g:, 'Mm_RecurseSubmodules', 0)",
-            "executable('rg')", "executable('pt')", "executable('ag')", "executable('find')",
-            "executable('sed')", "&encoding"
-        ]
-
-        # Minimize rpcs by just making one call
-        return self._nvim.call("marksman#evalAll", variables, evalNames)
-
-    def _tryScanForFilesUsingSearchType(self, searchType, dirPath, noIgnore):
-        os.chdir(dirPath)
-
-        if searchType == "python":
-            # This should always work
-            return self._pythonSearchHandler.scanForFiles(dirPath, noIgnore)
+        self._settings = self._getSettings()
+        self._log = Log(self._nvim, self._settings['g:Mm_EnableDebugLogging'] != 0)
 
-        if searchType == "custom":
-            if not self._vimSettings["exists('g:Mm_CustomSearchCommand')"]:
-                return None
-
-            cmd = self._vimSettings["g:Mm_CustomSearchCommand"] % dirPath.join('""')
+        if self._settings['g:Mm_UseDaemon']:
+            self._daemonClient = tryConnectToDaemon(self._settings, self._onSearchUpdated, self._log)
         else:
-            cmd = self._searchCommandBuilder.tryBuildExternalSearchCommand(
-                searchType, dirPath, noIgnore)
-
-        if not cmd:
-            return None
-
-        if self._log.includeDebugging:
-            self._log.queueInfo(f'Marksman External Command: {cmd}')
-
-        return AsyncCommandExecutor().execute(
-            cmd, encoding=self._vimSettings["&encoding"])
-
-    def _scanForFiles(self, dirPath, noIgnore):
-
-        for searchType in self._vimSettings["g:Mm_SearchPreferenceOrder"]:
-            result = self._tryScanForFilesUsingSearchType(searchType, dirPath, noIgnore)
-
-            if result:
-                return result
-
-        assert False, "Could not find valid search type!"
-
-    def _searchThreadInternal(self):
-        while True:
-            rootPath = self._refreshQueue.get()
-
-            assert os.path.isdir(rootPath), f"Could not find directory '{rootPath}'"
-
-            # self._log.queueDebug(f'Started processing "{rootPath}"')
-
-            startTime = datetime.now()
-            projectInfo = self._getProjectInfo(rootPath)
-            projectInfo.totalCount.setValue(0)
-            assert projectInfo.isUpdating.getValue()
+            self._daemonClient = None
 
-            allFilesList = ReadWriteLockableValue([])
-
-            projectInfo.idMap.setValue({'': allFilesList})
-
-            noIgnore = False  # Do we care about this?
-
-            for path in self._scanForFiles(rootPath, noIgnore):
-                name = os.path.basename(path)
-
-                nameFileList = None
-                with projectInfo.nameMap.readLock:
-                    nameFileList = projectInfo.nameMap.value.get(name)
-
-                if not nameFileList:
-                    nameFileList = ReadWriteLockableValue([])
-                    with projectInfo.nameMap.writeLock:
-                        projectInfo.nameMap.value[name] = nameFileList
-
-                path = self._getCanonicalPath(os.path.join(rootPath, path.strip()))
-
-                with nameFileList.writeLock:
-                    nameFileList.value.append(path)
-
-                id = self._getFileNameHumps(name)
-
-                if len(id) > 0:
-                    idFileList = None
-                    with projectInfo.idMap.readLock:
-                        idFileList = projectInfo.idMap.value.get(id)
-
-                    if not idFileList:
-                        idFileList = ReadWriteLockableValue([])
-                        with projectInfo.idMap.writeLock:
-                            projectInfo.idMap.value[id] = idFileList
-
-                    fileInfo = FileInfo(path, name)
-
-                    with allFilesList.writeLock:
-                        allFilesList.value.append(fileInfo)
-
-                    with idFileList.writeLock:
-                        idFileList.value.append(fileInfo)
-
-                    with projectInfo.totalCount.lock:
-                        projectInfo.totalCount.value += 1
-
-            with allFilesList.readLock:
-                # Update all the modification times
-                for fileInfo in allFilesList.value:
-                    try:
-                        # This can fail sometimes
-                        # For example, when using git, deleted files can be listed
-                        modTime = datetime.fromtimestamp(os.path.getmtime(fileInfo.path))
-                    except Exception as e:
-                        continue
-
-                    with fileInfo.modificationTime.writeLock:
-                        fileInfo.modificationTime.value = modTime
-
-            with projectInfo.idMap.readLock:
-                fileLists = projectInfo.idMap.value.values()
-
-            for fileList in fileLists:
-                with fileList.writeLock:
-                    self._sortFileList(fileList.value)
-
-            assert projectInfo.isUpdating.getValue()
-            projectInfo.isUpdating.setValue(False)
-
-            elapsed = (datetime.now() - startTime).total_seconds()
-
-            self._log.queueDebug(f'Finished processing directory "{rootPath}", took {elapsed:0.2f} seconds')
-
-            self._refreshQueue.task_done()
+        if self._daemonClient:
+            self._engine = self._daemonClient
+        else:
+            self._useLocalEngine()
 
-    def _searchThread(self):
+    def _callEngine(self, methodName, *args):
         try:
-            self._searchThreadInternal()
-        except Exception as e:
-            self._log.queueException(e)
-
-    def _getProjectInfo(self, rootPath):
+            return getattr(self._engine, methodName)(*args)
+        except OSError:
+            # Which includes the ConnectionError that the daemon client raises once
+            # the daemon has gone away
+            if not self._daemonClient:
+                raise
+
+        # Otherwise this request would be lost, and only the next one would fall back
+        self._fallBackToLocalEngine()
+        return getattr(self._engine, methodName)(*args)
+
+    def _fallBackToLocalEngine(self):
+        self._daemonClient.close()
+        self._log.error('Lost the connection to the marksman daemon, continuing without it')
+        self._useLocalEngine()
+
+    def _useLocalEngine(self):
+        self._daemonClient = None
+        self._engine = MarksmanEngine(self._settings, self._log, self._onSearchUpdated)
 
-        with self._projectMap.readLock:
-            info = self._projectMap.value.get(rootPath)
-
-        if not info:
-            info = ProjectInfo()
-
-            with self._projectMap.writeLock:
-                self._projectMap.value[rootPath] = info
-
-            self._refreshQueue.put(rootPath)
-
-        return info
-
-    def _lookupMatchesSlice(self, projectInfo, requestId, offset, maxAmount, ignorePath):
-
-        with projectInfo.idMap.readLock:
-            fileList = projectInfo.idMap.value.get(requestId)
-
-        if not fileList:
-            return [], 0
-
-        with fileList.readLock:
-            return [x for x in fileList.value if x.path != ignorePath and os.path.exists(x.path)][offset:offset + maxAmount], len(fileList.value)
-
-    def _getFileChangeTime(self, fileInfo):
-        with self._lastOpenTimes.readLock:
-            lastOpenTime = self._lastOpenTimes.value.get(fileInfo.path)
-
-        with fileInfo.modificationTime.readLock:
-            if lastOpenTime:
-                if fileInfo.modificationTime.value:
-                    return max(lastOpenTime, fileInfo.modificationTime.value)
-                return lastOpenTime
-
-            return fileInfo.modificationTime.value
-
-    def _sortFileList(self, fileList):
-        fileList.sort(reverse=True, key=self._getFileChangeTime)
-
-    def _onBufEnterInternal(self, path):
-        assert self._hasInitialized
-
-        path = self._getCanonicalPath(path)
-        id = self._getFileNameHumps(os.path.basename(path))
-
-        with self._lastOpenTimes.writeLock:
-            self._lastOpenTimes.value[path] = datetime.now()
-
-        with self._projectMap.readLock:
-            projectInfos = [x for x in self._projectMap.value.values()]
-
-        for projInfo in projectInfos:
-            with projInfo.idMap.readLock:
-                fileList = projInfo.idMap.value.get(id)
-
-            if not fileList:
-                continue
+    def _getSettings(self):
+        # Minimize rpcs by just making one call
+        return self._nvim.call("marksman#evalAll", SettingNames, EvaluatedNames)
 
-            found = False
-            with fileList.readLock:
-                for fileInfo in fileList.value:
-                    if fileInfo.path == path:
-                        found = True
-                        break
+    def _onSearchUpdated(self, session, result):
+        # Called on a background thread, so hand it over to the main loop
+        self._nvim.async_call(self._pushSearchResult, self._toVimResult(result))
 
-            if found:
-                with fileList.writeLock:
-                    self._sortFileList(fileList.value)
+    def _pushSearchResult(self, result):
+        # Sent as a notification so that the UI never waits on us
+        self._nvim.call('marksman#onUpdate', result, async_=True)
 
     @pynvim.autocmd('BufEnter', pattern='*', eval='expand("<afile>")')
     def onBufEnter(self, path):
         if not self._hasInitialized:
             return
         try:
-            self._onBufEnterInternal(path)
+            self._callEngine('recordFileOpened', path)
         except Exception as e:
             self._log.exception(e)
 
-    def _convertToFileInfoDictionary(self, fileInfo):
-        return {'path': fileInfo.path, 'name': fileInfo.name}
-
-
-if __name__ == "__main__":
-    result = Marksman(None).updateSearch(['C:/Temp/test1', 'f', 0, 5])
-
-    print(result['totalCount'])
+    def _toVimResult(self, result):
+        result = dict(result)
+        result['matches'] = [self._toVimFileInfo(x) for x in result['matches']]
+        result['continuations'] = [self._toVimFileInfo(x) for x in result['continuations']]
+        return result
+
+    def _toVimFileInfo(self, fileInfo):
+        fileInfo = dict(fileInfo)
+        fileInfo['path'] = self._toVimString(fileInfo['path'])
+        fileInfo['name'] = self._toVimString(fileInfo['name'])
+        return fileInfo
+
+    def _toVimString(self, value):
+        # Paths that weren't valid in the encoding keep their original bytes as surrogates,
+        # which can't be sent as utf-8.  Vim takes raw bytes as a string all the same, so
+        # send those as they are and the path still refers to the same file
+        try:
+            value.encode('utf-8')
+            return value
+        except UnicodeEncodeError:
+            return value.encode('utf-8', 'surrogateescape')
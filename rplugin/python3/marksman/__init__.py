@@ -1 +1,7 @@
-from marksman.Marksman import Marksman
+
+try:
+    from marksman.Marksman import Marksman
+except ImportError as e:
+    # Only the plugin needs pynvim.  The engine and the command line work without it
+    if e.name != 'pynvim':
+        raise
@@ -0,0 +1,203 @@
+"""
+Runs the Marksman engine from the command line, without neovim.
+
+    python -m marksman build ROOT                 Scan ROOT and save its cache
+    python -m marksman query ROOT HUMPS           Print the best matches for HUMPS
+    python -m marksman bench ROOT                 Time queries for a sample of humps
+    python -m marksman daemon                     Serve the indexes to every neovim instance
+
+Run it from rplugin/python3, or with that directory on PYTHONPATH.  Settings use the
+same names as the vim variables, without the g:Mm_ prefix, eg.
+
+    python -m marksman --set ShowHidden=1 --set StatThreadCount=4 build ~/src/project
+
+The persistent cache is the same one neovim uses, so build can be used to warm it up
+"""
+
+import os
+import sys
+import ast
+import json
+import time
+import signal
+import argparse
+
+from marksman.engine.MarksmanEngine import MarksmanEngine
+from marksman.engine.Settings import createSettings
+from marksman.engine.QueryBenchmark import sampleQueries, measureQueries
+from marksman.daemon.DaemonProtocol import isDaemonSupported, getDefaultSocketPath
+from marksman.daemon.DaemonServer import DaemonServer
+from marksman.util.ConsoleLog import ConsoleLog
+
+def _parseSetting(value):
+    name, separator, rawValue = value.partition('=')
+
+    if not separator:
+        raise argparse.ArgumentTypeError(f'Expected NAME=VALUE but found "{value}"')
+
+    try:
+        parsedValue = ast.literal_eval(rawValue)
+    except (ValueError, SyntaxError):
+        # Plain strings don't need quotes
+        parsedValue = rawValue
+
+    return f'g:Mm_{name}', parsedValue
+
+def _createEngine(args):
+    overrides = {
+        # There is nothing to keep up to date once the command exits
+        'g:Mm_EnableFileWatcher': 0,
+        'g:Mm_EnableDebugLogging': 1 if args.debug else 0,
+    }
+
+    if args.search_types:
+        overrides['g:Mm_SearchPreferenceOrder'] = args.search_types
+
+    if args.cache_dir:
+        overrides['g:Mm_CacheDirectory'] = args.cache_dir
+
+    if args.no_cache:
+        overrides['g:Mm_EnablePersistentCache'] = 0
+
+    overrides.update(args.set or [])
+
+    log = ConsoleLog(args.debug)
+    return MarksmanEngine(createSettings(overrides), log), log
+
+def _waitForProject(engine, args):
+    # Without a timeout this still returns once the scan fails, since the engine logs
+    # the error and stops updating the project
+    if not engine.waitForProject(args.root, args.timeout):
+        raise RuntimeError(f'Could not scan "{args.root}", either it failed or it took longer than --timeout')
+
+def _build(engine, args):
+    startTime = time.time()
+    _waitForProject(engine, args)
+
+    stats = engine.getStats(args.root)[0]
+
+    if args.json:
+        return stats
+
+    print(f'Indexed {stats["fileCount"]} files in {time.time() - startTime:0.2f} seconds'
+        + (f' using "{stats["lastScan"]["searchType"]}"' if stats['lastScan'] else ' from the cache'))
+
+def _query(engine, args):
+    paths, totalCount = engine.getMatches(args.root, args.humps, args.offset, args.max, timeout=args.timeout)
+
+    if args.json:
+        return {'matchesCount': totalCount, 'matches': paths}
+
+    for path in paths:
+        print(path)
+
+def _bench(engine, args):
+    _waitForProject(engine, args)
+
+    queries = sampleQueries(engine.getIndex(args.root), args.samples, args.seed)
+    results = measureQueries(engine, args.root, queries, args.max, args.rounds)
+    results['stats'] = engine.getStats(args.root)[0]
+
+    if args.json:
+        return results
+
+    lastScan = results['stats']['lastScan']
+
+    if lastScan:
+        print(f'Scan: {lastScan["totalSeconds"]:0.2f} seconds for {lastScan["scannedCount"]} files using "{lastScan["searchType"]}" ('
+            + ', '.join(f'{x} {y:0.2f}s' for x, y in lastScan['phaseSeconds'].items()) + ')')
+
+    if results['queryCount']:
+        print(f'Queries: {results["queryCount"]}, p50 {results["p50Ms"]:0.3f} ms, p99 {results["p99Ms"]:0.3f} ms, '
+            f'max {results["maxMs"]:0.3f} ms')
+    else:
+        print('Queries: nothing to search for')
+
+def _runDaemon(args):
+    if not isDaemonSupported():
+        raise RuntimeError('Unix domain sockets are not supported on this platform')
+
+    log = ConsoleLog(args.debug)
+    socketPath = args.socket or getDefaultSocketPath()
+    server = DaemonServer(socketPath, log, args.idle_timeout)
+
+    try:
+        if not server.start():
+            log.error(f'Another daemon is already serving "{socketPath}"')
+            return 1
+    except PermissionError as e:
+        log.error(f'Refusing to use "{socketPath}": {e}')
+        return 1
+
+    signal.signal(signal.SIGTERM, lambda *_: server.stop())
+    log.info(f'Serving "{socketPath}"')
+
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m marksman', description='Build and query Marksman indexes without neovim')
+    parser.add_argument('--search-types', type=lambda x: x.split(','), metavar='TYPE,...',
+        help='Search types to try, in order.  Defaults to g:Mm_SearchPreferenceOrder')
+    parser.add_argument('--cache-dir', help='Where to keep the persistent cache.  Defaults to the one neovim uses')
+    parser.add_argument('--no-cache', action='store_true', help='Neither load nor save the persistent cache')
+    parser.add_argument('--set', type=_parseSetting, action='append', metavar='NAME=VALUE',
+        help='Any other setting, by the name of its vim variable without the g:Mm_ prefix')
+    parser.add_argument('--timeout', type=float, help='Give up after this many seconds of scanning')
+    parser.add_argument('--json', action='store_true', help='Print the results as json')
+    parser.add_argument('--debug', action='store_true', help='Log what the engine is doing')
+
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    buildParser = commands.add_parser('build', help='Scan a project and save its cache')
+    buildParser.add_argument('root')
+    buildParser.set_defaults(run=_build)
+
+    queryParser = commands.add_parser('query', help='Print the best matches for some humps')
+    queryParser.add_argument('root')
+    queryParser.add_argument('humps')
+    queryParser.add_argument('--offset', type=int, default=0)
+    queryParser.add_argument('--max', type=int, default=20)
+    queryParser.set_defaults(run=_query)
+
+    benchParser = commands.add_parser('bench', help='Time queries for a sample of the humps in a project')
+    benchParser.add_argument('root')
+    benchParser.add_argument('--samples', type=int, default=200, help='Number of distinct humps to search for, with all of their prefixes')
+    benchParser.add_argument('--rounds', type=int, default=1, help='Number of times to run every query')
+    benchParser.add_argument('--max', type=int, default=20, help='Number of results per query')
+    benchParser.add_argument('--seed', type=int, default=0)
+    benchParser.set_defaults(run=_bench)
+
+    daemonParser = commands.add_parser('daemon', help='Serve the indexes to every neovim instance with g:Mm_UseDaemon set')
+    daemonParser.add_argument('--socket', help='Path of the unix domain socket.  Defaults to the one neovim uses')
+    daemonParser.add_argument('--idle-timeout', type=float, help='Stop once there have been no clients for this many seconds')
+
+    args = parser.parse_args()
+
+    if args.command == 'daemon':
+        return _runDaemon(args)
+
+    if not os.path.isdir(args.root):
+        parser.error(f'Could not find directory "{args.root}"')
+
+    engine, log = _createEngine(args)
+
+    try:
+        result = args.run(engine, args)
+    except RuntimeError as e:
+        log.error(str(e))
+        return 1
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+    return 1 if log.errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+
+import os
+import sys
+import time
+import socket
+import threading
+import subprocess
+from queue import Queue
+
+from marksman.daemon.DaemonProtocol import (
+    ProtocolVersion, isDaemonSupported, getDefaultSocketPath, prepareSocketDirectory, checkSocketOwner,
+    sendMessage, receiveMessage)
+
+# How long to wait for a daemon that we started to accept connections
+StartupTimeout = 3.0
+# Daemons that we start stop on their own once nobody has used them for this long
+SpawnedIdleTimeout = 30 * 60
+
+_pythonDir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class DaemonError(Exception):
+    pass
+
+class DaemonClient:
+    """
+    Has the same methods as MarksmanEngine, but forwards them to a shared daemon (see
+    DaemonServer).  Once the connection is lost isConnected turns False and every
+    call raises ConnectionError, so that the caller can fall back to its own engine
+    """
+    def __init__(self, sock, settings, onSearchUpdated):
+        self._socket = sock
+        self._onSearchUpdated = onSearchUpdated
+        # Only one request is in flight at a time, so responses come back in order
+        self._callLock = threading.Lock()
+        self._responses = Queue()
+        self._nextRequestNumber = 1
+        self.isConnected = True
+
+        # Before the reader starts, so that nothing else can arrive first
+        sendMessage(self._socket, [self._nextRequestNumber, 'hello', [ProtocolVersion, settings]])
+        self._nextRequestNumber += 1
+        self.daemonPid = self._readResponse(receiveMessage(self._socket))
+
+        readerThread = threading.Thread(target=self._readerThread)
+        # die when the main thread dies
+        readerThread.daemon = True
+        readerThread.start()
+
+    def _readResponse(self, message):
+        if message is None:
+            raise ConnectionError('Lost connection to the marksman daemon')
+
+        responseType, _, value = message
+
+        if responseType == 'e':
+            raise DaemonError(value)
+
+        return value
+
+    def _readerThread(self):
+        try:
+            while True:
+                message = receiveMessage(self._socket)
+
+                if message is None:
+                    break
+
+                if message[0] == 'u':
+                    if self._onSearchUpdated:
+                        self._onSearchUpdated(None, message[1])
+                else:
+                    self._responses.put(message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.isConnected = False
+            # Wakes up whoever is waiting on a response
+            self._responses.put(None)
+
+    def _call(self, method, *args):
+        with self._callLock:
+            if not self.isConnected:
+                raise ConnectionError('Lost connection to the marksman daemon')
+
+            requestNumber = self._nextRequestNumber
+            self._nextRequestNumber += 1
+            sendMessage(self._socket, [requestNumber, method, args])
+            return self._readResponse(self._responses.get())
+
+    def _notify(self, method, *args):
+        """ Like _call, but doesn't wait for the daemon to finish """
+        with self._callLock:
+            if not self.isConnected:
+                raise ConnectionError('Lost connection to the marksman daemon')
+
+            sendMessage(self._socket, [0, method, args])
+
+    def close(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self._socket.close()
+
+    def _toAbsolutePath(self, path):
+        # The daemon has a working directory of its own, so relative paths (and the
+        # empty root path, which means the current directory) are resolved here, the
+        # same way that a local engine would resolve them
+        return None if path is None else os.path.abspath(path)
+
+    def forceRefresh(self, rootPath):
+        self._notify('forceRefresh', self._toAbsolutePath(rootPath))
+
+    def getMatches(self, rootPath, id, offset, maxAmount, ignorePath=None):
+        paths, totalCount = self._call(
+            'getMatches', self._toAbsolutePath(rootPath), id, offset, maxAmount, self._toAbsolutePath(ignorePath))
+        return paths, totalCount
+
+    def profileSearchMethods(self, dirPath):
+        return self._call('profileSearchMethods', self._toAbsolutePath(dirPath))
+
+    def lookupByFileName(self, rootPath, fileName):
+        return self._call('lookupByFileName', self._toAbsolutePath(rootPath), fileName)
+
+    def updateSearch(self, rootPath, requestId, offset, maxAmount, ignorePath=None):
+        return self._call(
+            'updateSearch', self._toAbsolutePath(rootPath), requestId, offset, maxAmount, self._toAbsolutePath(ignorePath))
+
+    def getStats(self, rootPath=None):
+        return self._call('getStats', self._toAbsolutePath(rootPath))
+
+    def endSearch(self):
+        self._notify('endSearch')
+
+    def recordFileOpened(self, path):
+        self._notify('recordFileOpened', self._toAbsolutePath(path))
+
+def _tryConnectSocket(socketPath):
+    # Raises PermissionError if someone else put something there
+    if not checkSocketOwner(socketPath):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(socketPath)
+    except OSError:
+        sock.close()
+        return None
+
+    return sock
+
+def _startDaemon(socketPath):
+    # Its own session, so that it outlives this neovim and isn't sent its signals
+    subprocess.Popen(
+        [sys.executable, '-m', 'marksman', 'daemon', '--socket', socketPath, '--idle-timeout', str(SpawnedIdleTimeout)],
+        cwd=_pythonDir, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+
+def tryConnectToDaemon(settings, onSearchUpdated, log):
+    """
+    Returns a DaemonClient for the daemon at g:Mm_DaemonSocketPath, starting one first
+    if nothing is listening there.  Returns None if that doesn't work out, in which
+    case the caller should just use its own engine
+    """
+    if not isDaemonSupported():
+        log.queueDebug('Unix domain sockets are not supported here, not using the daemon')
+        return None
+
+    socketPath = settings['g:Mm_DaemonSocketPath'] or getDefaultSocketPath()
+
+    try:
+        prepareSocketDirectory(socketPath)
+        sock = _tryConnectSocket(socketPath)
+    except PermissionError as e:
+        log.queueError(f'Not using the marksman daemon at "{socketPath}": {e}')
+        return None
+    except OSError as e:
+        log.queueDebug(f'Could not use the directory of "{socketPath}": {e}')
+        return None
+
+    if not sock:
+        try:
+            _startDaemon(socketPath)
+        except OSError as e:
+            log.queueDebug(f'Could not start the marksman daemon: {e}')
+            return None
+
+        startTime = time.time()
+
+        while not sock and time.time() - startTime < StartupTimeout:
+            time.sleep(0.05)
+
+            try:
+                sock = _tryConnectSocket(socketPath)
+            except PermissionError as e:
+                log.queueError(f'Not using the marksman daemon at "{socketPath}": {e}')
+                return None
+
+        if not sock:
+            log.queueDebug(f'Timed out waiting for the marksman daemon at "{socketPath}"')
+            return None
+
+    try:
+        client = DaemonClient(sock, settings, onSearchUpdated)
+    except (OSError, ValueError, DaemonError) as e:
+        # Eg. a daemon from an older version that is still running
+        log.queueDebug(f'Could not use the marksman daemon at "{socketPath}": {e}')
+        sock.close()
+        return None
+
+    log.queueDebug(f'Using the marksman daemon at "{socketPath}" (pid {client.daemonPid})')
+    return client
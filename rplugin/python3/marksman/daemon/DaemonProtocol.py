@@ -0,0 +1,295 @@
+
+import os
+import stat
+import socket
+import struct
+import tempfile
+
+# Bump this whenever the messages below change, so that an old daemon is never used
+ProtocolVersion = 1
+# Anything bigger than this is a corrupt or hostile message
+MaxMessageSize = 256 * 1024 * 1024
+
+# Every message is a 4 byte length followed by one value.  Values start with a one
+# byte tag:
+#
+#   N          None
+#   T / F      True / False
+#   i          int64
+#   d          float64
+#   s / b      uint32 length, then utf-8 (with surrogateescape) or raw bytes
+#   l          uint32 count, then that many values
+#   m          uint32 count, then that many key and value pairs
+#
+# Client messages are [requestNumber, method, args].  A requestNumber of 0 means
+# that no response is wanted.  The daemon answers with ['r', requestNumber, result]
+# or ['e', requestNumber, errorMessage], and pushes ['u', searchResult] whenever the
+# active search of the client changes
+_header = struct.Struct('>I')
+_int = struct.Struct('>q')
+_float = struct.Struct('>d')
+_count = struct.Struct('>I')
+
+def isDaemonSupported():
+    return hasattr(socket, 'AF_UNIX')
+
+def getDefaultSocketPath():
+    runtimeDir = os.environ.get('XDG_RUNTIME_DIR')
+
+    if runtimeDir:
+        return os.path.join(runtimeDir, 'marksman', 'marksman.sock')
+
+    # Shared between users, so keep them apart
+    return os.path.join(tempfile.gettempdir(), f'marksman-{os.getuid()}', 'marksman.sock')
+
+def prepareSocketDirectory(socketPath):
+    """
+    Creates the directory of socketPath if needed, and raises PermissionError unless
+    only the current user can get at it.  Otherwise anyone could put a socket there
+    first and receive every query, or connect to the daemon and read the indexes
+    """
+    dirPath = os.path.dirname(os.path.abspath(socketPath))
+
+    try:
+        os.mkdir(dirPath, 0o700)
+    except FileExistsError:
+        pass
+
+    # lstat, so that a link to a directory of someone else doesn't count
+    info = os.lstat(dirPath)
+
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f'"{dirPath}" is not a directory')
+
+    if info.st_uid != os.getuid():
+        raise PermissionError(f'"{dirPath}" is owned by another user')
+
+    if info.st_mode & 0o077:
+        raise PermissionError(f'"{dirPath}" can be accessed by other users, it needs to be mode 0700')
+
+def checkSocketOwner(socketPath):
+    """ Returns False if nothing is at socketPath, and raises PermissionError if it isn't our own socket """
+    try:
+        info = os.lstat(socketPath)
+    except FileNotFoundError:
+        return False
+
+    if not stat.S_ISSOCK(info.st_mode):
+        raise PermissionError(f'"{socketPath}" is not a socket')
+
+    if info.st_uid != os.getuid():
+        raise PermissionError(f'"{socketPath}" is owned by another user')
+
+    return True
+
+def _encodeValue(value, parts):
+    # bool first, since it is also an int
+    if value is None:
+        parts.append(b'N')
+    elif value is True:
+        parts.append(b'T')
+    elif value is False:
+        parts.append(b'F')
+    elif isinstance(value, int):
+        parts.append(b'i')
+        parts.append(_int.pack(value))
+    elif isinstance(value, float):
+        parts.append(b'd')
+        parts.append(_float.pack(value))
+    elif isinstance(value, str):
+        # Paths that weren't valid utf-8 keep their original bytes as surrogates
+        data = value.encode('utf-8', 'surrogateescape')
+        parts.append(b's')
+        parts.append(_count.pack(len(data)))
+        parts.append(data)
+    elif isinstance(value, bytes):
+        parts.append(b'b')
+        parts.append(_count.pack(len(value)))
+        parts.append(value)
+    elif isinstance(value, (list, tuple)):
+        parts.append(b'l')
+        parts.append(_count.pack(len(value)))
+
+        for item in value:
+            _encodeValue(item, parts)
+    elif isinstance(value, dict):
+        parts.append(b'm')
+        parts.append(_count.pack(len(value)))
+
+        for key, item in value.items():
+            _encodeValue(key, parts)
+            _encodeValue(item, parts)
+    else:
+        raise ValueError(f'Can not send values of type {type(value).__name__}')
+
+def encodeMessage(value):
+    parts = []
+    _encodeValue(value, parts)
+    body = b''.join(parts)
+    return _header.pack(len(body)) + body
+
+def _decodeValue(data, offset):
+    """ Returns (value, offset past the value) """
+    tag = data[offset:offset + 1]
+    offset += 1
+
+    if tag == b'N':
+        return None, offset
+
+    if tag == b'T':
+        return True, offset
+
+    if tag == b'F':
+        return False, offset
+
+    if tag == b'i':
+        return _int.unpack_from(data, offset)[0], offset + _int.size
+
+    if tag == b'd':
+        return _float.unpack_from(data, offset)[0], offset + _float.size
+
+    if tag in (b's', b'b'):
+        length = _count.unpack_from(data, offset)[0]
+        offset += _count.size
+        value = bytes(data[offset:offset + length])
+
+        if len(value) != length:
+            raise ValueError('Truncated message')
+
+        if tag == b's':
+            value = value.decode('utf-8', 'surrogateescape')
+
+        return value, offset + length
+
+    if tag == b'l':
+        count = _count.unpack_from(data, offset)[0]
+        offset += _count.size
+        result = []
+
+        for _ in range(count):
+            item, offset = _decodeValue(data, offset)
+            result.append(item)
+
+        return result, offset
+
+    if tag == b'm':
+        count = _count.unpack_from(data, offset)[0]
+        offset += _count.size
+        result = {}
+
+        for _ in range(count):
+            key, offset = _decodeValue(data, offset)
+            result[key], offset = _decodeValue(data, offset)
+
+        return result, offset
+
+    raise ValueError(f'Unexpected tag {tag!r} in message')
+
+def decodeMessage(body):
+    value, offset = _decodeValue(memoryview(body), 0)
+
+    if offset != len(body):
+        raise ValueError('Unexpected data at the end of message')
+
+    return value
+
+def _receiveExactly(sock, size):
+    data = bytearray()
+
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1024 * 1024))
+
+        if not chunk:
+            return None
+
+        data.extend(chunk)
+
+    return data
+
+def sendMessage(sock, value):
+    sock.sendall(encodeMessage(value))
+
+def receiveMessage(sock):
+    """ Blocks until a whole message arrives.  Returns None once the other side has closed the connection """
+    header = _receiveExactly(sock, _header.size)
+
+    if header is None:
+        return None
+
+    size = _header.unpack(header)[0]
+
+    if size > MaxMessageSize:
+        raise ValueError(f'Message of {size} bytes is too large')
+
+    body = _receiveExactly(sock, size)
+
+    if body is None:
+        raise ConnectionError('Connection closed in the middle of a message')
+
+    return decodeMessage(body)
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    value = {
+        'requestId': 'fb', 'offset': 0, 'isUpdating': False, 'scannedCount': -1, 'mtime': 1.5,
+        'matches': [{'path': '/a/Caf\udce9Bar.txt', 'name': 'Caf\udce9Bar.txt'}], 'raw': b'\x00\xff',
+        'nested': [[], {}, None, True],
+    }
+
+    message = encodeMessage(value)
+    assertIsEqual(_header.unpack_from(message)[0], len(message) - _header.size)
+    assertIsEqual(decodeMessage(message[_header.size:]), value)
+    # Tuples come back as lists
+    assertIsEqual(decodeMessage(encodeMessage((1, 'a'))[_header.size:]), [1, 'a'])
+
+    try:
+        decodeMessage(encodeMessage('abc')[_header.size:-1])
+        assert False, 'Expected truncated message to fail'
+    except ValueError:
+        pass
+
+    if isDaemonSupported():
+        left, right = socket.socketpair()
+        sendMessage(left, value)
+        assertIsEqual(receiveMessage(right), value)
+        left.close()
+        assertIsEqual(receiveMessage(right), None)
+        right.close()
+
+        socketDir = os.path.join(tempfile.mkdtemp(), 'marksman')
+        socketPath = os.path.join(socketDir, 'marksman.sock')
+        prepareSocketDirectory(socketPath)
+        assertIsEqual(stat.S_IMODE(os.stat(socketDir).st_mode), 0o700)
+        assertIsEqual(checkSocketOwner(socketPath), False)
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(socketPath)
+        assertIsEqual(checkSocketOwner(socketPath), True)
+        listener.close()
+        os.unlink(socketPath)
+
+        with open(socketPath, 'w'):
+            pass
+
+        try:
+            checkSocketOwner(socketPath)
+            assert False, 'Expected a plain file to be refused'
+        except PermissionError:
+            pass
+
+        os.unlink(socketPath)
+        os.chmod(socketDir, 0o755)
+
+        try:
+            prepareSocketDirectory(socketPath)
+            assert False, 'Expected a directory that others can read to be refused'
+        except PermissionError:
+            pass
+
+        os.rmdir(socketDir)
+
+    print("Tests passed")
@@ -0,0 +1,257 @@
+
+import os
+import json
+import time
+import socket
+import threading
+
+from marksman.engine.MarksmanEngine import MarksmanEngine
+from marksman.daemon.DaemonProtocol import ProtocolVersion, prepareSocketDirectory, checkSocketOwner, sendMessage, receiveMessage
+from marksman.util.LockableValue import LockableValue
+
+# Everything a client can call, all of which are MarksmanEngine methods
+RemoteMethods = {
+    'forceRefresh', 'getMatches', 'lookupByFileName', 'updateSearch', 'endSearch',
+    'getStats', 'recordFileOpened', 'profileSearchMethods',
+}
+# These take the client as the session, so that every client has its own active search
+SessionMethods = {'updateSearch', 'endSearch'}
+# How often the accept loop checks whether it should stop
+AcceptTimeout = 1.0
+# Engines that no client has used for this long are stopped, unless the daemon has an
+# idle timeout of its own, which is used instead
+EngineIdleTimeout = 30 * 60
+
+class SharedEngine:
+    """ An engine and the number of clients using it, guarded by DaemonServer._engines.lock """
+    def __init__(self, engine):
+        self.engine = engine
+        self.clientCount = 0
+        self.lastDisconnectTime = time.time()
+
+class ClientConnection:
+    def __init__(self, sock):
+        self.socket = sock
+        # Held while writing, since search updates are pushed from the engine's thread
+        self.writeLock = threading.Lock()
+        self.sharedEngine = None
+        self.engine = None
+
+    def send(self, value):
+        with self.writeLock:
+            sendMessage(self.socket, value)
+
+    def pushSearchResult(self, result):
+        try:
+            self.send(['u', result])
+        except OSError:
+            # The client went away, which its own thread notices and cleans up after
+            pass
+
+class DaemonServer:
+    """
+    Serves MarksmanEngine over a unix domain socket, so that every neovim instance on
+    the machine can share the same project indexes instead of each building its own.
+
+    Clients send the settings they would have used in process when they connect.  The
+    engines are shared between clients with the same settings, and clients with
+    different ones get separate engines, so results never depend on who scanned first
+    """
+    def __init__(self, socketPath, log, idleTimeout=None):
+        self._socketPath = socketPath
+        self._log = log
+        # Stop once there have been no clients for this many seconds, or never if None
+        self._idleTimeout = idleTimeout
+        # Settings as json -> SharedEngine
+        self._engines = LockableValue({})
+        self._clientCount = LockableValue(0)
+        self._lastDisconnectTime = time.time()
+        self._isStopped = threading.Event()
+        self._socket = None
+
+    def _isAlreadyRunning(self):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            probe.connect(self._socketPath)
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+
+    def start(self):
+        """
+        Returns False if another daemon is already serving the socket.  Raises
+        PermissionError if the socket or its directory could be used by other users
+        """
+        prepareSocketDirectory(self._socketPath)
+
+        if checkSocketOwner(self._socketPath):
+            if self._isAlreadyRunning():
+                return False
+
+            # Left behind by a daemon that didn't shut down cleanly
+            os.unlink(self._socketPath)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Only the current user can connect, even if the directory is opened up later
+        oldMask = os.umask(0o177)
+        try:
+            self._socket.bind(self._socketPath)
+        finally:
+            os.umask(oldMask)
+
+        self._socket.listen()
+        self._socket.settimeout(AcceptTimeout)
+        return True
+
+    def serveForever(self):
+        try:
+            while not self._isStopped.is_set():
+                try:
+                    clientSocket, _ = self._socket.accept()
+                except socket.timeout:
+                    if self._hasBeenIdleTooLong():
+                        self._log.info('No clients left, stopping')
+                        break
+
+                    self._stopIdleEngines()
+                    continue
+
+                # Accepted sockets inherit the timeout on some platforms
+                clientSocket.settimeout(None)
+
+                with self._clientCount.lock:
+                    self._clientCount.value += 1
+
+                clientThread = threading.Thread(target=self._clientThread, args=(ClientConnection(clientSocket),))
+                # die when the main thread dies
+                clientThread.daemon = True
+                clientThread.start()
+        finally:
+            self._socket.close()
+
+            try:
+                os.unlink(self._socketPath)
+            except OSError:
+                pass
+
+    def stop(self):
+        self._isStopped.set()
+
+    def _hasBeenIdleTooLong(self):
+        if self._idleTimeout is None:
+            return False
+
+        with self._clientCount.lock:
+            return self._clientCount.value == 0 and time.time() - self._lastDisconnectTime > self._idleTimeout
+
+    def _acquireEngine(self, settings):
+        """ Returns the SharedEngine for settings, counting the caller as one of its clients """
+        key = json.dumps(settings, sort_keys=True)
+
+        with self._engines.lock:
+            sharedEngine = self._engines.value.get(key)
+
+            if not sharedEngine:
+                sharedEngine = SharedEngine(MarksmanEngine(settings, self._log, self._onSearchUpdated))
+                self._engines.value[key] = sharedEngine
+                self._log.debug(f'Created engine number {len(self._engines.value)}')
+
+            sharedEngine.clientCount += 1
+            return sharedEngine
+
+    def _releaseEngine(self, sharedEngine):
+        with self._engines.lock:
+            sharedEngine.clientCount -= 1
+            sharedEngine.lastDisconnectTime = time.time()
+
+    def _stopIdleEngines(self):
+        # Otherwise every combination of settings that ever connected would keep its
+        # indexes in memory for as long as the daemon runs
+        idleTimeout = EngineIdleTimeout if self._idleTimeout is None else self._idleTimeout
+        stoppedEngines = []
+
+        with self._engines.lock:
+            for key, sharedEngine in list(self._engines.value.items()):
+                if sharedEngine.clientCount == 0 and time.time() - sharedEngine.lastDisconnectTime > idleTimeout:
+                    del self._engines.value[key]
+                    stoppedEngines.append(sharedEngine.engine)
+
+            remainingCount = len(self._engines.value)
+
+        # Outside the lock, since this waits on the file watchers
+        for engine in stoppedEngines:
+            engine.shutdown()
+
+        if stoppedEngines:
+            self._log.debug(f'Stopped {len(stoppedEngines)} engines that had no clients, {remainingCount} left')
+
+    def _onSearchUpdated(self, session, result):
+        session.pushSearchResult(result)
+
+    def _clientThread(self, connection):
+        try:
+            self._clientThreadInternal(connection)
+        except Exception as e:
+            self._log.queueException(e)
+        finally:
+            if connection.engine:
+                connection.engine.endSearch(session=connection)
+                self._releaseEngine(connection.sharedEngine)
+
+            connection.socket.close()
+
+            with self._clientCount.lock:
+                self._clientCount.value -= 1
+                self._lastDisconnectTime = time.time()
+
+    def _clientThreadInternal(self, connection):
+        hello = receiveMessage(connection.socket)
+
+        if hello is None:
+            return
+
+        requestNumber, method, args = hello
+
+        if method != 'hello' or args[0] != ProtocolVersion:
+            connection.send(['e', requestNumber, f'Expected protocol version {ProtocolVersion}'])
+            return
+
+        connection.sharedEngine = self._acquireEngine(args[1])
+        connection.engine = connection.sharedEngine.engine
+        connection.send(['r', requestNumber, os.getpid()])
+
+        while True:
+            message = receiveMessage(connection.socket)
+
+            if message is None:
+                return
+
+            requestNumber, method, args = message
+
+            try:
+                result = self._handleRequest(connection, method, args)
+            except Exception as e:
+                if requestNumber == 0:
+                    self._log.queueException(e)
+                else:
+                    connection.send(['e', requestNumber, f'{type(e).__name__}: {e}'])
+
+                continue
+
+            if requestNumber != 0:
+                connection.send(['r', requestNumber, result])
+
+    def _handleRequest(self, connection, method, args):
+        if method not in RemoteMethods:
+            raise ValueError(f'Unknown method "{method}"')
+
+        func = getattr(connection.engine, method)
+
+        if method in SessionMethods:
+            return func(*args, session=connection)
+
+        return func(*args)
@@ -0,0 +1,2 @@
+from marksman.daemon.DaemonServer import DaemonServer
+from marksman.daemon.DaemonClient import DaemonClient, tryConnectToDaemon
@@ -0,0 +1,1630 @@
+
+import os
+import stat
+from marksman.util.StringHumpsFinder import getFileNameHumps
+from marksman.util.AsyncCommandExecutor import AsyncCommandExecutor
+from marksman.util.ParallelCommandExecutor import ParallelCommandExecutor
+from marksman.util.DirectoryWalker import DirectoryWalker
+from marksman.util.SearchExternalCommandBuilder import SearchExternalCommandBuilder, SearchTypes as ExternalSearchTypes
+from marksman.util.LockableValue import LockableValue
+from marksman.util.ReadWriteLockableValue import ReadWriteLockableValue
+from marksman.util.ProjectCache import ProjectCache, ProjectCacheData
+from marksman.util.FileWatcher import createFileWatcher, FileChangeTypes
+from marksman.util.ProjectIndex import ProjectIndex, ProjectIndexBuilder
+from marksman.util.ExistenceCache import ExistenceCache
+from marksman.util.ModificationTimeCollector import ModificationTimeCollector
+from marksman.util.PathIngester import PathIngester, BatchedScanResult, iterateBatches, splitRecords, parseModificationTimeRecords, IngestBatchSize
+from marksman.util.GitIndexReader import readGitIndex
+from marksman.util.RefreshScheduler import RefreshScheduler
+from marksman.util.SearchTypeBenchmarks import SearchTypeBenchmarks, SearchTypeBenchmark
+from marksman.util.FileTable import FileTable
+from marksman.util.ProjectStats import ProjectStats, ScanMetrics
+from datetime import datetime
+import threading
+from queue import Queue
+import subprocess
+import itertools
+import time
+from array import array
+
+SearchTypes = ExternalSearchTypes + ["python", "custom", "gitindex"]
+WaitingForSearchTimeout = 5.0
+# How long to let file system events accumulate before applying them
+FileChangeBatchDelay = 0.1
+# Past this many file changes during a scan, the project is just scanned again after it
+MaxDeferredFileChanges = 10000
+# How often partial results are published while a project is scanned for the first time
+SnapshotPublishInterval = 0.25
+# How long to trust that a listed file exists, or is missing, before checking again
+ExistenceTimeToLive = 2.0
+MissingFileTimeToLive = 30.0
+# Each search type is timed this many times when benchmarking, keeping the fastest, so
+# that whichever runs first isn't penalized for a cold disk cache
+BenchmarkRounds = 2
+# Search types that list hidden files whatever g:Mm_ShowHidden is set to
+HiddenFileSearchTypes = {'git', 'gitindex', 'python'}
+# Search types that leave out the files that .gitignore rules match
+GitIgnoreSearchTypes = {'git', 'gitindex', 'rg', 'ag', 'pt'}
+
+class ProjectInfo:
+    def __init__(self, rootPath):
+        self.rootPath = rootPath
+        # Immutable snapshot that is replaced as a whole, so readers just grab
+        # the reference and never need to lock
+        self.index = ProjectIndex()
+        # Held by anything that publishes a new index
+        self.writeLock = threading.Lock()
+        self.isUpdating = LockableValue(True)
+        # True once there is a complete index to serve, either from the on-disk cache
+        # or from a finished scan.  After that, rescans only publish once complete
+        self.hasResults = False
+        self.fileWatcher = None
+        # Number of files the current scan has listed so far
+        self.scannedCount = 0
+        # Bumped to cancel the running scan.  Scans check it between batches and
+        # throw away their results if it changed
+        self.generation = 0
+        # New projects are queued for their first scan right away
+        self.isRefreshQueued = True
+        # Executor of the external scanner (or the directory walker), so that it can be
+        # killed on cancel
+        self.scanExecutor = None
+        self.stats = ProjectStats()
+        # True if the last scan that wasn't cancelled raised instead of finishing
+        self.lastScanFailed = False
+        # (changeType, path) from the file watcher while a scan is running, which the scan
+        # might have missed if it already passed the directory.  Guarded by isUpdating.lock
+        self.deferredFileChanges = []
+        # Paths that searches found missing and queued for removal, so that every redraw
+        # doesn't queue them again until the watcher thread gets to them
+        self.queuedRemovals = LockableValue(set())
+        # With g:Mm_LazyModificationTimes, the ids of the buckets that still have files
+        # without a modification time, plus '' until the bucket with every file has been
+        # sorted.  Replaced along with the index, under writeLock
+        self.unresolvedIds = set()
+        # Path -> open time of the files opened while a scan runs, which the scan applies
+        # to its builder before each publish.  None when nothing is scanning.  Guarded by
+        # writeLock
+        self.filesOpenedDuringScan = None
+        # The file table of the running scan's builder, once a snapshot that uses it has
+        # been published.  recordFileOpened leaves that one to the scan, since only one
+        # builder should be editing a file table at a time.  Guarded by writeLock
+        self.scanFileTable = None
+
+class ActiveSearch:
+    """ The search that is currently shown by marksman#run, which gets pushed updates """
+    def __init__(self, projectInfo, requestId, offset, maxAmount, ignorePath):
+        self.projectInfo = projectInfo
+        self.requestId = requestId
+        self.offset = offset
+        self.maxAmount = maxAmount
+        self.ignorePath = ignorePath
+        self.lastResult = None
+        # Taken before the first result is built, so that nothing in between is missed
+        self.lastState = self._getState()
+
+    def _getState(self):
+        # Cheap to check, and the result can only change when one of these does
+        projectInfo = self.projectInfo
+        return (projectInfo.index.version, projectInfo.isUpdating.getValue(), projectInfo.scannedCount)
+
+    def hasChanged(self):
+        state = self._getState()
+
+        if state == self.lastState:
+            return False
+
+        self.lastState = state
+        return True
+
+class MarksmanEngine(object):
+    """
+    Keeps an index of the files in each project root and answers queries against it,
+    without depending on neovim.  settings is a plain dict with the same names as
+    the vim variables (see marksman.engine.Settings.createSettings), log is a Log or
+    ConsoleLog, and onSearchUpdated(session, result) is called on a background
+    thread with the new result of a session's active search (see updateSearch)
+    whenever it changes
+    """
+    def __init__(self, settings, log, onSearchUpdated=None):
+        self._settings = settings
+        self._log = log
+        self._onSearchUpdated = onSearchUpdated
+        # Canonical path -> seconds since epoch, so that open times survive a rescan
+        self._lastOpenTimes = ReadWriteLockableValue({})
+        self._refreshScheduler = RefreshScheduler()
+        self._projectMap = ReadWriteLockableValue({})
+        # Root path -> lock held while that project is created, so that the threads that
+        # ask for a new project at the same time all get the same one.  One per project
+        # so that loading a large cache doesn't hold up creating the others
+        self._projectCreationLocks = LockableValue({})
+        self._searchCommandBuilder = SearchExternalCommandBuilder(self._settings)
+
+        if self._settings['g:Mm_EnablePersistentCache']:
+            self._projectCache = ProjectCache(self._settings['g:Mm_CacheDirectory'])
+        else:
+            self._projectCache = None
+
+        if self._settings['g:Mm_EnablePersistentCache']:
+            self._searchTypeBenchmarks = SearchTypeBenchmarks(self._settings['g:Mm_CacheDirectory'])
+        else:
+            self._searchTypeBenchmarks = SearchTypeBenchmarks(None)
+
+        self._benchmarkQueue = Queue()
+        self._queuedBenchmarks = LockableValue(set())
+        # Root paths whose files all need their modification times looked up, for
+        # g:Mm_LazyModificationTimes
+        self._resolveQueue = Queue()
+        self._queuedResolves = LockableValue(set())
+        self._fileChangeQueue = Queue()
+        self._existenceCache = ExistenceCache(ExistenceTimeToLive, MissingFileTimeToLive)
+        # Session -> ActiveSearch.  Each client that shows a search is a session
+        self._activeSearches = LockableValue({})
+        # Set whenever a project publishes a new index or starts or stops updating
+        self._projectChangedEvent = threading.Event()
+        self._isShutDown = threading.Event()
+
+        if self._settings['g:Mm_EnableFileWatcher']:
+            fileWatcherThread = threading.Thread(target=self._fileWatcherThread)
+            # die when the main thread dies
+            fileWatcherThread.daemon = True
+            fileWatcherThread.start()
+
+        for _ in range(max(1, self._settings['g:Mm_ScanThreadCount'])):
+            searchThread = threading.Thread(target=self._searchThread)
+            # die when the main thread dies
+            searchThread.daemon = True
+            searchThread.start()
+
+        if self._settings['g:Mm_AutoSelectSearchType']:
+            benchmarkThread = threading.Thread(target=self._benchmarkThread)
+            # die when the main thread dies
+            benchmarkThread.daemon = True
+            benchmarkThread.start()
+
+        if self._settings['g:Mm_LazyModificationTimes']:
+            resolveThread = threading.Thread(target=self._resolveThread)
+            # die when the main thread dies
+            resolveThread.daemon = True
+            resolveThread.start()
+
+        searchNotifierThread = threading.Thread(target=self._searchNotifierThread)
+        # die when the main thread dies
+        searchNotifierThread.daemon = True
+        searchNotifierThread.start()
+
+    def shutdown(self):
+        """
+        Stops the threads and file watchers of the engine and forgets every project, so
+        that an engine that is no longer used can be freed (see DaemonServer).  Nothing
+        else should be called on it afterwards
+        """
+        self._isShutDown.set()
+
+        with self._projectMap.writeLock:
+            projectInfos = list(self._projectMap.value.values())
+            self._projectMap.value = {}
+
+        for projectInfo in projectInfos:
+            with projectInfo.isUpdating.lock:
+                # Makes the running scan throw away its results
+                projectInfo.generation += 1
+                scanExecutor = projectInfo.scanExecutor
+
+            if scanExecutor:
+                scanExecutor.killProcess()
+
+            if projectInfo.fileWatcher:
+                projectInfo.fileWatcher.stop()
+
+        # Wakes up the threads that are waiting for work, which then exit
+        self._refreshScheduler.close()
+        self._fileChangeQueue.put(None)
+        self._benchmarkQueue.put(None)
+        self._resolveQueue.put(None)
+        self._projectChangedEvent.set()
+
+    def forceRefresh(self, rootPath):
+        rootPath = self._getCanonicalPath(rootPath)
+
+        info = self._getProjectInfo(rootPath)
+        self._queueRefresh(rootPath, info)
+
+    def _queueRefresh(self, rootPath, projectInfo):
+        with projectInfo.isUpdating.lock:
+            # The queued scan hasn't started yet, so it will see everything anyway
+            if projectInfo.isRefreshQueued:
+                return
+
+            if projectInfo.isUpdating.value:
+                # The running scan may be stale or stuck, so abort it and start over
+                projectInfo.generation += 1
+                scanExecutor = projectInfo.scanExecutor
+            else:
+                scanExecutor = None
+
+            projectInfo.isUpdating.value = True
+            projectInfo.isRefreshQueued = True
+
+        if scanExecutor:
+            # Unblocks the scan thread if it is waiting on output, since the reader
+            # threads see the end of the pipes and stop
+            scanExecutor.killProcess()
+
+        self._projectChangedEvent.set()
+        self._refreshScheduler.push(rootPath)
+
+    def _waitForProjectToInitialize(self, projectInfo, timeout=WaitingForSearchTimeout):
+        self._refreshScheduler.promote(projectInfo.rootPath)
+        elapsed = 0
+
+        while projectInfo.isUpdating.getValue() and not projectInfo.hasResults:
+            time.sleep(0.05)
+            elapsed += 0.05
+            if timeout is not None and elapsed > timeout:
+                raise RuntimeError(f"Timeout waiting to update project in Marksman!")
+
+    def waitForProject(self, rootPath, timeout=None):
+        """
+        Blocks until rootPath has been scanned completely and its cache has been saved,
+        and returns False if that takes longer than timeout seconds or the scan fails
+        """
+        projectInfo = self._getProjectInfo(self._getCanonicalPath(rootPath))
+        self._refreshScheduler.promote(projectInfo.rootPath)
+        startTime = time.time()
+
+        # The scan thread saves the cache after the index is published
+        while projectInfo.isUpdating.getValue() or self._refreshScheduler.isPending(projectInfo.rootPath):
+            if timeout is not None and time.time() - startTime > timeout:
+                return False
+
+            time.sleep(0.005)
+
+        return not projectInfo.lastScanFailed
+
+    def getMatches(self, rootPath, id, offset, maxAmount, ignorePath=None, timeout=WaitingForSearchTimeout):
+        """
+        Returns (paths, totalMatchesCount) for the files in rootPath with the given
+        humps, best match first.  Waits for the first results if the project hasn't
+        been scanned yet
+        """
+        rootPath = self._getCanonicalPath(rootPath)
+
+        assert os.path.isdir(rootPath), f"Could not find directory '{rootPath}'"
+
+        if ignorePath:
+            ignorePath = self._getCanonicalPath(ignorePath)
+
+        projectInfo = self._getProjectInfo(rootPath)
+
+        self._waitForProjectToInitialize(projectInfo, timeout)
+
+        return self._lookupMatchesSlice(projectInfo, self._getIndexForLookup(projectInfo, id), id, offset, maxAmount, ignorePath)
+
+    def profileSearchMethods(self, dirPath):
+        """ Times every search type on dirPath, and returns the report as a list of lines """
+        dirPath = self._getCanonicalPath(dirPath)
+        report = []
+
+        for i in range(BenchmarkRounds):
+            report.append(f'Round {i+1}:')
+
+            invalidTypes = []
+
+            for searchType in SearchTypes:
+                startTime = datetime.now()
+
+                fileIterator = self._tryScanForFilesUsingSearchType(searchType, dirPath, False)
+
+                if not fileIterator:
+                    invalidTypes.append(searchType)
+                    continue
+
+                for path in fileIterator:
+                    pass
+
+                elapsed = (datetime.now() - startTime).total_seconds()
+                report.append(f'Searching with "{searchType}" took {elapsed:0.2f} seconds')
+                time.sleep(0.001)
+
+        if len(invalidTypes) > 0:
+            report.append(f'The following were attempted but not supported: {invalidTypes}')
+
+        report.append(f'Done profiling')
+        return report
+
+    def lookupByFileName(self, rootPath, fileName):
+        rootPath = self._getCanonicalPath(rootPath)
+
+        assert os.path.isdir(rootPath), f"Could not find directory '{rootPath}'"
+
+        projectInfo = self._getProjectInfo(rootPath)
+
+        self._waitForProjectToInitialize(projectInfo)
+
+        index = projectInfo.index
+        return [index.fileTable.getPath(x) for x in index.nameMap.get(fileName, [])]
+
+    def updateSearch(self, rootPath, requestId, offset, maxAmount, ignorePath=None, session=None):
+        """
+        Returns the current result for the search, and makes it the active search of the
+        session, which gets passed to onSearchUpdated again every time the result changes
+        """
+        rootPath = self._getCanonicalPath(rootPath)
+
+        assert os.path.isdir(rootPath), f"Could not find directory '{rootPath}'"
+
+        if ignorePath:
+            ignorePath = self._getCanonicalPath(ignorePath)
+
+        projectInfo = self._getProjectInfo(rootPath)
+        # Whatever is on screen goes ahead of any other project that is waiting to be scanned
+        self._refreshScheduler.promote(rootPath)
+        activeSearch = ActiveSearch(projectInfo, requestId, offset, maxAmount, ignorePath)
+        activeSearch.lastResult = self._buildSearchResult(projectInfo, requestId, offset, maxAmount, ignorePath)
+
+        # Only one search is shown at a time, so this replaces any previous one
+        with self._activeSearches.lock:
+            self._activeSearches.value[session] = activeSearch
+
+        return activeSearch.lastResult
+
+    def getStats(self, rootPath=None):
+        """
+        Returns a list with the counters and timings of each project, or just of the
+        project at rootPath if it is given
+        """
+        with self._projectMap.readLock:
+            projectInfos = list(self._projectMap.value.values())
+
+        if rootPath is not None:
+            rootPath = self._getCanonicalPath(rootPath)
+            projectInfos = [x for x in projectInfos if x.rootPath == rootPath]
+
+        return [self._getProjectStats(x) for x in projectInfos]
+
+    def getIndex(self, rootPath):
+        """ The current ProjectIndex snapshot of rootPath, which never changes once returned """
+        return self._getProjectInfo(self._getCanonicalPath(rootPath)).index
+
+    def _getProjectStats(self, projectInfo):
+        index = projectInfo.index
+        # The empty id holds every file, so it isn't counted as a bucket
+        ids = [x for x in index.idMap if x and index.idMap[x]]
+        largestId = max(ids, key=lambda x: len(index.idMap[x]), default=None)
+
+        stats = projectInfo.stats.toDictionary()
+        stats.update({
+            'rootPath': projectInfo.rootPath,
+            'isUpdating': projectInfo.isUpdating.getValue(),
+            'fileCount': index.totalCount,
+            'bucketCount': len(ids),
+            'largestBucket': {
+                'id': largestId,
+                'count': len(index.idMap[largestId]) if largestId is not None else 0,
+            },
+        })
+
+        return stats
+
+    def endSearch(self, session=None):
+        with self._activeSearches.lock:
+            self._activeSearches.value.pop(session, None)
+
+    def _buildSearchResult(self, projectInfo, requestId, offset, maxAmount, ignorePath):
+        # Take the snapshot once so that the matches and the prefix summary agree
+        index = self._getIndexForLookup(projectInfo, requestId)
+        matchesSlice, totalMatchesCount = self._lookupMatchesSlice(
+            projectInfo, index, requestId, offset, maxAmount, ignorePath)
+
+        if len(requestId) > 0:
+            prefixMatchesCount, continuations = index.getPrefixSummary(requestId)
+        else:
+            # Everything is an exact match for the empty request
+            prefixMatchesCount, continuations = 0, []
+
+        return {
+            # Echoed back so that the UI can ignore updates for a request it has moved on from
+            'requestId': requestId,
+            'offset': offset,
+            'totalCount': index.totalCount,
+            'isUpdating': projectInfo.isUpdating.getValue(),
+            'scannedCount': projectInfo.scannedCount,
+            'matchesCount': totalMatchesCount,
+            'matches': [self._convertToFileInfoDictionary(x) for x in matchesSlice],
+            'prefixMatchesCount': prefixMatchesCount,
+            'continuations': [self._convertToContinuationDictionary(index, *x) for x in continuations],
+        }
+
+    def _convertToContinuationDictionary(self, index, letter, count, fileIndex):
+        result = self._convertToFileInfoDictionary(index.fileTable.getPath(fileIndex))
+        result['letter'] = letter
+        result['count'] = count
+        return result
+
+    def _convertToFileInfoDictionary(self, path):
+        return {'path': path, 'name': os.path.basename(path)}
+
+    def _getFileNameHumps(self, fileName):
+        return getFileNameHumps(os.path.basename(fileName))
+
+    def _getCanonicalPath(self, path):
+        return os.path.abspath(path)
+
+    def _tryScanForFilesUsingSearchType(self, searchType, dirPath, noIgnore, projectInfo=None):
+        if searchType == "python":
+            # This should always work
+            walker = DirectoryWalker(
+                self._settings["g:Mm_IgnoreDirectoryPatterns"], self._settings["g:Mm_IgnoreFilePatterns"],
+                self._settings["g:Mm_FollowLinks"], self._settings['g:Mm_StatThreadCount'])
+
+            if projectInfo:
+                projectInfo.scanExecutor = walker
+
+            return walker.execute(dirPath)
+
+        if searchType == "custom":
+            if not self._settings["exists('g:Mm_CustomSearchCommand')"]:
+                return None
+
+            cmd = self._settings["g:Mm_CustomSearchCommand"] % dirPath.join('""')
+        elif searchType == "git":
+            return self._tryScanForFilesUsingGit(dirPath, noIgnore, projectInfo)
+        elif searchType == "gitindex":
+            return self._tryScanForFilesUsingGitIndex(dirPath, noIgnore, projectInfo)
+        else:
+            cmd = self._searchCommandBuilder.tryBuildExternalSearchCommand(
+                searchType, dirPath, noIgnore)
+
+        if not cmd:
+            return None
+
+        if self._log.includeDebugging:
+            self._log.queueInfo(f'Marksman External Command: {cmd}')
+
+        if searchType != "custom" and self._searchCommandBuilder.outputsModificationTimes(searchType):
+            transform = parseModificationTimeRecords
+        else:
+            transform = None
+
+        executor = AsyncCommandExecutor()
+
+        if projectInfo:
+            projectInfo.scanExecutor = executor
+
+        # Several projects can be scanned at once, so don't change the working directory
+        # of the whole process
+        return executor.execute(
+            cmd, encoding=self._settings["&encoding"], cwd=dirPath, bulk=True, errors='surrogateescape',
+            transform=transform)
+
+    def _tryScanForFilesUsingGit(self, dirPath, noIgnore, projectInfo):
+        commands = self._searchCommandBuilder.tryBuildGitSearchCommands(dirPath, noIgnore)
+
+        if not commands:
+            return None
+
+        if self._log.includeDebugging:
+            self._log.queueInfo(f'Marksman External Commands: {[x[0] for x in commands]}')
+
+        executor = ParallelCommandExecutor()
+
+        if projectInfo:
+            projectInfo.scanExecutor = executor
+
+        # The untracked listing is often by far the slowest, so nothing waits on it
+        return executor.execute(
+            [(cmd, os.path.join(dirPath, subDirectory), self._createGitOutputTransform(subDirectory, excludedLines))
+                for cmd, subDirectory, excludedLines in commands],
+            encoding=self._settings["&encoding"], errors='surrogateescape')
+
+    def _tryScanForFilesUsingGitIndex(self, dirPath, noIgnore, projectInfo):
+        cmd = self._searchCommandBuilder.tryBuildGitUntrackedSearchCommand(dirPath, noIgnore)
+
+        if not cmd:
+            return None
+
+        # The index only has the tracked files.  Start git on the untracked ones first so
+        # that it runs while we read the index
+        executor = AsyncCommandExecutor()
+
+        if projectInfo:
+            projectInfo.scanExecutor = executor
+
+        untrackedResult = executor.execute(
+            cmd, encoding=self._settings["&encoding"], cwd=dirPath, bulk=True, errors='surrogateescape')
+
+        records = readGitIndex(dirPath, self._settings["get(g:, 'Mm_RecurseSubmodules', 0)"])
+
+        if records is None:
+            # Let the 'git' search type handle it instead
+            executor.killProcess()
+            return None
+
+        # The index has the modification times too, so these skip the stat pass
+        return BatchedScanResult(itertools.chain(
+            iterateBatches(records, IngestBatchSize), untrackedResult.iterBatches()))
+
+    def _createGitOutputTransform(self, subDirectory, excludedLines):
+        if not subDirectory and not excludedLines:
+            return None
+
+        prefix = os.path.join(subDirectory, '') if subDirectory else ''
+
+        def transform(lines):
+            if excludedLines:
+                lines = [x for x in lines if x not in excludedLines]
+
+            if prefix:
+                lines = [prefix + x for x in lines]
+
+            return lines
+
+        return transform
+
+    def _getSearchTypeOrder(self, dirPath):
+        order = self._settings["g:Mm_SearchPreferenceOrder"]
+
+        if not self._settings['g:Mm_AutoSelectSearchType']:
+            return order
+
+        benchmark = self._searchTypeBenchmarks.tryGet(dirPath)
+
+        # Ignore the result if that search type has been taken out of the order since
+        if not benchmark or benchmark.searchType not in order:
+            return order
+
+        # The rest are still there in case the fastest one stops working
+        return [benchmark.searchType] + [x for x in order if x != benchmark.searchType]
+
+    def _scanForFiles(self, dirPath, noIgnore, projectInfo=None):
+
+        for searchType in self._getSearchTypeOrder(dirPath):
+            result = self._tryScanForFilesUsingSearchType(searchType, dirPath, noIgnore, projectInfo)
+
+            if result:
+                if projectInfo:
+                    projectInfo.stats.lastSearchType = searchType
+
+                return result
+
+        # Not an assert, since those are stripped under -O
+        raise RuntimeError(f'Could not find a valid search type for "{dirPath}" in g:Mm_SearchPreferenceOrder')
+
+    def _scanForFileBatches(self, dirPath, noIgnore, batchSize, projectInfo=None):
+        result = self._scanForFiles(dirPath, noIgnore, projectInfo)
+
+        # External commands already hand over their output in large batches
+        if hasattr(result, 'iterBatches'):
+            return result.iterBatches()
+
+        return iterateBatches(result, batchSize)
+
+    def _searchThreadInternal(self):
+        while True:
+            rootPath = self._refreshScheduler.pop()
+
+            if rootPath is None:
+                return
+
+            try:
+                self._processProject(rootPath)
+            except Exception as e:
+                # Eg. no search type works for this project.  Letting it through would
+                # end this thread for good, and with it every scan that is queued after
+                self._log.queueException(e)
+            finally:
+                self._refreshScheduler.taskDone(rootPath)
+
+    def _processProject(self, rootPath):
+        # self._log.queueDebug(f'Started processing "{rootPath}"')
+
+        startTime = datetime.now()
+        projectInfo = self._getProjectInfo(rootPath)
+
+        with projectInfo.isUpdating.lock:
+            assert projectInfo.isUpdating.value
+            projectInfo.isRefreshQueued = False
+            generation = projectInfo.generation
+
+        scanMetrics = ScanMetrics()
+        index = None
+
+        try:
+            if not os.path.isdir(rootPath):
+                raise RuntimeError(f"Could not find directory '{rootPath}'")
+
+            index = self._scanProject(rootPath, projectInfo, generation, scanMetrics)
+        except Exception:
+            projectInfo.lastScanFailed = True
+            raise
+        finally:
+            if index is not None:
+                projectInfo.lastScanFailed = False
+
+            scanMetrics.stop()
+
+            projectInfo.stats.addScan(
+                scanMetrics, (datetime.now() - startTime).total_seconds(), projectInfo.scannedCount, index is None)
+
+            if index is None:
+                # Cancelled or failed, so nothing is editing the published file table anymore
+                with projectInfo.stats.acquire(projectInfo.writeLock):
+                    projectInfo.filesOpenedDuringScan = None
+                    projectInfo.scanFileTable = None
+
+            # Also when the scan failed, since otherwise the project would stay updating
+            # forever and everything waiting on it would wait forever too
+            self._finishUpdating(rootPath, projectInfo)
+
+        if index is None:
+            # The refresh that cancelled us is already queued and takes over from here
+            self._log.queueDebug(f'Cancelled processing directory "{rootPath}"')
+            return
+
+        elapsed = (datetime.now() - startTime).total_seconds()
+
+        self._log.queueDebug(f'Finished processing directory "{rootPath}", took {elapsed:0.2f} seconds')
+
+        self._trySaveProjectCache(rootPath, index)
+        self._restartFileWatcher(rootPath, projectInfo)
+        self._queueBenchmarkIfNeeded(rootPath, projectInfo.scannedCount)
+
+    def _finishUpdating(self, rootPath, projectInfo):
+        deferredFileChanges = []
+
+        with projectInfo.isUpdating.lock:
+            # A refresh that came in after we published (or that cancelled us) still needs
+            # to run, and picks up the deferred changes once it is done
+            if not projectInfo.isRefreshQueued:
+                projectInfo.isUpdating.value = False
+                deferredFileChanges = projectInfo.deferredFileChanges
+                projectInfo.deferredFileChanges = []
+
+        for changeType, path in deferredFileChanges:
+            self._fileChangeQueue.put((rootPath, changeType, path))
+
+        self._projectChangedEvent.set()
+
+    def _queueBenchmarkIfNeeded(self, rootPath, fileCount):
+        if not self._settings['g:Mm_AutoSelectSearchType']:
+            return
+
+        benchmark = self._searchTypeBenchmarks.tryGet(rootPath)
+
+        if benchmark and not benchmark.isStale(fileCount):
+            return
+
+        with self._queuedBenchmarks.lock:
+            if rootPath in self._queuedBenchmarks.value:
+                return
+
+            self._queuedBenchmarks.value.add(rootPath)
+
+        self._benchmarkQueue.put(rootPath)
+
+    def _benchmarkThreadInternal(self):
+        while True:
+            rootPath = self._benchmarkQueue.get()
+
+            if rootPath is None:
+                return
+
+            try:
+                self._benchmarkSearchTypes(rootPath)
+            finally:
+                with self._queuedBenchmarks.lock:
+                    self._queuedBenchmarks.value.discard(rootPath)
+
+    def _benchmarkThread(self):
+        try:
+            self._benchmarkThreadInternal()
+        except Exception as e:
+            self._log.queueException(e)
+
+    def _benchmarkSearchTypes(self, rootPath):
+        """
+        Times every search type that works for rootPath, and saves the fastest one out
+        of those that list the same number of files as the first one that works in
+        g:Mm_SearchPreferenceOrder.  Otherwise switching could change the results,
+        since for example 'git' leaves out ignored files and 'find' doesn't
+        """
+        order = self._settings["g:Mm_SearchPreferenceOrder"]
+        timings = {}
+        fileCounts = {}
+
+        for _ in range(BenchmarkRounds):
+            for searchType in order:
+                result = self._timeSearchType(searchType, rootPath)
+
+                if result is None:
+                    continue
+
+                elapsed, fileCount = result
+                timings[searchType] = min(elapsed, timings.get(searchType, elapsed))
+                fileCounts[searchType] = fileCount
+
+        if not fileCounts:
+            return
+
+        preferredType = next(x for x in order if x in fileCounts)
+        fileCount = fileCounts[preferredType]
+        candidates = [x for x in fileCounts if fileCounts[x] == fileCount]
+        searchType = min(candidates, key=lambda x: timings[x])
+
+        self._log.queueDebug(
+            f'Benchmarked search types for "{rootPath}", using "{searchType}": '
+            + ', '.join(f'{x} {timings[x]:0.2f}s ({fileCounts[x]} files)' for x in timings))
+
+        try:
+            self._searchTypeBenchmarks.save(rootPath, SearchTypeBenchmark(searchType, fileCount, timings, fileCounts))
+        except OSError as e:
+            self._log.queueError(f'Failed to write search type benchmark for "{rootPath}": {e}')
+
+    def _timeSearchType(self, searchType, rootPath):
+        """
+        Returns (seconds, fileCount), or None if the search type doesn't work here.
+        Looking up the modification times that the search type doesn't provide is
+        part of the time, since scans have to do that too
+        """
+        startTime = time.time()
+
+        try:
+            result = self._tryScanForFilesUsingSearchType(searchType, rootPath, False)
+
+            if not result:
+                return None
+
+            fileTable = FileTable()
+            ingester = PathIngester(rootPath, 0)
+            modTimeCollector = ModificationTimeCollector(fileTable, self._settings['g:Mm_StatThreadCount'])
+            fileCount = 0
+
+            try:
+                for batch in result.iterBatches():
+                    paths, modTimes = splitRecords(batch)
+                    fileCount += len(paths)
+
+                    for i, path in enumerate(paths):
+                        if not modTimes or not modTimes[i]:
+                            modTimeCollector.add(fileTable.add(ingester.getCanonicalPath(path), ''))
+
+                modTimeCollector.flush()
+
+                while modTimeCollector.hasOutstanding():
+                    modTimeCollector.takeResults(SnapshotPublishInterval)
+            finally:
+                modTimeCollector.shutdown()
+        except Exception as e:
+            # Eg. external commands that print errors for unreadable directories
+            self._log.queueDebug(f'Could not benchmark "{searchType}" for "{rootPath}": {e}')
+            return None
+
+        return time.time() - startTime, fileCount
+
+    def _scanProject(self, rootPath, projectInfo, generation, scanMetrics):
+        """
+        Returns the published index, or None if the scan was cancelled, in which case
+        nothing past the incremental snapshots has been published
+        """
+        # Everything is built privately and only shared through publish(), so
+        # there is nothing to lock per file
+        builder = ProjectIndexBuilder()
+        fileTable = builder.fileTable
+
+        # Once there are complete results, keep serving them until the scan is done
+        publishIncrementally = not projectInfo.hasResults
+        lastPublishTime = time.time()
+
+        noIgnore = False  # Do we care about this?
+        projectInfo.scannedCount = 0
+
+        with projectInfo.stats.acquire(projectInfo.writeLock):
+            projectInfo.filesOpenedDuringScan = {}
+
+        ingester = PathIngester(rootPath, self._settings['g:Mm_IngestProcessCount'])
+        # Modification times are looked up on other threads while the scan continues
+        modTimeCollector = ModificationTimeCollector(fileTable, self._settings['g:Mm_StatThreadCount'])
+        # Or left for _getIndexForLookup, which only looks up the buckets that get searched
+        isLazy = self._settings['g:Mm_LazyModificationTimes']
+        unresolvedIds = set()
+
+        try:
+            # Time spent waiting on the scanner counts as 'scan', the rest of the loop
+            # is split up below
+            scanMetrics.startPhase('scan')
+
+            for batch in self._scanForFileBatches(rootPath, noIgnore, ingester.batchSize, projectInfo):
+                if projectInfo.generation != generation:
+                    return None
+
+                scanMetrics.startPhase('ingest')
+                projectInfo.scannedCount += len(batch)
+
+                paths, modTimes = splitRecords(batch)
+                statIndices = builder.addFiles(ingester.ingest(paths), modTimes)
+
+                # Only the files without a modification time still need to be looked up
+                if isLazy:
+                    unresolvedIds.update(fileTable.ids[x] for x in statIndices)
+                else:
+                    scanMetrics.statCount += len(statIndices)
+
+                    for fileIndex in statIndices:
+                        modTimeCollector.add(fileIndex)
+
+                if publishIncrementally and time.time() - lastPublishTime > SnapshotPublishInterval:
+                    scanMetrics.startPhase('sort')
+                    self._applyModificationTimes(builder, modTimeCollector.takeResults())
+                    builder.sortBuckets(includeAllFiles=False)
+
+                    if not self._publishScanSnapshot(projectInfo, builder, generation, unresolvedIds):
+                        return None
+
+                    lastPublishTime = time.time()
+
+                scanMetrics.startPhase('scan')
+
+            scanMetrics.startPhase('stat')
+            modTimeCollector.flush()
+
+            while modTimeCollector.hasOutstanding():
+                if projectInfo.generation != generation:
+                    return None
+
+                self._applyModificationTimes(builder, modTimeCollector.takeResults(SnapshotPublishInterval))
+
+                if publishIncrementally:
+                    scanMetrics.startPhase('sort')
+                    builder.sortBuckets(includeAllFiles=False)
+
+                    if not self._publishScanSnapshot(projectInfo, builder, generation):
+                        return None
+
+                    scanMetrics.startPhase('stat')
+        except Exception:
+            # Killing the scanner can make it fail in all sorts of ways
+            if projectInfo.generation != generation:
+                return None
+
+            raise
+        finally:
+            ingester.shutdown()
+            modTimeCollector.shutdown()
+
+            # Nothing reads the output past this point.  This is a no-op if it already finished
+            if projectInfo.scanExecutor:
+                projectInfo.scanExecutor.killProcess()
+                projectInfo.scanExecutor = None
+
+        scanMetrics.startPhase('sort')
+        self._applyLastOpenTimes(rootPath, builder)
+        builder.sortBuckets()
+
+        with projectInfo.stats.acquire(projectInfo.writeLock):
+            # A killed scanner just looks like one that finished early, so check
+            # again before replacing anything
+            if projectInfo.generation != generation:
+                return None
+
+            self._applyFilesOpenedDuringScan(projectInfo, builder)
+            index = builder.publish()
+            projectInfo.hasResults = True
+            projectInfo.filesOpenedDuringScan = None
+            projectInfo.scanFileTable = None
+            self._publishIndex(projectInfo, index, unresolvedIds)
+
+        # The new index only has files that the scan found, so anything missing in it
+        # is queued again
+        with projectInfo.queuedRemovals.lock:
+            projectInfo.queuedRemovals.value = set()
+
+        # So that the first search doesn't have to wait for it.  Later snapshots only
+        # update it
+        index.buildSummaryTree()
+        return index
+
+    def _publishScanSnapshot(self, projectInfo, builder, generation, unresolvedIds=None):
+        """ Publishes the partial results of a first scan.  Returns False if the scan was cancelled """
+        with projectInfo.stats.acquire(projectInfo.writeLock):
+            if projectInfo.generation != generation:
+                return False
+
+            self._applyFilesOpenedDuringScan(projectInfo, builder)
+            projectInfo.scanFileTable = builder.fileTable
+            self._publishIndex(projectInfo, builder.publish(), unresolvedIds)
+            return True
+
+    def _applyFilesOpenedDuringScan(self, projectInfo, builder):
+        """ Call with projectInfo.writeLock held """
+        fileTable = builder.fileTable
+
+        # Kept until the scan is done, since it might not have found the file yet
+        for path, openTime in projectInfo.filesOpenedDuringScan.items():
+            fileIndex = builder.findFileIndex(path)
+
+            if fileIndex is not None and fileTable.openTimes.get(fileIndex) != openTime:
+                fileTable.openTimes[fileIndex] = openTime
+                builder.reorderFile(fileIndex)
+
+    def _publishIndex(self, projectInfo, index, unresolvedIds=None):
+        """ unresolvedIds replaces projectInfo.unresolvedIds when given (see g:Mm_LazyModificationTimes) """
+        if unresolvedIds is not None:
+            projectInfo.unresolvedIds = set(unresolvedIds) | {''} if unresolvedIds else set()
+
+        projectInfo.index = index
+        self._projectChangedEvent.set()
+
+    def _getIndexForLookup(self, projectInfo, requestId):
+        """
+        The index to search for requestId.  With g:Mm_LazyModificationTimes the files
+        with those humps get their modification times looked up and sorted the first
+        time they are searched for, and the result is kept until the next scan
+        """
+        if requestId not in projectInfo.unresolvedIds or not projectInfo.hasResults:
+            # Partial results of a first scan are still being added to, so those stay
+            # in the order they were found
+            return projectInfo.index
+
+        if len(requestId) == 0:
+            # The bucket with every file needs all of them looked up, which is exactly
+            # the cost this mode is meant to avoid, so that happens in the background.
+            # The active search is updated once it is done
+            self._queueResolve(projectInfo.rootPath)
+            return projectInfo.index
+
+        return self._resolveModificationTimes(projectInfo, {requestId})
+
+    def _resolveModificationTimes(self, projectInfo, ids):
+        """ Looks up the modification times of the files in the buckets of ids, and publishes them sorted """
+        index = projectInfo.index
+        sortAllFiles = '' in ids
+        results = []
+        modTimeCollector = ModificationTimeCollector(index.fileTable, self._settings['g:Mm_StatThreadCount'])
+
+        # Without holding the write lock, since this can take a while on slow drives
+        try:
+            for id in ids:
+                if len(id) > 0:
+                    for fileIndex in index.idMap.get(id, ()):
+                        modTimeCollector.add(fileIndex)
+
+            modTimeCollector.flush()
+
+            while modTimeCollector.hasOutstanding():
+                results.extend(modTimeCollector.takeResults(None))
+        finally:
+            modTimeCollector.shutdown()
+
+        with projectInfo.stats.acquire(projectInfo.writeLock):
+            if projectInfo.index.fileTable is not index.fileTable:
+                # A scan replaced the index in the meantime, with its own unresolved ids
+                return projectInfo.index
+
+            builder = ProjectIndexBuilder(projectInfo.index)
+            self._applyModificationTimes(builder, results)
+            builder.sortBuckets(includeAllFiles=sortAllFiles)
+            # Copied rather than changed in place, since readers check it without the lock
+            projectInfo.unresolvedIds = projectInfo.unresolvedIds - ids
+            self._publishIndex(projectInfo, builder.publish())
+            return projectInfo.index
+
+    def _queueResolve(self, rootPath):
+        with self._queuedResolves.lock:
+            if rootPath in self._queuedResolves.value:
+                return
+
+            self._queuedResolves.value.add(rootPath)
+
+        self._resolveQueue.put(rootPath)
+
+    def _resolveThreadInternal(self):
+        while True:
+            rootPath = self._resolveQueue.get()
+
+            if rootPath is None:
+                return
+
+            try:
+                projectInfo = self._getProjectInfo(rootPath)
+
+                if projectInfo.unresolvedIds:
+                    self._resolveModificationTimes(projectInfo, set(projectInfo.unresolvedIds))
+            finally:
+                with self._queuedResolves.lock:
+                    self._queuedResolves.value.discard(rootPath)
+
+    def _resolveThread(self):
+        try:
+            self._resolveThreadInternal()
+        except Exception as e:
+            self._log.queueException(e)
+
+    def _getActiveSearches(self):
+        with self._activeSearches.lock:
+            return list(self._activeSearches.value.items())
+
+    def _searchNotifierThreadInternal(self):
+        while True:
+            # Scans publish nothing once there are complete results, so check for progress
+            # every so often while one is running.  Otherwise just wait for a change
+            if any(x.projectInfo.isUpdating.getValue() for _, x in self._getActiveSearches()):
+                timeout = self._settings['g:Mm_ProgressUpdateInterval']
+            else:
+                timeout = None
+
+            self._projectChangedEvent.wait(timeout)
+            self._projectChangedEvent.clear()
+
+            if self._isShutDown.is_set():
+                return
+
+            for session, activeSearch in self._getActiveSearches():
+                if not activeSearch.hasChanged():
+                    continue
+
+                result = self._buildSearchResult(
+                    activeSearch.projectInfo, activeSearch.requestId, activeSearch.offset,
+                    activeSearch.maxAmount, activeSearch.ignorePath)
+
+                if result == activeSearch.lastResult:
+                    continue
+
+                activeSearch.lastResult = result
+
+                if self._onSearchUpdated:
+                    self._onSearchUpdated(session, result)
+
+    def _searchNotifierThread(self):
+        try:
+            self._searchNotifierThreadInternal()
+        except Exception as e:
+            self._log.queueException(e)
+
+    def _applyLastOpenTimes(self, rootPath, builder):
+        with self._lastOpenTimes.readLock:
+            lastOpenTimes = list(self._lastOpenTimes.value.items())
+
+        rootPrefix = os.path.join(rootPath, '')
+
+        for path, openTime in lastOpenTimes:
+            # Files opened in other projects can't be in this one
+            if not path.startswith(rootPrefix):
+                continue
+
+            fileIndex = builder.findFileIndex(path)
+
+            if fileIndex is not None:
+                builder.setOpenTime(fileIndex, openTime)
+
+    def _applyModificationTimes(self, builder, results):
+        for fileIndex, modTime in results:
+            builder.setModificationTime(fileIndex, modTime)
+
+    def _restartFileWatcher(self, rootPath, projectInfo):
+        if not self._settings['g:Mm_EnableFileWatcher']:
+            return
+
+        if projectInfo.fileWatcher:
+            projectInfo.fileWatcher.stop()
+
+        # Watch every directory that contains an indexed file, plus the directories
+        # in between so that new sibling directories are noticed too
+        directories = {rootPath}
+        rootPrefix = os.path.join(rootPath, '')
+
+        for dirPath in list(projectInfo.index.fileTable.directories):
+            while dirPath not in directories and dirPath.startswith(rootPrefix):
+                directories.add(dirPath)
+                dirPath = os.path.dirname(dirPath)
+
+        # The watcher has to agree with the scan about hidden files, otherwise the next
+        # rescan would bring back (or drop) the files that the watcher saw differently
+        if projectInfo.stats.lastSearchType in HiddenFileSearchTypes:
+            showHidden = True
+        else:
+            showHidden = None
+
+        projectInfo.fileWatcher = createFileWatcher(
+            rootPath, directories, self._fileChangeQueue, self._settings, showHidden)
+
+        # A scan that finished while the engine was shut down
+        if self._isShutDown.is_set():
+            projectInfo.fileWatcher.stop()
+            return
+
+        self._log.queueDebug(
+            f'Watching {len(directories)} directories in "{rootPath}" using {type(projectInfo.fileWatcher).__name__}')
+
+    def _fileWatcherThreadInternal(self):
+        while True:
+            changes = [self._fileChangeQueue.get()]
+
+            # Editors and build tools tend to produce bursts of events
+            time.sleep(FileChangeBatchDelay)
+
+            while not self._fileChangeQueue.empty():
+                changes.append(self._fileChangeQueue.get_nowait())
+
+            if self._isShutDown.is_set():
+                return
+
+            changesByRoot = {}
+
+            for rootPath, changeType, path in changes:
+                changesByRoot.setdefault(rootPath, []).append((changeType, path))
+
+            for rootPath, rootChanges in changesByRoot.items():
+                projectInfo = self._getProjectInfo(rootPath)
+
+                if self._tryDeferFileChanges(projectInfo, rootChanges):
+                    continue
+
+                self._applyFileChanges(rootPath, projectInfo, rootChanges)
+
+    def _tryDeferFileChanges(self, projectInfo, changes):
+        """
+        Keeps the changes for after the running scan, if there is one, since the new
+        index replaces whatever they would be applied to.  Returns False if nothing is
+        scanning, in which case they should be applied now
+        """
+        with projectInfo.isUpdating.lock:
+            if not projectInfo.isUpdating.value:
+                return False
+
+            deferredFileChanges = projectInfo.deferredFileChanges
+            deferredFileChanges.extend(changes)
+
+            if len(deferredFileChanges) > MaxDeferredFileChanges:
+                projectInfo.deferredFileChanges = [(FileChangeTypes.Overflow, projectInfo.rootPath)]
+
+            return True
+
+    def _fileWatcherThread(self):
+        try:
+            self._fileWatcherThreadInternal()
+        except Exception as e:
+            self._log.queueException(e)
+
+    def _applyFileChanges(self, rootPath, projectInfo, changes):
+        if any(changeType == FileChangeTypes.Overflow for changeType, _ in changes):
+            self._log.queueDebug(f'Too many file changes in "{rootPath}", rescanning')
+            self._queueRefresh(rootPath, projectInfo)
+            return
+
+        addedPaths = set()
+        modifiedPaths = set()
+        removedPaths = set()
+        removedDirectories = []
+
+        for changeType, path in changes:
+            if changeType == FileChangeTypes.Added:
+                addedPaths.add(path)
+            elif changeType == FileChangeTypes.Removed:
+                addedPaths.discard(path)
+                modifiedPaths.discard(path)
+                removedPaths.add(path)
+            elif changeType == FileChangeTypes.DirectoryRemoved:
+                prefix = os.path.join(path, '')
+                addedPaths = {x for x in addedPaths if not x.startswith(prefix)}
+                modifiedPaths = {x for x in modifiedPaths if not x.startswith(prefix)}
+                removedDirectories.append(path)
+            elif changeType == FileChangeTypes.Modified:
+                if path not in addedPaths:
+                    modifiedPaths.add(path)
+            else:
+                assert False, f'Unexpected file change type "{changeType}"'
+
+        # Asking git and the file system happens before taking the write lock, since
+        # opening a file and looking up modification times wait on that lock
+        addedTimes = {}
+
+        for path in self._filterGitIgnoredPaths(rootPath, projectInfo.stats.lastSearchType, addedPaths):
+            modTime = self._tryGetFileModificationTime(path)
+
+            if modTime is not None:
+                addedTimes[path] = modTime
+
+        modifiedTimes = {}
+
+        for path in modifiedPaths:
+            modTime = self._tryGetFileModificationTime(path)
+
+            if modTime is not None:
+                modifiedTimes[path] = modTime
+
+        with projectInfo.stats.acquire(projectInfo.writeLock):
+            builder = ProjectIndexBuilder(projectInfo.index)
+            removedIndices = set()
+
+            for path in removedPaths:
+                fileIndex = builder.findFileIndex(path)
+
+                if fileIndex is not None:
+                    removedIndices.add(fileIndex)
+
+            for dirPath in removedDirectories:
+                removedIndices.update(self._getFilesUnderDirectory(builder.fileTable, dirPath))
+
+            # All at once, since that filters each bucket once instead of once per file.
+            # Before adding, so that files that were deleted and recreated get a new entry
+            builder.removeFiles(removedIndices)
+
+            for path, modTime in addedTimes.items():
+                if not self._addFileToIndex(builder, path, modTime):
+                    self._updateFileInIndex(builder, path, modTime)
+
+            for path, modTime in modifiedTimes.items():
+                self._updateFileInIndex(builder, path, modTime)
+
+            self._publishIndex(projectInfo, builder.publish())
+
+        with projectInfo.queuedRemovals.lock:
+            projectInfo.queuedRemovals.value.difference_update(removedPaths)
+
+    def _filterGitIgnoredPaths(self, rootPath, searchType, paths):
+        # The watcher only knows about g:Mm_Ignore*Patterns, so ask git about .gitignore
+        # rules to match what the git/rg/ag scanners would have returned.  The others
+        # list ignored files too
+        if not paths or searchType not in GitIgnoreSearchTypes or not self._settings["executable('git')"]:
+            return paths
+
+        try:
+            result = subprocess.run(
+                ['git', 'check-ignore', '--stdin', '-z'], cwd=rootPath,
+                input='\0'.join(paths).encode('utf-8', 'surrogateescape'),
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError:
+            return paths
+
+        # 0 means some were ignored, 1 means none were, anything else means not a git repo
+        if result.returncode not in (0, 1):
+            return paths
+
+        ignoredPaths = set(result.stdout.decode('utf-8', 'surrogateescape').split('\0'))
+        # git never lists what is inside its own directories, and check-ignore doesn't
+        # report them either
+        gitDirectory = os.sep + '.git' + os.sep
+        return [x for x in paths if x not in ignoredPaths and gitDirectory not in x]
+
+    def _tryGetFileModificationTime(self, path):
+        """ Returns None if path isn't a file (anymore) """
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+
+        return info.st_mtime if stat.S_ISREG(info.st_mode) else None
+
+    def _addFileToIndex(self, builder, path, modTime):
+        """ Returns False if the file was already part of the project """
+        if builder.findFileIndex(path) is not None:
+            return False
+
+        builder.insertFile(path, self._getFileNameHumps(os.path.basename(path)), modTime)
+        # It might have been tombstoned as missing before it was recreated
+        self._existenceCache.invalidate(path)
+        return True
+
+    def _getFilesUnderDirectory(self, fileTable, dirPath):
+        # Only walks the directories, which are far fewer than the files
+        prefix = os.path.join(dirPath, '')
+        fileIndices = []
+
+        for directoryIndex, directory in enumerate(fileTable.directories):
+            if directory == dirPath or directory.startswith(prefix):
+                fileIndices.extend(fileTable.getFilesInDirectory(directoryIndex))
+
+        return fileIndices
+
+    def _updateFileInIndex(self, builder, path, modTime):
+        fileIndex = builder.findFileIndex(path)
+
+        if fileIndex is None:
+            return
+
+        builder.fileTable.modificationTimes[fileIndex] = modTime
+        builder.reorderFile(fileIndex)
+
+    def _searchThread(self):
+        try:
+            self._searchThreadInternal()
+        except Exception as e:
+            self._log.queueException(e)
+
+    def _getProjectInfo(self, rootPath):
+
+        with self._projectMap.readLock:
+            info = self._projectMap.value.get(rootPath)
+
+        if info:
+            return info
+
+        with self._projectCreationLocks.lock:
+            creationLock = self._projectCreationLocks.value.setdefault(rootPath, threading.Lock())
+
+        with creationLock:
+            # Someone else might have created it while we waited
+            with self._projectMap.readLock:
+                info = self._projectMap.value.get(rootPath)
+
+            if info:
+                return info
+
+            info = ProjectInfo(rootPath)
+
+            self._tryLoadProjectCache(rootPath, info)
+
+            with self._projectMap.writeLock:
+                self._projectMap.value[rootPath] = info
+
+            self._refreshScheduler.push(rootPath)
+
+        # Anyone that comes later finds the project in the map instead
+        with self._projectCreationLocks.lock:
+            self._projectCreationLocks.value.pop(rootPath, None)
+
+        return info
+
+    def _getProjectsContaining(self, path):
+        """
+        The loaded projects that path could be in, ie. the ones rooted at one of its
+        parent directories.  Each parent is a single lookup in the project map, so this
+        costs the same no matter how many projects are loaded, and within a project the
+        file table finds the file by its directory and name
+        """
+        projectInfos = []
+
+        with self._projectMap.readLock:
+            projectMap = self._projectMap.value
+            dirPath = os.path.dirname(path)
+
+            while True:
+                projectInfo = projectMap.get(dirPath)
+
+                if projectInfo:
+                    projectInfos.append(projectInfo)
+
+                parentPath = os.path.dirname(dirPath)
+
+                if parentPath == dirPath:
+                    break
+
+                dirPath = parentPath
+
+        return projectInfos
+
+    def _tryLoadProjectCache(self, rootPath, projectInfo):
+        if not self._projectCache:
+            return
+
+        startTime = datetime.now()
+        data = self._projectCache.tryLoad(rootPath)
+
+        if data is None:
+            return
+
+        builder = ProjectIndexBuilder()
+        isLazy = self._settings['g:Mm_LazyModificationTimes']
+        unresolvedIds = set()
+
+        # The cache is written in sorted order so the buckets come out sorted too
+        for path, id, modTime in zip(data.paths, data.ids, data.modificationTimes):
+            builder.addFile(path, id, modTime)
+
+            # Saved by a lazy scan before the bucket was ever searched
+            if isLazy and modTime == 0:
+                unresolvedIds.add(id)
+
+        unresolvedIds.discard('')
+        self._publishIndex(projectInfo, builder.publish(), unresolvedIds)
+        projectInfo.hasResults = True
+
+        elapsed = (datetime.now() - startTime).total_seconds()
+        self._log.debug(f'Loaded cached results for "{rootPath}", took {elapsed:0.2f} seconds')
+
+    def _trySaveProjectCache(self, rootPath, index):
+        if not self._projectCache:
+            return
+
+        fileTable = index.fileTable
+        sortedIndices = list(index.iterBucket(''))
+
+        # Files without humps are only in nameMap, so append them at the end
+        sortedIndices.extend(x for x in range(len(fileTable)) if len(fileTable.ids[x]) == 0 and not fileTable.isRemoved(x))
+
+        data = ProjectCacheData(
+            [fileTable.getPath(x) for x in sortedIndices],
+            [fileTable.ids[x] for x in sortedIndices],
+            array('d', (fileTable.modificationTimes[x] for x in sortedIndices)))
+
+        try:
+            self._projectCache.save(rootPath, data)
+        except OSError as e:
+            self._log.queueError(f'Failed to write cache for "{rootPath}": {e}')
+
+    def _lookupMatchesSlice(self, projectInfo, index, requestId, offset, maxAmount, ignorePath):
+        startTime = time.perf_counter()
+        result = self._lookupMatchesSliceInternal(projectInfo, index, requestId, offset, maxAmount, ignorePath)
+        projectInfo.stats.addLookup(time.perf_counter() - startTime)
+        return result
+
+    def _lookupMatchesSliceInternal(self, projectInfo, index, requestId, offset, maxAmount, ignorePath):
+        fileList = index.idMap.get(requestId)
+
+        if not fileList:
+            return [], 0
+
+        fileTable = index.fileTable
+        matches = []
+
+        # Only stat what we are about to return, since this runs for every redraw.  Files
+        # that turn out to be missing are skipped and the page is filled from further on
+        for fileIndex in index.iterBucket(requestId, offset):
+            if len(matches) >= maxAmount:
+                break
+
+            path = fileTable.getPath(fileIndex)
+
+            if path == ignorePath:
+                continue
+
+            if self._existenceCache.exists(path):
+                matches.append(path)
+            elif self._settings['g:Mm_EnableFileWatcher']:
+                self._queueMissingFileRemoval(projectInfo, path)
+
+        return matches, len(fileList)
+
+    def _queueMissingFileRemoval(self, projectInfo, path):
+        # Let the watcher thread drop it from the index, once
+        with projectInfo.queuedRemovals.lock:
+            if path in projectInfo.queuedRemovals.value:
+                return
+
+            projectInfo.queuedRemovals.value.add(path)
+
+        self._fileChangeQueue.put((projectInfo.rootPath, FileChangeTypes.Removed, path))
+
+    def recordFileOpened(self, path):
+        """ Moves path ahead of the other files with the same humps in every project that has it """
+        path = self._getCanonicalPath(path)
+        openTime = time.time()
+
+        with self._lastOpenTimes.writeLock:
+            self._lastOpenTimes.value[path] = openTime
+
+        for projInfo in self._getProjectsContaining(path):
+            with projInfo.stats.acquire(projInfo.writeLock):
+                if projInfo.filesOpenedDuringScan is not None:
+                    # The new index would replace whatever we change here
+                    projInfo.filesOpenedDuringScan[path] = openTime
+
+                    # A first scan publishes snapshots that share its builder's file table
+                    if projInfo.index.fileTable is projInfo.scanFileTable:
+                        continue
+
+                fileIndex = projInfo.index.findFileIndex(path)
+
+                if fileIndex is None:
+                    continue
+
+                builder = ProjectIndexBuilder(projInfo.index)
+                builder.fileTable.openTimes[fileIndex] = openTime
+                builder.reorderFile(fileIndex)
+                self._publishIndex(projInfo, builder.publish())
+
+if __name__ == "__main__":
+    import io
+    import tempfile
+    from marksman.engine.Settings import createSettings
+    from marksman.util.ConsoleLog import ConsoleLog
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    with tempfile.TemporaryDirectory() as rootPath:
+        for relativePath in ['src/FooBar.py', 'src/fooBaz.py', 'test/FooBar.py', 'README.md']:
+            os.makedirs(os.path.dirname(os.path.join(rootPath, relativePath)), exist_ok=True)
+            open(os.path.join(rootPath, relativePath), 'w').close()
+
+        log = ConsoleLog(False)
+        engine = MarksmanEngine(createSettings({
+            'g:Mm_SearchPreferenceOrder': ['python'], 'g:Mm_EnablePersistentCache': 0,
+            'g:Mm_EnableFileWatcher': 0}), log)
+
+        assertIsEqual(engine.waitForProject(rootPath, 10.0), True)
+        assertIsEqual(engine.getMatches(rootPath, 'fb', 0, 10)[1], 3)
+        assertIsEqual(len(engine.lookupByFileName(rootPath, 'FooBar.py')), 2)
+
+        assertIsEqual([x.rootPath for x in engine._getProjectsContaining(os.path.join(rootPath, 'test/FooBar.py'))], [rootPath])
+        assertIsEqual(engine._getProjectsContaining(os.path.dirname(rootPath)), [])
+
+        engine.recordFileOpened(os.path.join(rootPath, 'test/FooBar.py'))
+        assertIsEqual(engine.getMatches(rootPath, 'fb', 0, 1)[0], [os.path.join(rootPath, 'test/FooBar.py')])
+
+        result = engine.updateSearch(rootPath, 'f', 0, 10)
+        assertIsEqual(result['matchesCount'], 0)
+        assertIsEqual(result['prefixMatchesCount'], 3)
+        engine.endSearch()
+
+        assertIsEqual(engine.getStats(rootPath)[0]['fileCount'], 4)
+        assertIsEqual(log.errors, [])
+
+        # Every thread that asks for a new project at the same time gets the same one
+        subPath = os.path.join(rootPath, 'src')
+        projectInfos = []
+        threads = [threading.Thread(target=lambda: projectInfos.append(engine._getProjectInfo(subPath))) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assertIsEqual(len(set(map(id, projectInfos))), 1)
+        assertIsEqual(engine.waitForProject(subPath, 10.0), True)
+
+        # Loading the cache of one project doesn't hold up creating another
+        slowEngine = MarksmanEngine(createSettings({
+            'g:Mm_SearchPreferenceOrder': ['python'], 'g:Mm_EnablePersistentCache': 0,
+            'g:Mm_EnableFileWatcher': 0}), log)
+        slowEngine._tryLoadProjectCache = lambda path, _: time.sleep(1.0) if path == subPath else None
+        slowThread = threading.Thread(target=lambda: slowEngine._getProjectInfo(subPath))
+        slowThread.start()
+        time.sleep(0.1)
+        startTime = time.time()
+        slowEngine._getProjectInfo(os.path.join(rootPath, 'test'))
+        assertIsEqual(time.time() - startTime < 0.5, True)
+        slowThread.join()
+
+        # A scan that fails is logged, and doesn't take its scan thread down with it
+        failingLog = ConsoleLog(False, io.StringIO())
+        failingEngine = MarksmanEngine(createSettings({
+            'g:Mm_SearchPreferenceOrder': ['custom'], 'g:Mm_EnablePersistentCache': 0,
+            'g:Mm_EnableFileWatcher': 0, 'g:Mm_ScanThreadCount': 1}), failingLog)
+
+        for _ in range(2):
+            failingEngine.forceRefresh(rootPath)
+            assertIsEqual(failingEngine.waitForProject(rootPath, 10.0), False)
+
+        assertIsEqual(len(failingLog.errors), 2)
+
+        os.utime(os.path.join(rootPath, 'src/fooBaz.py'), (2e9, 2e9))
+        lazyEngine = MarksmanEngine(createSettings({
+            'g:Mm_SearchPreferenceOrder': ['python'], 'g:Mm_EnablePersistentCache': 0,
+            'g:Mm_EnableFileWatcher': 0, 'g:Mm_LazyModificationTimes': 1}), log)
+
+        assertIsEqual(lazyEngine.waitForProject(rootPath, 10.0), True)
+        projectInfo = lazyEngine._getProjectInfo(rootPath)
+        assertIsEqual(projectInfo.unresolvedIds, {'', 'fb', 'readme'})
+        assertIsEqual(lazyEngine.getMatches(rootPath, 'fb', 0, 1)[0], [os.path.join(rootPath, 'src/fooBaz.py')])
+        assertIsEqual(projectInfo.unresolvedIds, {'', 'readme'})
+        # The bucket with every file is looked up in the background
+        lazyEngine.getMatches(rootPath, '', 0, 1)
+        startTime = time.time()
+
+        while projectInfo.unresolvedIds and time.time() - startTime < 10.0:
+            time.sleep(0.01)
+
+        assertIsEqual(projectInfo.unresolvedIds, set())
+        assertIsEqual(lazyEngine.getMatches(rootPath, '', 0, 1)[0], [os.path.join(rootPath, 'src/fooBaz.py')])
+        assertIsEqual(log.errors, [])
+
+        # Every thread of an engine that is shut down exits
+        threadCount = threading.active_count()
+        watchingEngine = MarksmanEngine(createSettings({
+            'g:Mm_SearchPreferenceOrder': ['python'], 'g:Mm_EnablePersistentCache': 0,
+            'g:Mm_EnableFileWatcher': 1, 'g:Mm_AutoSelectSearchType': 1, 'g:Mm_LazyModificationTimes': 1}), log)
+        assertIsEqual(watchingEngine.waitForProject(rootPath, 10.0), True)
+        watchingEngine.shutdown()
+        startTime = time.time()
+
+        while threading.active_count() > threadCount and time.time() - startTime < 10.0:
+            time.sleep(0.01)
+
+        assertIsEqual(threading.active_count(), threadCount)
+        assertIsEqual(watchingEngine.getStats(), [])
+
+    print("Tests passed")
@@ -0,0 +1,65 @@
+
+import time
+import random
+
+def getPercentile(sortedValues, percentile):
+    if not sortedValues:
+        return None
+
+    index = min(len(sortedValues) - 1, int(round(percentile / 100.0 * (len(sortedValues) - 1))))
+    return sortedValues[index]
+
+def sampleQueries(index, sampleSize, seed=0):
+    """
+    Picks sampleSize distinct humps from the index, and returns them along with every
+    one of their prefixes, since that is what gets sent while typing
+    """
+    rng = random.Random(seed)
+    ids = sorted(x for x in index.idMap if x)
+    sample = rng.sample(ids, min(sampleSize, len(ids)))
+    queries = []
+
+    for id in sample:
+        queries.extend(id[:i] for i in range(1, len(id) + 1))
+
+    return queries
+
+def measureQueries(engine, rootPath, queries, maxAmount, rounds=1):
+    """ Times updateSearch for each query, the same as the UI calls it.  Returns a dict of the latencies """
+    latencies = []
+
+    for _ in range(rounds):
+        for query in queries:
+            startTime = time.perf_counter()
+            engine.updateSearch(rootPath, query, 0, maxAmount)
+            latencies.append(time.perf_counter() - startTime)
+
+    engine.endSearch()
+    latencies.sort()
+
+    return {
+        'queryCount': len(latencies),
+        'p50Ms': getPercentile(latencies, 50) * 1000.0 if latencies else None,
+        'p99Ms': getPercentile(latencies, 99) * 1000.0 if latencies else None,
+        'maxMs': latencies[-1] * 1000.0 if latencies else None,
+    }
+
+if __name__ == "__main__":
+    from marksman.util.ProjectIndex import ProjectIndexBuilder
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    assertIsEqual(getPercentile([1, 2, 3, 4, 5], 50), 3)
+    assertIsEqual(getPercentile([1, 2, 3, 4, 5], 99), 5)
+    assertIsEqual(getPercentile([], 50), None)
+
+    builder = ProjectIndexBuilder()
+    builder.addFile('/a/FooBar.py', 'fb', 0.0)
+    builder.addFile('/a/Qux.py', 'q', 0.0)
+    queries = sampleQueries(builder.publish(), 10)
+    assertIsEqual(sorted(queries), ['f', 'fb', 'q'])
+    assertIsEqual(sampleQueries(builder.publish(), 10), queries)
+
+    print("Tests passed")
@@ -0,0 +1,94 @@
+
+import os
+import shutil
+
+# Mirrors the defaults in autoload/marksman.vim
+DefaultSettings = {
+    'g:Mm_IgnoreDirectoryPatterns': [],
+    'g:Mm_IgnoreFilePatterns': [],
+    'g:Mm_FollowLinks': 0,
+    'g:Mm_CustomSearchCommand': None,
+    'g:Mm_ShowHidden': 0,
+    'g:Mm_SearchPreferenceOrder': ['custom', 'gitindex', 'git', 'hg', 'rg', 'pt', 'ag', 'find', 'python'],
+    'g:Mm_EnableDebugLogging': 0,
+    'g:Mm_EnablePersistentCache': 1,
+    'g:Mm_CacheDirectory': None,
+    'g:Mm_EnableFileWatcher': 1,
+    'g:Mm_FileWatcherPollInterval': 2.0,
+    'g:Mm_StatThreadCount': 8,
+    'g:Mm_IngestProcessCount': 0,
+    'g:Mm_ProgressUpdateInterval': 0.25,
+    'g:Mm_ScanThreadCount': 2,
+    'g:Mm_AutoSelectSearchType': 0,
+    'g:Mm_LazyModificationTimes': 0,
+    'g:Mm_UseDaemon': 0,
+    'g:Mm_DaemonSocketPath': '',
+}
+
+SettingNames = list(DefaultSettings)
+
+# Everything else the engine reads, as expressions that marksman#evalAll evaluates
+EvaluatedNames = [
+    "exists('g:Mm_CustomSearchCommand')", "get(g:, 'Mm_RecurseSubmodules', 0)",
+    "executable('rg')", "executable('pt')", "executable('ag')", "executable('find')",
+    "executable('sed')", "executable('git')", "&encoding"
+]
+
+def _getDefaultCacheDirectory():
+    # The same place as stdpath('cache') . '/marksman', so that the caches are shared with neovim
+    if os.name == 'nt':
+        cacheRoot = os.path.join(os.environ.get('TEMP', os.path.expanduser('~')), 'nvim')
+    else:
+        cacheRoot = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'nvim')
+
+    return os.path.join(cacheRoot, 'marksman')
+
+def _evaluate(name, settings):
+    if name.startswith("executable('"):
+        return 1 if shutil.which(name[len("executable('"):-2]) else 0
+
+    if name == "exists('g:Mm_CustomSearchCommand')":
+        return 1 if settings['g:Mm_CustomSearchCommand'] else 0
+
+    if name == "get(g:, 'Mm_RecurseSubmodules', 0)":
+        return settings.get('g:Mm_RecurseSubmodules', 0)
+
+    if name == "&encoding":
+        return 'utf-8'
+
+    assert False, f'Unexpected setting expression "{name}"'
+
+def createSettings(overrides=None):
+    """
+    Returns the settings dict that MarksmanEngine takes, for when there is no neovim
+    to ask.  overrides uses the same names as the vim variables, eg.
+    {'g:Mm_ShowHidden': 1}, and the expressions in EvaluatedNames are worked out
+    the way vim would
+    """
+    settings = dict(DefaultSettings)
+    settings['g:Mm_CacheDirectory'] = _getDefaultCacheDirectory()
+    settings.update(overrides or {})
+
+    for name in EvaluatedNames:
+        if name not in settings:
+            settings[name] = _evaluate(name, settings)
+
+    return settings
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    settings = createSettings({'g:Mm_ShowHidden': 1, 'g:Mm_RecurseSubmodules': 1})
+    assertIsEqual(settings['g:Mm_ShowHidden'], 1)
+    assertIsEqual(settings["get(g:, 'Mm_RecurseSubmodules', 0)"], 1)
+    assertIsEqual(settings["exists('g:Mm_CustomSearchCommand')"], 0)
+    assertIsEqual(_evaluate("executable('marksman-missing-command')", settings), 0)
+    assertIsEqual(set(SettingNames + EvaluatedNames) <= set(settings), True)
+
+    settings = createSettings({"&encoding": 'latin1'})
+    assertIsEqual(settings["&encoding"], 'latin1')
+
+    print("Tests passed")
@@ -0,0 +1,2 @@
+from marksman.engine.MarksmanEngine import MarksmanEngine
+from marksman.engine.Settings import createSettings
@@ -12,21 +12,54 @@ else:
     import Queue
 
 
-def lfBytes2Str(bytes, encoding=None):
+# Size of each read from the output of the command in bulk mode
+BulkReadSize = 1 << 20
+# Number of chunks that can be waiting to be processed in bulk mode.  Once this many
+# are queued the reader stops reading, which blocks the command when the pipe fills up
+MaxQueuedChunks = 16
+# How often a reader that is blocked on a full queue checks whether it should stop
+StopCheckInterval = 0.1
+
+_defaultEncoding = None
+
+def _getDefaultEncoding():
+    # Looking up the locale is surprisingly slow, and it doesn't change
+    global _defaultEncoding
+
+    if _defaultEncoding is None:
+        _defaultEncoding = locale.getdefaultlocale()[1] or ''
+
+    return _defaultEncoding
+
+
+def lfBytes2Str(bytes, encoding=None, errors=None):
+    if errors:
+        # With errors like 'surrogateescape' this can't fail, so there's nothing to fall back to
+        return bytes.decode(encoding or _getDefaultEncoding() or 'utf-8', errors)
+
     try:
         if encoding:
             return bytes.decode(encoding)
         else:
-            if locale.getdefaultlocale()[1] is None:
+            if not _getDefaultEncoding():
                 return bytes.decode()
             else:
-                return bytes.decode(locale.getdefaultlocale()[1])
+                return bytes.decode(_getDefaultEncoding())
     except ValueError:
         return bytes.decode(errors="ignore")
     except UnicodeDecodeError:
         return bytes.decode(errors="ignore")
 
 
+def _splitLines(text):
+    lines = text.split('\n')
+
+    if '\r' in text:
+        lines = [x.rstrip('\r') for x in lines]
+
+    return lines
+
+
 class AsyncCommandExecutor(object):
     """
     A class to implement executing a command in subprocess, then
@@ -37,6 +70,8 @@ class AsyncCommandExecutor(object):
         self._errQueue = Queue.Queue()
         self._process = None
         self._finished = False
+        # Set once nobody is interested in the output anymore
+        self._stopEvent = threading.Event()
 
     def _readerThread(self, fd, queue, is_out):
         try:
@@ -49,13 +84,82 @@ class AsyncCommandExecutor(object):
             if is_out:
                 self._finished = True
 
-    def execute(self, cmd, encoding=None, cleanup=None):
+    def _putUnlessStopped(self, queue, item):
+        while not self._stopEvent.is_set():
+            try:
+                queue.put(item, timeout=StopCheckInterval)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def _bulkReaderThread(self, fd, queue, encoding, errors, transform):
+        # This thread owns the pipe and closes it itself, so that its file descriptor
+        # can't be reused while we are still reading from it
+        fileno = fd.fileno()
+        remainder = b""
+
+        try:
+            while True:
+                data = os.read(fileno, BulkReadSize)
+
+                if not data:
+                    break
+
+                if self._stopEvent.is_set():
+                    # Keep draining so that the command doesn't block on a full pipe
+                    continue
+
+                end = data.rfind(b"\n")
+
+                if end < 0:
+                    remainder += data
+                    continue
+
+                # Only whole lines are decoded, so multi-byte characters are never split
+                chunk = remainder + data[:end] if remainder else data[:end]
+                remainder = data[end + 1:]
+
+                self._putUnlessStopped(queue, self._decodeLines(chunk, encoding, errors, transform))
+
+            if remainder:
+                self._putUnlessStopped(queue, self._decodeLines(remainder, encoding, errors, transform))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._putUnlessStopped(queue, None)
+            self._finished = True
+
+            try:
+                fd.close()
+            except IOError:
+                pass
+
+    def _decodeLines(self, chunk, encoding, errors, transform):
+        lines = _splitLines(lfBytes2Str(chunk, encoding, errors))
+        return transform(lines) if transform else lines
+
+    def execute(self, cmd, encoding=None, cleanup=None, cwd=None, bulk=False, errors=None, transform=None):
+        """
+        In bulk mode the output is read in large chunks that are decoded and split
+        all at once, and the result can be iterated a batch of lines at a time with
+        iterBatches().  The amount of output held in memory is bounded.
+
+        transform is only used in bulk mode.  It is given each batch of lines on the
+        reader thread and returns what to yield instead, for example to parse the
+        lines into records
+
+        errors is passed on to bytes.decode.  Use 'surrogateescape' for paths, so that
+        ones that aren't valid in the encoding still refer to the same file
+        """
         if os.name == 'nt':
             self._process = subprocess.Popen(cmd, bufsize=-1,
                                              stdin=subprocess.PIPE,
                                              stdout=subprocess.PIPE,
                                              stderr=subprocess.PIPE,
                                              shell=True,
+                                             cwd=cwd,
                                              universal_newlines=False)
         else:
             self._process = subprocess.Popen(cmd, bufsize=-1,
@@ -63,12 +167,18 @@ class AsyncCommandExecutor(object):
                                              stderr=subprocess.PIPE,
                                              preexec_fn=os.setsid,
                                              shell=True,
+                                             cwd=cwd,
                                              universal_newlines=False)
 
         self._finished = False
 
-        stdout_thread = threading.Thread(target=self._readerThread,
-                                         args=(self._process.stdout, self._outQueue, True))
+        if bulk:
+            self._outQueue = Queue.Queue(maxsize=MaxQueuedChunks)
+            stdout_thread = threading.Thread(target=self._bulkReaderThread,
+                                             args=(self._process.stdout, self._outQueue, encoding, errors, transform))
+        else:
+            stdout_thread = threading.Thread(target=self._readerThread,
+                                             args=(self._process.stdout, self._outQueue, True))
         stdout_thread.daemon = True
         stdout_thread.start()
 
@@ -79,11 +189,14 @@ class AsyncCommandExecutor(object):
 
         stdout_thread.join(0.01)
 
-        result = AsyncCommandExecutor.Result(self._outQueue, self._errQueue, encoding, cleanup, self._process)
+        result = AsyncCommandExecutor.Result(
+            self._outQueue, self._errQueue, encoding, cleanup, self._process, self._stopEvent, bulk, errors)
 
         return result
 
     def killProcess(self):
+        self._stopEvent.set()
+
         # Popen.poll always returns None, bug?
         # if self._process and not self._process.poll():
         if self._process and not self._finished:
@@ -98,27 +211,66 @@ class AsyncCommandExecutor(object):
             self._process = None
 
     class Result(object):
-        def __init__(self, outQueue, errQueue, encoding, cleanup, process):
+        def __init__(self, outQueue, errQueue, encoding, cleanup, process, stopEvent=None, isBulk=False, errors=None):
             self._outQueue = outQueue
             self._errQueue = errQueue
             self._encoding = encoding
             self._cleanup = cleanup
             self._process = process
+            self._stopEvent = stopEvent
+            self._isBulk = isBulk
+            self._errors = errors
+
+        def iterBatches(self):
+            """ Yields lists of lines, or what transform returned for them.  Only available in bulk mode """
+            assert self._isBulk
+
+            try:
+                while True:
+                    try:
+                        lines = self._outQueue.get(timeout=StopCheckInterval)
+                    except Queue.Empty:
+                        # Once killed the reader may never get to queue the end marker
+                        if self._stopEvent.is_set():
+                            return
+                        continue
+
+                    if lines is None:
+                        break
+                    yield lines
+
+                err = b"".join(iter(self._errQueue.get, None))
+                if err:
+                    raise Exception(lfBytes2Str(err, self._encoding))
+            finally:
+                # Lets the reader thread finish even if we stopped early.  It closes the
+                # pipe itself
+                if self._stopEvent:
+                    self._stopEvent.set()
+
+                if self._cleanup:
+                    self._cleanup()
 
         def __iter__(self):
+            if self._isBulk:
+                for lines in self.iterBatches():
+                    for line in lines:
+                        yield line
+                return
+
             try:
                 if self._encoding:
                     while True:
                         line = self._outQueue.get()
                         if line is None:
                             break
-                        yield lfBytes2Str(line.rstrip(b"\r\n"), self._encoding)
+                        yield lfBytes2Str(line.rstrip(b"\r\n"), self._encoding, self._errors)
                 else:
                     while True:
                         line = self._outQueue.get()
                         if line is None:
                             break
-                        yield lfBytes2Str(line.rstrip(b"\r\n"))
+                        yield lfBytes2Str(line.rstrip(b"\r\n"), errors=self._errors)
 
                 err = b"".join(iter(self._errQueue.get, None))
                 if err:
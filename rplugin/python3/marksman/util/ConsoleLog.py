@@ -0,0 +1,52 @@
+
+import sys
+import traceback
+import threading
+
+# Thread safe logger with the same interface as Log, for running without neovim
+class ConsoleLog:
+    def __init__(self, includeDebugging, stream=None):
+        self.includeDebugging = includeDebugging
+        self._stream = stream or sys.stderr
+        self._lock = threading.Lock()
+        # Every error that was logged, so that callers can tell whether something failed
+        self.errors = []
+
+    def _write(self, message):
+        with self._lock:
+            self._stream.write(f'marksman: {message}\n')
+            self._stream.flush()
+
+    def info(self, message):
+        self._write(message)
+
+    def queueInfo(self, message):
+        self.info(message)
+
+    def error(self, message):
+        with self._lock:
+            self.errors.append(message)
+
+        self._write(message)
+
+    def queueError(self, message):
+        self.error(message)
+
+    def _getExceptionMessage(self, e):
+        if self.includeDebugging:
+            return ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+
+        return f'Error when running marksman search: {type(e).__name__}: {e}'
+
+    def exception(self, e):
+        self.error(self._getExceptionMessage(e))
+
+    def queueException(self, e):
+        self.exception(e)
+
+    def debug(self, message):
+        if self.includeDebugging:
+            self.info(message)
+
+    def queueDebug(self, message):
+        self.debug(message)
@@ -0,0 +1,165 @@
+
+import os
+import re
+import fnmatch
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from marksman.util.PathIngester import BatchedScanResult, IngestBatchSize
+from marksman.util.AsyncCommandExecutor import StopCheckInterval
+
+# On windows os.scandir gets the modification times along with the names, elsewhere
+# it would cost a stat call per file, which is better left to ModificationTimeCollector
+ScanDirHasModificationTimes = (os.name == 'nt')
+# Number of tasks handed to the pool ahead of time per thread, so that the threads
+# don't sit idle while we collect results
+PendingTasksPerThread = 4
+# Each task keeps walking into the sub directories it finds, up to this many
+# directories, and hands the rest back to be spread over the pool.  Handing out
+# every directory separately costs more than listing most of them
+DirectoriesPerTask = 32
+
+def compileIgnorePatterns(patterns):
+    """ Returns one regex that matches a name if any of the globs do, or None if there are none """
+    if not patterns:
+        return None
+
+    # Same as fnmatch.fnmatch, which compares using os.path.normcase
+    flags = re.IGNORECASE if os.name == 'nt' else 0
+    return re.compile('|'.join(fnmatch.translate(x) for x in patterns), flags)
+
+class DirectoryWalker:
+    """
+    Lists all the files under a directory in process, for when there are no external
+    search commands available.
+
+    Directories are listed on a pool of threads with os.scandir, since most of the
+    time is spent waiting on the file system.  The files come out as batches of
+    (path, modificationTime) records while the walk is still running.  Has the same
+    killProcess() as AsyncCommandExecutor so that the walk can be cancelled the same way
+    """
+    def __init__(self, ignoreDirectoryPatterns, ignoreFilePatterns, followLinks, threadCount):
+        self._ignoreDirectoryRegex = compileIgnorePatterns(ignoreDirectoryPatterns)
+        self._ignoreFileRegex = compileIgnorePatterns(ignoreFilePatterns)
+        self._followLinks = followLinks
+        self._threadCount = max(1, threadCount)
+        self._stopEvent = threading.Event()
+
+    def execute(self, rootDir):
+        return BatchedScanResult(self._iterBatches(rootDir))
+
+    def killProcess(self):
+        self._stopEvent.set()
+
+    def _walkDirectories(self, dirPath):
+        """
+        Returns the sub directories that were found but not walked yet, and the file
+        records of the ones that were
+        """
+        pendingDirs = [dirPath]
+        records = []
+
+        for _ in range(DirectoriesPerTask):
+            if not pendingDirs or self._stopEvent.is_set():
+                break
+
+            self._listDirectory(pendingDirs.pop(), pendingDirs, records)
+
+        return pendingDirs, records
+
+    def _listDirectory(self, dirPath, subDirs, records):
+        ignoreDirectoryRegex = self._ignoreDirectoryRegex
+        ignoreFileRegex = self._ignoreFileRegex
+
+        try:
+            with os.scandir(dirPath) as it:
+                for entry in it:
+                    name = entry.name
+
+                    try:
+                        # Uses the type from the directory listing when the file system has it
+                        isDir = entry.is_dir()
+                    except OSError:
+                        isDir = False
+
+                    if isDir:
+                        if ignoreDirectoryRegex and ignoreDirectoryRegex.match(name):
+                            continue
+
+                        if self._followLinks or not entry.is_symlink():
+                            subDirs.append(entry.path)
+
+                        continue
+
+                    if ignoreFileRegex and ignoreFileRegex.match(name):
+                        continue
+
+                    modificationTime = None
+
+                    if ScanDirHasModificationTimes:
+                        try:
+                            modificationTime = entry.stat().st_mtime
+                        except OSError:
+                            pass
+
+                    records.append((entry.path, modificationTime))
+        except OSError:
+            # Directories we can't read are skipped, like find does
+            pass
+
+    def _iterBatches(self, rootDir):
+        pool = ThreadPoolExecutor(max_workers=self._threadCount)
+        maxPending = self._threadCount * PendingTasksPerThread
+        queuedDirs = [rootDir]
+        pending = set()
+        batch = []
+
+        try:
+            while queuedDirs or pending:
+                # Depth first, so the number of queued directories stays small
+                while queuedDirs and len(pending) < maxPending:
+                    pending.add(pool.submit(self._walkDirectories, queuedDirs.pop()))
+
+                done, pending = wait(pending, timeout=StopCheckInterval, return_when=FIRST_COMPLETED)
+
+                if self._stopEvent.is_set():
+                    return
+
+                for future in done:
+                    subDirs, records = future.result()
+                    queuedDirs.extend(subDirs)
+                    batch.extend(records)
+
+                if len(batch) >= IngestBatchSize:
+                    yield batch
+                    batch = []
+
+            if batch:
+                yield batch
+        finally:
+            self._stopEvent.set()
+
+            for future in pending:
+                future.cancel()
+
+            pool.shutdown(wait=False)
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    regex = compileIgnorePatterns(['*.pyc', 'bin'])
+    assertIsEqual(bool(regex.match('foo.pyc')), True)
+    assertIsEqual(bool(regex.match('bin')), True)
+    assertIsEqual(bool(regex.match('binary')), False)
+    assertIsEqual(compileIgnorePatterns([]), None)
+
+    if len(sys.argv) > 1:
+        startTime = time.time()
+        count = sum(1 for _ in DirectoryWalker([], [], False, 8).execute(sys.argv[1]))
+        print(f'Found {count} files in {time.time() - startTime:0.3f} seconds')
+
+    print("Tests passed")
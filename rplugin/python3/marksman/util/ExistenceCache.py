@@ -0,0 +1,68 @@
+
+import os
+import time
+
+# Only prune once we've grown past this, since a session rarely looks at more
+MaxEntries = 10000
+
+class ExistenceCache:
+    """
+    Remembers whether paths exist for a short while, so that redrawing the same
+    page of results every frame doesn't stat the same files again.
+
+    Paths that were found missing are tombstoned for longer than paths that
+    exist, since they usually stay missing until the index catches up
+    """
+    def __init__(self, timeToLive, tombstoneTimeToLive):
+        self._timeToLive = timeToLive
+        self._tombstoneTimeToLive = tombstoneTimeToLive
+        # path -> (expiry time, exists)
+        self._entries = {}
+
+    def exists(self, path):
+        now = time.monotonic()
+        entry = self._entries.get(path)
+
+        if entry and entry[0] > now:
+            return entry[1]
+
+        exists = os.path.exists(path)
+
+        if len(self._entries) >= MaxEntries:
+            self._prune(now)
+
+        self._entries[path] = (now + (self._timeToLive if exists else self._tombstoneTimeToLive), exists)
+        return exists
+
+    def invalidate(self, path):
+        self._entries.pop(path, None)
+
+    def _prune(self, now):
+        self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+
+        if len(self._entries) >= MaxEntries:
+            self._entries.clear()
+
+if __name__ == "__main__":
+    import tempfile
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        path = os.path.join(tempDir, 'foo.txt')
+        cache = ExistenceCache(60, 60)
+
+        assertIsEqual(cache.exists(path), False)
+        open(path, 'w').close()
+        # Still tombstoned
+        assertIsEqual(cache.exists(path), False)
+        cache.invalidate(path)
+        assertIsEqual(cache.exists(path), True)
+
+        cache = ExistenceCache(0, 0)
+        os.remove(path)
+        assertIsEqual(cache.exists(path), False)
+
+    print("Tests passed")
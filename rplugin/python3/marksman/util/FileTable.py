@@ -0,0 +1,125 @@
+
+import os
+from array import array
+
+class FileTable:
+    """
+    Struct of arrays holding every file of a project.  Files are referred to
+    by their integer index everywhere else (eg. in the hump buckets) so that we
+    don't need a python object per file.
+
+    Directory paths, names and humps are interned since they repeat a lot
+    (think 'src', 'index.js' or '__init__.py') and the full path is only
+    rebuilt when needed
+    """
+    def __init__(self):
+        self.directories = []
+        self.directoryIndices = array('l')
+        self.names = []
+        self.ids = []
+        # Seconds since epoch, 0 when unknown
+        self.modificationTimes = array('d')
+        # Sparse since only a handful of files get opened in a session
+        self.openTimes = {}
+        self.removedIndices = set()
+        self._directoryLookup = {}
+        # Directory index -> {name: file index}, so that finding a path is two dict
+        # lookups.  The names are the interned ones, so no strings are duplicated
+        self._filesByDirectory = []
+        self._interned = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _intern(self, value):
+        return self._interned.setdefault(value, value)
+
+    def add(self, path, id, modificationTime=0.0):
+        dirPath, name = os.path.split(path)
+
+        directoryIndex = self._directoryLookup.get(dirPath)
+
+        if directoryIndex is None:
+            directoryIndex = len(self.directories)
+            self.directories.append(dirPath)
+            self._directoryLookup[dirPath] = directoryIndex
+            self._filesByDirectory.append({})
+
+        index = len(self.names)
+        name = self._intern(name)
+        self.directoryIndices.append(directoryIndex)
+        self.names.append(name)
+        self._filesByDirectory[directoryIndex][name] = index
+        self.ids.append(self._intern(id))
+        self.modificationTimes.append(modificationTime)
+        return index
+
+    def remove(self, index):
+        # Indices must stay stable and older snapshots may still refer to this
+        # entry, so just mark it.  The space is reclaimed by the next scan
+        self.removedIndices.add(index)
+        self.openTimes.pop(index, None)
+
+        files = self._filesByDirectory[self.directoryIndices[index]]
+
+        # Unless the same path has been added again since
+        if files.get(self.names[index]) == index:
+            del files[self.names[index]]
+
+    def findDirectoryIndex(self, dirPath):
+        """ Returns None if no file was ever added to dirPath """
+        return self._directoryLookup.get(dirPath)
+
+    def findFile(self, path):
+        """ Returns the index of the file at path, or None if it isn't in the table """
+        dirPath, name = os.path.split(path)
+        directoryIndex = self._directoryLookup.get(dirPath)
+
+        if directoryIndex is None:
+            return None
+
+        return self._filesByDirectory[directoryIndex].get(name)
+
+    def getFilesInDirectory(self, directoryIndex):
+        """ The indices of the files directly inside the directory, leaving out removed ones """
+        return list(self._filesByDirectory[directoryIndex].values())
+
+    def isRemoved(self, index):
+        return index in self.removedIndices
+
+    def getPath(self, index):
+        return os.path.join(self.directories[self.directoryIndices[index]], self.names[index])
+
+    def getChangeTime(self, index):
+        return max(self.modificationTimes[index], self.openTimes.get(index, 0.0))
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    table = FileTable()
+    first = table.add('/foo/src/FooBar.py', 'fb', 10.0)
+    second = table.add('/foo/src/fooBar.cpp', 'fb')
+
+    assertIsEqual(table.getPath(first), '/foo/src/FooBar.py')
+    assertIsEqual(len(table.directories), 1)
+    assertIsEqual(table.ids[first] is table.ids[second], True)
+    assertIsEqual(table.getChangeTime(first), 10.0)
+    assertIsEqual(table.findDirectoryIndex('/foo/src'), table.directoryIndices[first])
+    assertIsEqual(table.findDirectoryIndex('/foo'), None)
+    assertIsEqual(table.findFile('/foo/src/fooBar.cpp'), second)
+    assertIsEqual(table.findFile('/foo/src/Missing.py'), None)
+    assertIsEqual(table.findFile('/bar/FooBar.py'), None)
+
+    table.openTimes[second] = 20.0
+    assertIsEqual(table.getChangeTime(second), 20.0)
+
+    table.remove(first)
+    assertIsEqual(table.isRemoved(first), True)
+    assertIsEqual(table.findFile('/foo/src/FooBar.py'), None)
+    assertIsEqual(table.getFilesInDirectory(table.directoryIndices[second]), [second])
+    assertIsEqual(len(table), 2)
+
+    print("Tests passed")
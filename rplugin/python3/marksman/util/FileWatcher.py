@@ -0,0 +1,386 @@
+
+import os
+import sys
+import struct
+import select
+import fnmatch
+import threading
+import ctypes
+import ctypes.util
+
+class FileChangeTypes:
+    Added = 'added'
+    Removed = 'removed'
+    Modified = 'modified'
+    DirectoryRemoved = 'directoryRemoved'
+    # Too many changes were dropped to track them individually, so the
+    # project needs a full rescan
+    Overflow = 'overflow'
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WatchMask = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+             | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EventHeaderFormat = 'iIII'
+EventHeaderSize = struct.calcsize(EventHeaderFormat)
+
+class FileWatcherBase:
+    """
+    Watches a fixed set of directories belonging to a project and pushes
+    (rootPath, changeType, path) tuples onto changeQueue.  Subclasses implement _run,
+    which runs on its own thread until stop is called.
+
+    showHidden overrides g:Mm_ShowHidden, for search types that list hidden files
+    either way
+    """
+    def __init__(self, rootPath, directories, changeQueue, vimSettings, showHidden=None):
+        self._rootPath = rootPath
+        self._directories = directories
+        self._changeQueue = changeQueue
+        self._vimSettings = vimSettings
+        self._ignoreDirPatterns = vimSettings["g:Mm_IgnoreDirectoryPatterns"] or []
+        self._ignoreFilePatterns = vimSettings["g:Mm_IgnoreFilePatterns"] or []
+        self._showHidden = vimSettings["g:Mm_ShowHidden"] if showHidden is None else showHidden
+        self._followLinks = vimSettings["g:Mm_FollowLinks"]
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def _shouldIgnoreDirectory(self, name):
+        if not self._showHidden and name.startswith('.'):
+            return True
+        return any(fnmatch.fnmatch(name, x) for x in self._ignoreDirPatterns)
+
+    def _shouldIgnoreFile(self, name):
+        if not self._showHidden and name.startswith('.'):
+            return True
+        return any(fnmatch.fnmatch(name, x) for x in self._ignoreFilePatterns)
+
+    def _post(self, changeType, path):
+        self._changeQueue.put((self._rootPath, changeType, path))
+
+    def _walkNewDirectory(self, dirPath, onDirectory):
+        """ Reports every file below a directory that appeared after the scan """
+        stack = [dirPath]
+
+        while stack:
+            current = stack.pop()
+
+            if not onDirectory(current):
+                continue
+
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=self._followLinks):
+                                if not self._shouldIgnoreDirectory(entry.name):
+                                    stack.append(entry.path)
+                            elif not self._shouldIgnoreFile(entry.name):
+                                self._post(FileChangeTypes.Added, entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        # die when the main thread dies
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopEvent.set()
+
+class InotifyFileWatcher(FileWatcherBase):
+    """ Linux only.  Raises OSError from start() if the watches cannot be added """
+
+    _libc = None
+
+    @classmethod
+    def isSupported(cls):
+        if not sys.platform.startswith('linux'):
+            return False
+
+        if cls._libc is None:
+            try:
+                cls._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                cls._libc.inotify_init1
+            except (OSError, AttributeError):
+                cls._libc = False
+
+        return bool(cls._libc)
+
+    def __init__(self, rootPath, directories, changeQueue, vimSettings, showHidden=None):
+        super().__init__(rootPath, directories, changeQueue, vimSettings, showHidden)
+        self._fd = -1
+        self._watchPaths = {}
+        self._watchIds = {}
+        # Held while the watches change, so that stop can remove them from another thread
+        self._watchLock = threading.Lock()
+
+    def _addWatch(self, dirPath):
+        if dirPath in self._watchIds:
+            return True
+
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirPath), WatchMask)
+
+        if wd < 0:
+            error = ctypes.get_errno()
+            # The directory might have been removed in the meantime, which is fine,
+            # but running out of watches means this watcher cannot do its job
+            if error in (2, 20):  # ENOENT, ENOTDIR
+                return False
+            raise OSError(error, f'inotify_add_watch failed for "{dirPath}": {os.strerror(error)}')
+
+        self._watchPaths[wd] = dirPath
+        self._watchIds[dirPath] = wd
+        return True
+
+    def _removeWatchesUnder(self, dirPath):
+        prefix = dirPath + os.sep
+
+        for path in [x for x in self._watchIds if x == dirPath or x.startswith(prefix)]:
+            wd = self._watchIds.pop(path)
+            del self._watchPaths[wd]
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def start(self):
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f'inotify_init1 failed: {os.strerror(error)}')
+
+        try:
+            for dirPath in self._directories:
+                self._addWatch(dirPath)
+        except OSError:
+            os.close(self._fd)
+            self._fd = -1
+            raise
+
+        super().start()
+
+    def stop(self):
+        # The watches are released right away instead of once _run notices, since the
+        # watcher that replaces this one adds its own, and both count towards
+        # fs.inotify.max_user_watches
+        with self._watchLock:
+            super().stop()
+
+            if self._fd >= 0:
+                for wd in self._watchPaths:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+
+            self._watchPaths.clear()
+            self._watchIds.clear()
+
+    def _run(self):
+        try:
+            while not self._stopEvent.is_set():
+                readable, _, _ = select.select([self._fd], [], [], 0.5)
+
+                if not readable:
+                    continue
+
+                with self._watchLock:
+                    # Everything left is from before stop
+                    if self._stopEvent.is_set():
+                        break
+
+                    try:
+                        buf = os.read(self._fd, 256 * 1024)
+                    except BlockingIOError:
+                        continue
+
+                    self._processEvents(buf)
+        finally:
+            # Under the lock, so that stop never uses the number after it was reused
+            with self._watchLock:
+                os.close(self._fd)
+                self._fd = -1
+
+    def _processEvents(self, buf):
+        offset = 0
+
+        while offset + EventHeaderSize <= len(buf):
+            wd, mask, _, nameLen = struct.unpack_from(EventHeaderFormat, buf, offset)
+            offset += EventHeaderSize
+            name = os.fsdecode(buf[offset:offset + nameLen].rstrip(b'\0'))
+            offset += nameLen
+
+            if mask & IN_Q_OVERFLOW:
+                self._post(FileChangeTypes.Overflow, self._rootPath)
+                continue
+
+            dirPath = self._watchPaths.get(wd)
+
+            if dirPath is None:
+                continue
+
+            if mask & IN_IGNORED:
+                self._watchPaths.pop(wd, None)
+                self._watchIds.pop(dirPath, None)
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._removeWatchesUnder(dirPath)
+                self._post(FileChangeTypes.DirectoryRemoved, dirPath)
+                continue
+
+            path = os.path.join(dirPath, name)
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if not self._shouldIgnoreDirectory(name):
+                        try:
+                            self._walkNewDirectory(path, self._addWatch)
+                        except OSError:
+                            # Out of watches, so let a full refresh sort it out
+                            self._post(FileChangeTypes.Overflow, self._rootPath)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._removeWatchesUnder(path)
+                    self._post(FileChangeTypes.DirectoryRemoved, path)
+                continue
+
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if not self._shouldIgnoreFile(name):
+                    self._post(FileChangeTypes.Added, path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._post(FileChangeTypes.Removed, path)
+            elif mask & (IN_CLOSE_WRITE | IN_ATTRIB):
+                self._post(FileChangeTypes.Modified, path)
+
+class PollingFileWatcher(FileWatcherBase):
+    """
+    Fallback for platforms without inotify or when we run out of watches.
+    Only directory modification times are polled, so this catches added, removed
+    and renamed files but not changes to the contents of existing files
+    """
+    def __init__(self, rootPath, directories, changeQueue, vimSettings, showHidden=None):
+        super().__init__(rootPath, directories, changeQueue, vimSettings, showHidden)
+        self._interval = vimSettings['g:Mm_FileWatcherPollInterval']
+        # dir path -> (modification time, file names, sub directory names)
+        self._snapshots = {}
+
+    def _takeSnapshot(self, dirPath):
+        try:
+            modTime = os.stat(dirPath).st_mtime
+            files = set()
+            dirs = set()
+
+            with os.scandir(dirPath) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=self._followLinks):
+                            dirs.add(entry.name)
+                        else:
+                            files.add(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+
+        return (modTime, files, dirs)
+
+    def _trackDirectory(self, dirPath):
+        if dirPath in self._snapshots:
+            return True
+
+        snapshot = self._takeSnapshot(dirPath)
+
+        if snapshot is None:
+            return False
+
+        self._snapshots[dirPath] = snapshot
+        return True
+
+    def _forgetDirectoriesUnder(self, dirPath):
+        prefix = dirPath + os.sep
+
+        for path in [x for x in self._snapshots if x == dirPath or x.startswith(prefix)]:
+            del self._snapshots[path]
+
+    def _run(self):
+        for dirPath in self._directories:
+            self._trackDirectory(dirPath)
+
+        while not self._stopEvent.wait(self._interval):
+            for dirPath in list(self._snapshots.keys()):
+                if self._stopEvent.is_set():
+                    return
+
+                oldSnapshot = self._snapshots.get(dirPath)
+
+                if oldSnapshot is None:
+                    # Removed while handling an ancestor
+                    continue
+
+                try:
+                    modTime = os.stat(dirPath).st_mtime
+                except OSError:
+                    self._forgetDirectoriesUnder(dirPath)
+                    self._post(FileChangeTypes.DirectoryRemoved, dirPath)
+                    continue
+
+                if modTime == oldSnapshot[0]:
+                    continue
+
+                newSnapshot = self._takeSnapshot(dirPath)
+
+                if newSnapshot is None:
+                    continue
+
+                self._snapshots[dirPath] = newSnapshot
+                self._postDifferences(dirPath, oldSnapshot, newSnapshot)
+
+    def _postDifferences(self, dirPath, oldSnapshot, newSnapshot):
+        _, oldFiles, oldDirs = oldSnapshot
+        _, newFiles, newDirs = newSnapshot
+
+        for name in newFiles - oldFiles:
+            if not self._shouldIgnoreFile(name):
+                self._post(FileChangeTypes.Added, os.path.join(dirPath, name))
+
+        for name in oldFiles - newFiles:
+            self._post(FileChangeTypes.Removed, os.path.join(dirPath, name))
+
+        for name in oldDirs - newDirs:
+            path = os.path.join(dirPath, name)
+            self._forgetDirectoriesUnder(path)
+            self._post(FileChangeTypes.DirectoryRemoved, path)
+
+        for name in newDirs - oldDirs:
+            if not self._shouldIgnoreDirectory(name):
+                self._walkNewDirectory(os.path.join(dirPath, name), self._trackDirectory)
+
+def createFileWatcher(rootPath, directories, changeQueue, vimSettings, showHidden=None):
+    """ Returns a started watcher, preferring inotify when it is available """
+
+    if InotifyFileWatcher.isSupported():
+        watcher = InotifyFileWatcher(rootPath, directories, changeQueue, vimSettings, showHidden)
+
+        try:
+            watcher.start()
+            return watcher
+        except OSError:
+            # Most likely fs.inotify.max_user_watches is too low for this project
+            pass
+
+    watcher = PollingFileWatcher(rootPath, directories, changeQueue, vimSettings, showHidden)
+    watcher.start()
+    return watcher
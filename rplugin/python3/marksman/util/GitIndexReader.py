@@ -0,0 +1,372 @@
+
+import os
+import mmap
+import struct
+
+_headerStruct = struct.Struct('>4sII')
+# ctime, mtime (seconds and nanoseconds each), dev, ino, mode, uid, gid, size
+_entryStatStruct = struct.Struct('>IIIIIIIIII')
+_flagsStruct = struct.Struct('>H')
+
+HashSize = 20
+# Stat data, hash and flags
+EntryHeaderSize = _entryStatStruct.size + HashSize + _flagsStruct.size
+
+ExtendedFlag = 0x4000
+StageMask = 0x3000
+# Only in the extended flags of version 3 and up
+SkipWorktreeFlag = 0x4000
+
+ModeTypeMask = 0o170000
+GitLinkMode = 0o160000
+
+# Extensions that change what the entries mean.  A split index only holds the
+# changes on top of another file, so we'd have to read both
+_unsupportedExtensions = (b'link',)
+
+def findGitDirectory(path):
+    """
+    Returns (workTreePath, gitDirPath) for the repository that contains path, or None.
+    Handles the .git files that submodules and worktrees use in place of a directory
+    """
+    path = os.path.abspath(path)
+
+    while True:
+        dotGit = os.path.join(path, '.git')
+
+        if os.path.exists(dotGit):
+            gitDir = _getGitDirectory(path)
+            return (path, gitDir) if gitDir else None
+
+        parent = os.path.dirname(path)
+
+        if parent == path:
+            return None
+
+        path = parent
+
+def _getGitDirectory(workTreePath):
+    dotGit = os.path.join(workTreePath, '.git')
+
+    if os.path.isdir(dotGit):
+        return dotGit
+
+    if os.path.isfile(dotGit):
+        return _readGitFile(dotGit)
+
+    return None
+
+def _readGitFile(dotGitPath):
+    try:
+        with open(dotGitPath, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            contents = f.read().strip()
+    except OSError:
+        return None
+
+    if not contents.startswith('gitdir:'):
+        return None
+
+    gitDir = contents[len('gitdir:'):].strip()
+    return os.path.normpath(os.path.join(os.path.dirname(dotGitPath), gitDir))
+
+def _readVarint(buf, offset):
+    # Not the usual LEB128, every continuation adds one.  See varint.c in git
+    c = buf[offset]
+    offset += 1
+    value = c & 0x7f
+
+    while c & 0x80:
+        c = buf[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (c & 0x7f)
+
+    return value, offset
+
+def _parseEntries(buf):
+    """
+    Returns a list of (path, modificationTime, mode) and the offset just past the
+    last entry, or None if the format isn't supported
+    """
+    if len(buf) < _headerStruct.size:
+        return None
+
+    signature, version, entryCount = _headerStruct.unpack_from(buf, 0)
+
+    if signature != b'DIRC' or version not in (2, 3, 4):
+        return None
+
+    offset = _headerStruct.size
+    entries = []
+    previousPath = b''
+    lastAddedPath = None
+    unpackStat = _entryStatStruct.unpack_from
+    unpackFlags = _flagsStruct.unpack_from
+    hashEnd = _entryStatStruct.size + HashSize
+
+    for _ in range(entryCount):
+        entryStart = offset
+        (_, _, mtimeSeconds, mtimeNanoseconds, _, _, mode, _, _, _) = unpackStat(buf, offset)
+        flags, = unpackFlags(buf, offset + hashEnd)
+        offset += EntryHeaderSize
+
+        isConflicted = (flags & StageMask) != 0
+        isSkipped = False
+
+        if flags & ExtendedFlag:
+            if version < 3:
+                return None
+
+            extendedFlags, = unpackFlags(buf, offset)
+            offset += _flagsStruct.size
+
+            # Sparse checkouts leave these out of the work tree
+            if extendedFlags & SkipWorktreeFlag:
+                isSkipped = True
+
+        if version == 4:
+            removeCount, offset = _readVarint(buf, offset)
+            end = _findNul(buf, offset)
+            path = previousPath[:len(previousPath) - removeCount] + buf[offset:end]
+            offset = end + 1
+        else:
+            end = _findNul(buf, offset)
+            path = buf[offset:end]
+            # Entries are padded with 1 to 8 nul bytes up to a multiple of 8
+            offset = entryStart + ((end - entryStart + 8) & ~7)
+
+        previousPath = path
+
+        # Conflicted files have one entry per stage, just keep the first
+        if isConflicted and path == lastAddedPath:
+            continue
+
+        if not isSkipped:
+            # Files added with --intent-to-add have no stat data yet
+            modificationTime = mtimeSeconds + mtimeNanoseconds / 1e9 if mtimeSeconds else None
+            entries.append((path, modificationTime, mode))
+            lastAddedPath = path
+
+    return entries, offset
+
+def _findNul(buf, offset):
+    end = buf.find(b'\0', offset)
+
+    if end < 0:
+        raise ValueError('Truncated git index entry')
+
+    return end
+
+def _hasUnsupportedExtension(buf, offset):
+    end = len(buf) - HashSize
+
+    while offset + 8 <= end:
+        signature = buf[offset:offset + 4]
+        size, = struct.unpack_from('>I', buf, offset + 4)
+
+        if signature in _unsupportedExtensions:
+            return True
+
+        offset += 8 + size
+
+    return False
+
+def _readIndexFile(indexPath):
+    try:
+        with open(indexPath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                result = _parseEntries(buf)
+
+                if result is None:
+                    return None
+
+                entries, offset = result
+
+                if _hasUnsupportedExtension(buf, offset):
+                    return None
+
+                return entries
+    except (OSError, ValueError, IndexError, struct.error):
+        return None
+
+def readGitIndex(dirPath, recurseSubmodules=False):
+    """
+    Returns (path, modificationTime) for every tracked file under dirPath, with the
+    paths relative to dirPath.  The modification times are the ones git cached the
+    last time it looked at each file, so most of the time they are current.  They
+    are None where git hasn't recorded one.
+
+    Returns None if dirPath isn't in a git repository, or the index uses something
+    we can't read, in which case 'git ls-files' should be used instead
+    """
+    repository = findGitDirectory(dirPath)
+
+    if not repository:
+        return None
+
+    workTreePath, gitDirPath = repository
+    results = []
+
+    if not _addIndexEntries(results, workTreePath, gitDirPath, os.path.abspath(dirPath), recurseSubmodules):
+        return None
+
+    return results
+
+def _addIndexEntries(results, workTreePath, gitDirPath, dirPath, recurseSubmodules):
+    entries = _readIndexFile(os.path.join(gitDirPath, 'index'))
+
+    if entries is None:
+        return False
+
+    # Index paths are relative to the root of the work tree and always use '/'
+    relativeDir = os.path.relpath(dirPath, workTreePath)
+
+    if relativeDir == '.':
+        prefix = b''
+        outputPrefix = ''
+    elif relativeDir == '..' or relativeDir.startswith('..' + os.sep):
+        # A submodule somewhere under dirPath.  Not just startswith('..'), since
+        # directories can be named eg. '..cache'
+        prefix = b''
+        outputPrefix = os.path.join(os.path.relpath(workTreePath, dirPath), '')
+    else:
+        prefix = os.fsencode(relativeDir.replace(os.sep, '/') + '/')
+        outputPrefix = ''
+
+    for path, modificationTime, mode in entries:
+        if prefix:
+            if not path.startswith(prefix):
+                continue
+
+            path = path[len(prefix):]
+
+        relativePath = outputPrefix + path.decode('utf-8', 'surrogateescape')
+
+        if (mode & ModeTypeMask) == GitLinkMode:
+            if recurseSubmodules:
+                submodulePath = os.path.join(dirPath, relativePath)
+                submoduleGitDir = _getGitDirectory(submodulePath)
+
+                # Skip submodules that aren't checked out, or that we can't read
+                if submoduleGitDir:
+                    _addIndexEntries(results, submodulePath, submoduleGitDir, dirPath, True)
+
+            continue
+
+        results.append((relativePath, modificationTime))
+
+    return True
+
+if __name__ == "__main__":
+    import tempfile
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    def encodeVarint(value):
+        # The inverse of _readVarint, like encode_varint in git
+        result = [value & 0x7f]
+        value >>= 7
+
+        while value:
+            value -= 1
+            result.insert(0, 0x80 | (value & 0x7f))
+            value >>= 7
+
+        return bytes(result)
+
+    def buildIndex(version, entries, extensions=b''):
+        """ entries are (path, mtimeSeconds, stage, extendedFlags or None, mode) """
+        parts = [_headerStruct.pack(b'DIRC', version, len(entries))]
+        previousPath = b''
+
+        for path, mtimeSeconds, stage, extendedFlags, mode in entries:
+            flags = (stage << 12) | min(len(path), 0xfff)
+
+            if extendedFlags is not None:
+                flags |= ExtendedFlag
+
+            entry = _entryStatStruct.pack(0, 0, mtimeSeconds, 500000000 if mtimeSeconds else 0, 0, 0, mode, 0, 0, 0)
+            entry += b'\0' * HashSize + _flagsStruct.pack(flags)
+
+            if extendedFlags is not None:
+                entry += _flagsStruct.pack(extendedFlags)
+
+            if version == 4:
+                commonLength = len(os.path.commonprefix([previousPath, path]))
+                entry += encodeVarint(len(previousPath) - commonLength) + path[commonLength:] + b'\0'
+            else:
+                entry += path + b'\0' * (8 - (len(entry) + len(path)) % 8)
+
+            parts.append(entry)
+            previousPath = path
+
+        return b''.join(parts) + extensions + b'\0' * HashSize
+
+    FileMode = 0o100644
+
+    for value in (0, 1, 127, 128, 255, 16511, 16512, 1 << 40):
+        assertIsEqual(_readVarint(encodeVarint(value), 0), (value, len(encodeVarint(value))))
+
+    # Every continuation adds one, so this is 128 and not 0
+    assertIsEqual(_readVarint(b'\x80\x00', 0), (128, 2))
+
+    # Paths of every length mod 8, so that every amount of padding comes up
+    paths = [b'a' * x + b'.txt' for x in range(1, 9)]
+
+    for version in (2, 3, 4):
+        buf = buildIndex(version, [(x, 1000, 0, None, FileMode) for x in paths])
+        entries, offset = _parseEntries(buf)
+        assertIsEqual([x[0] for x in entries], paths)
+        assertIsEqual(entries[0][1], 1000.5)
+        assertIsEqual(offset, len(buf) - HashSize)
+
+    # Prefix compressed paths that drop more than 127 bytes of the previous one
+    longPaths = [b'd' * 200 + b'/One.txt', b'd' * 200 + b'/Two.txt', b'Short.txt', b'Short.txt2']
+    entries, _ = _parseEntries(buildIndex(4, [(x, 1000, 0, None, FileMode) for x in longPaths]))
+    assertIsEqual([x[0] for x in entries], longPaths)
+
+    # Sparse checkouts, which need version 3
+    skipEntries = [(b'Kept.txt', 1000, 0, 0, FileMode), (b'Skipped.txt', 1000, 0, SkipWorktreeFlag, FileMode)]
+    entries, _ = _parseEntries(buildIndex(3, skipEntries))
+    assertIsEqual([x[0] for x in entries], [b'Kept.txt'])
+    assertIsEqual(_parseEntries(buildIndex(2, skipEntries)), None)
+
+    # One entry per stage of a conflicted file, and intent-to-add without stat data
+    entries, _ = _parseEntries(buildIndex(2, [
+        (b'Conflict.txt', 1000, 1, None, FileMode), (b'Conflict.txt', 1000, 2, None, FileMode),
+        (b'Conflict.txt', 1000, 3, None, FileMode), (b'Intent.txt', 0, 0, None, FileMode)]))
+    assertIsEqual(entries, [(b'Conflict.txt', 1000.5, FileMode), (b'Intent.txt', None, FileMode)])
+
+    assertIsEqual(_parseEntries(b'DIRC' + struct.pack('>II', 5, 0)), None)
+
+    with tempfile.TemporaryDirectory() as rootPath:
+        gitDir = os.path.join(rootPath, '.git')
+        os.makedirs(gitDir)
+        os.makedirs(os.path.join(rootPath, '..cache'))
+        os.makedirs(os.path.join(rootPath, 'sub'))
+        indexEntries = [(x, 1000, 0, None, FileMode) for x in [b'..cache/Cached.txt', b'Root.txt', b'sub/Nested.txt']]
+
+        def writeIndex(extensions=b''):
+            with open(os.path.join(gitDir, 'index'), 'wb') as f:
+                f.write(buildIndex(2, indexEntries, extensions))
+
+        writeIndex()
+        assertIsEqual(findGitDirectory(os.path.join(rootPath, 'sub')), (rootPath, gitDir))
+        assertIsEqual(len(readGitIndex(rootPath)), 3)
+        assertIsEqual(readGitIndex(os.path.join(rootPath, 'sub')), [('Nested.txt', 1000.5)])
+        assertIsEqual(readGitIndex(os.path.join(rootPath, '..cache')), [('Cached.txt', 1000.5)])
+
+        # A cache tree is fine, a split index isn't
+        writeIndex(b'TREE' + struct.pack('>I', 4) + b'\0' * 4)
+        assertIsEqual(len(readGitIndex(rootPath)), 3)
+        writeIndex(b'link' + struct.pack('>I', HashSize) + b'\0' * HashSize)
+        assertIsEqual(readGitIndex(rootPath), None)
+
+    with tempfile.TemporaryDirectory() as rootPath:
+        assertIsEqual(readGitIndex(rootPath), None)
+
+    print("Tests passed")
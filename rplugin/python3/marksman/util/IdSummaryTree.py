@@ -0,0 +1,174 @@
+
+from array import array
+from bisect import bisect_left
+
+# Sorts before any real change time
+NoFileTime = float('-inf')
+
+class IdSummaryTree:
+    """
+    Segment tree over the sortedIds of a ProjectIndex.  For any range of ids it gives
+    the number of files and the most recently changed one among them, in O(log n).
+    Since all the ids starting with a prefix form one range of sortedIds, that makes a
+    prefix summary a bisect and a range query per letter that can follow the prefix,
+    however many ids there are under it.
+
+    Trees are never modified once built.  withChanges copies the two arrays, which is
+    a plain memcpy, and then only updates the leaves of the ids that changed
+    """
+    def __init__(self, sortedIds, getCount, getFirstFile, getChangeTime, _copyFrom=None):
+        self.sortedIds = sortedIds
+        self._getChangeTime = getChangeTime
+
+        if _copyFrom is not None:
+            self._size = _copyFrom._size
+            self._counts = _copyFrom._counts[:]
+            self._firstFiles = _copyFrom._firstFiles[:]
+            self._firstTimes = _copyFrom._firstTimes[:]
+            return
+
+        size = 1
+
+        while size < len(sortedIds):
+            size *= 2
+
+        self._size = size
+        self._counts = array('l', [0]) * (2 * size)
+        # -1 where there are no files
+        self._firstFiles = array('l', [-1]) * (2 * size)
+        # The change times of _firstFiles, so that merging doesn't need the file table.
+        # A file whose change time changes is always in one of the changed ids
+        self._firstTimes = array('d', [NoFileTime]) * (2 * size)
+
+        counts = self._counts
+        firstFiles = self._firstFiles
+        firstTimes = self._firstTimes
+
+        # Inlined since this runs for every id after each scan
+        for node, id in enumerate(sortedIds, size):
+            counts[node] = getCount(id)
+            firstFile = getFirstFile(id)
+
+            if firstFile is not None:
+                firstFiles[node] = firstFile
+                firstTimes[node] = getChangeTime(firstFile)
+
+        for node in range(size - 1, 0, -1):
+            left = 2 * node
+            right = left + 1
+            counts[node] = counts[left] + counts[right]
+
+            if firstTimes[right] > firstTimes[left]:
+                left = right
+
+            firstFiles[node] = firstFiles[left]
+            firstTimes[node] = firstTimes[left]
+
+    def withChanges(self, changedIds, getCount, getFirstFile, getChangeTime):
+        """ A copy with the counts and first files of changedIds looked up again """
+        tree = IdSummaryTree(self.sortedIds, getCount, getFirstFile, getChangeTime, _copyFrom=self)
+        sortedIds = self.sortedIds
+
+        for id in changedIds:
+            position = bisect_left(sortedIds, id)
+
+            # Eg. the empty id, which is only in idMap
+            if position == len(sortedIds) or sortedIds[position] != id:
+                continue
+
+            tree._setLeaf(position, id, getCount, getFirstFile)
+            node = (position + tree._size) // 2
+
+            while node > 0:
+                tree._updateNode(node)
+                node //= 2
+
+        return tree
+
+    def _setLeaf(self, position, id, getCount, getFirstFile):
+        node = position + self._size
+        self._counts[node] = getCount(id)
+        firstFile = getFirstFile(id)
+
+        if firstFile is None:
+            self._firstFiles[node] = -1
+            self._firstTimes[node] = NoFileTime
+        else:
+            self._firstFiles[node] = firstFile
+            self._firstTimes[node] = self._getChangeTime(firstFile)
+
+    def _updateNode(self, node):
+        left = 2 * node
+        right = left + 1
+        self._counts[node] = self._counts[left] + self._counts[right]
+
+        # Ties go to the left, ie. the id that sorts first
+        if self._firstTimes[right] > self._firstTimes[left]:
+            left = right
+
+        self._firstFiles[node] = self._firstFiles[left]
+        self._firstTimes[node] = self._firstTimes[left]
+
+    def getRange(self, start, end):
+        """ Returns (count, fileIndex) for the ids at sortedIds[start:end], with fileIndex None if there are no files """
+        counts = self._counts
+        firstTimes = self._firstTimes
+        count = 0
+        # Nodes to the left of the range are visited left to right, and nodes to the
+        # right of it right to left, so the ties go the same way as in _updateNode
+        leftNode = rightNode = 0
+        leftTime = rightTime = NoFileTime
+        start += self._size
+        end += self._size
+
+        while start < end:
+            if start & 1:
+                count += counts[start]
+
+                if firstTimes[start] > leftTime:
+                    leftNode, leftTime = start, firstTimes[start]
+
+                start += 1
+
+            if end & 1:
+                end -= 1
+                count += counts[end]
+
+                if firstTimes[end] >= rightTime:
+                    rightNode, rightTime = end, firstTimes[end]
+
+            start //= 2
+            end //= 2
+
+        node = rightNode if rightTime > leftTime else leftNode
+        firstFile = self._firstFiles[node]
+        return count, (None if firstFile < 0 else firstFile)
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    sortedIds = ['a', 'ab', 'b', 'bc', 'bd']
+    counts = {'a': 1, 'ab': 2, 'b': 0, 'bc': 3, 'bd': 1}
+    firstFiles = {'a': 0, 'ab': 1, 'b': None, 'bc': 2, 'bd': 3}
+    changeTimes = [10.0, 30.0, 20.0, 30.0, 50.0]
+
+    tree = IdSummaryTree(sortedIds, counts.get, firstFiles.get, changeTimes.__getitem__)
+    assertIsEqual(tree.getRange(0, 5), (7, 1))
+    assertIsEqual(tree.getRange(2, 5), (4, 3))
+    assertIsEqual(tree.getRange(2, 3), (0, None))
+    assertIsEqual(tree.getRange(0, 0), (0, None))
+
+    counts['bc'] = 4
+    firstFiles['bc'] = 4
+    changed = tree.withChanges(['bc', 'missing', ''], counts.get, firstFiles.get, changeTimes.__getitem__)
+    assertIsEqual(changed.getRange(0, 5), (8, 4))
+    assertIsEqual(changed.getRange(3, 4), (4, 4))
+    # The original stays as it was
+    assertIsEqual(tree.getRange(3, 4), (3, 2))
+
+    assertIsEqual(IdSummaryTree([], counts.get, firstFiles.get, changeTimes.__getitem__).getRange(0, 0), (0, None))
+
+    print("Tests passed")
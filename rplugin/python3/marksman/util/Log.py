@@ -8,6 +8,8 @@ class Log:
         self.includeDebugging = includeDebugging
 
     def _escape(self, message):
+        # Paths can hold surrogates for bytes that weren't valid utf-8, which can't be sent
+        message = message.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
         return message.replace('\\', '\\\\').replace('"', '\\"')
 
     def _echom(self, message):
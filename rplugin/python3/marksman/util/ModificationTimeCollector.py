@@ -0,0 +1,109 @@
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Number of files to accumulate before handing them to the pool
+BatchSize = 512
+# On windows os.scandir gets the modification times for free, so once we need this
+# many files from the same directory it is cheaper to list it than to stat each one
+ScanDirThreshold = 16
+
+def _statBatch(directories):
+    results = []
+
+    for dirPath, entries in directories:
+        results.extend(_statDirectory(dirPath, entries))
+
+    return results
+
+def _statDirectory(dirPath, entries):
+    results = []
+
+    if os.name == 'nt' and len(entries) >= ScanDirThreshold:
+        fileIndices = dict((name, fileIndex) for fileIndex, name in entries)
+
+        try:
+            with os.scandir(dirPath) as it:
+                for entry in it:
+                    fileIndex = fileIndices.get(entry.name)
+
+                    if fileIndex is not None:
+                        try:
+                            results.append((fileIndex, entry.stat().st_mtime))
+                        except OSError:
+                            pass
+
+            return results
+        except OSError:
+            results = []
+
+    for fileIndex, name in entries:
+        try:
+            results.append((fileIndex, os.stat(os.path.join(dirPath, name)).st_mtime))
+        except OSError:
+            # This can fail sometimes
+            # For example, when using git, deleted files can be listed
+            continue
+
+    return results
+
+class ModificationTimeCollector:
+    """
+    Looks up modification times on a thread pool while the scan is still running.
+    Files are batched per directory, and results are collected on the calling thread
+    with takeResults so that only that thread ever writes to the file table
+    """
+    def __init__(self, fileTable, threadCount):
+        self._fileTable = fileTable
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threadCount))
+        self._pending = []
+        self._futures = set()
+
+    def add(self, fileIndex):
+        self._pending.append(fileIndex)
+
+        if len(self._pending) >= BatchSize:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        fileTable = self._fileTable
+        entriesByDirectory = {}
+
+        for fileIndex in self._pending:
+            entriesByDirectory.setdefault(fileTable.directoryIndices[fileIndex], []).append(
+                (fileIndex, fileTable.names[fileIndex]))
+
+        self._pending = []
+
+        # One task per batch rather than per directory, since scanners that walk
+        # in parallel can spread a batch over hundreds of directories
+        self._futures.add(self._executor.submit(
+            _statBatch, [(fileTable.directories[x], entries) for x, entries in entriesByDirectory.items()]))
+
+    def hasOutstanding(self):
+        return len(self._futures) > 0 or len(self._pending) > 0
+
+    def takeResults(self, timeout=0):
+        """
+        Returns (fileIndex, modificationTime) pairs for every finished batch, waiting
+        up to timeout seconds for at least one to finish
+        """
+        if not self._futures:
+            return []
+
+        done, self._futures = wait(self._futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        results = []
+
+        for future in done:
+            results.extend(future.result())
+
+        return results
+
+    def shutdown(self):
+        # The batches that haven't started are dropped, so that a cancelled scan doesn't
+        # keep stat'ing files next to the scan that replaced it
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,109 @@
+
+import threading
+import queue as Queue
+from marksman.util.AsyncCommandExecutor import AsyncCommandExecutor, MaxQueuedChunks, StopCheckInterval
+
+class ParallelCommandExecutor(object):
+    """
+    Runs several commands at the same time and merges their output into one stream of
+    batches, in whatever order it arrives.  The commands are read in bulk mode, so
+    the merged output is bounded the same way
+    """
+    def __init__(self):
+        self._executors = []
+        self._queue = Queue.Queue(maxsize=MaxQueuedChunks)
+        self._stopEvent = threading.Event()
+
+    def _putUnlessStopped(self, item):
+        while not self._stopEvent.is_set():
+            try:
+                self._queue.put(item, timeout=StopCheckInterval)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def _forwarderThread(self, result, transform):
+        try:
+            for lines in result.iterBatches():
+                if transform:
+                    lines = transform(lines)
+
+                if not self._putUnlessStopped(lines):
+                    break
+        except Exception as e:
+            self._putUnlessStopped(e)
+        finally:
+            self._putUnlessStopped(None)
+
+    def execute(self, commands, encoding=None, errors=None):
+        """
+        commands is a list of (cmd, cwd, transform), where transform is either None or
+        a function that is given each batch of lines and returns the lines to use
+        """
+        for cmd, cwd, transform in commands:
+            executor = AsyncCommandExecutor()
+            self._executors.append(executor)
+
+            result = executor.execute(cmd, encoding=encoding, cwd=cwd, bulk=True, errors=errors)
+
+            thread = threading.Thread(target=self._forwarderThread, args=(result, transform))
+            # die when the main thread dies
+            thread.daemon = True
+            thread.start()
+
+        return ParallelCommandExecutor.Result(self._queue, len(commands), self._stopEvent)
+
+    def killProcess(self):
+        self._stopEvent.set()
+
+        for executor in self._executors:
+            executor.killProcess()
+
+    class Result(object):
+        def __init__(self, queue, commandCount, stopEvent):
+            self._queue = queue
+            self._remainingCount = commandCount
+            self._stopEvent = stopEvent
+
+        def iterBatches(self):
+            """ Yields lists of lines """
+            try:
+                while self._remainingCount > 0:
+                    try:
+                        lines = self._queue.get(timeout=StopCheckInterval)
+                    except Queue.Empty:
+                        if self._stopEvent.is_set():
+                            return
+                        continue
+
+                    if lines is None:
+                        self._remainingCount -= 1
+                    elif isinstance(lines, Exception):
+                        raise lines
+                    else:
+                        yield lines
+            finally:
+                # Lets the forwarder threads finish even if we stopped early
+                self._stopEvent.set()
+
+        def __iter__(self):
+            for lines in self.iterBatches():
+                for line in lines:
+                    yield line
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    result = ParallelCommandExecutor().execute([
+        ('echo a && echo b', None, None),
+        ('echo c', None, lambda lines: ['x/' + x for x in lines]),
+    ], encoding='utf-8')
+
+    assertIsEqual(sorted(result), ['a', 'b', 'x/c'])
+
+    print("Tests passed")
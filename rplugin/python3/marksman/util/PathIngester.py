@@ -0,0 +1,146 @@
+
+import os
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from marksman.util.StringHumpsFinder import getFileNameHumps, getFileNameHumpsList
+
+# Number of paths taken from the scanner at a time
+IngestBatchSize = 4096
+# Larger batches when other processes are helping, so there is enough work to split up
+ProcessPoolBatchSize = 65536
+# Below this many new file names it isn't worth the cost of sending them to other processes
+ProcessPoolThreshold = 8192
+
+def iterateBatches(iterable, batchSize):
+    iterator = iter(iterable)
+
+    while True:
+        batch = list(itertools.islice(iterator, batchSize))
+
+        if not batch:
+            return
+
+        yield batch
+
+def parseModificationTimeRecords(lines):
+    """
+    Turns lines of '<modificationTime> <path>' (like the output of find -printf '%T@ %p\\n')
+    into (path, modificationTime) records.  Lines without a valid time are passed on
+    as bare paths, so they still get looked up
+    """
+    records = []
+
+    for line in lines:
+        if not line:
+            continue
+
+        timeText, separator, path = line.partition(' ')
+
+        try:
+            records.append((path, float(timeText)) if separator else (line, None))
+        except ValueError:
+            records.append((line, None))
+
+    return records
+
+def splitRecords(batch):
+    """
+    Scanners hand over batches of either bare paths, or of (path, modificationTime)
+    records when they get the modification times for free.  The time of a record can
+    be None if it isn't known.  Returns (paths, modificationTimes), where
+    modificationTimes is None for bare paths
+    """
+    if batch and isinstance(batch[0], tuple):
+        paths, modificationTimes = zip(*batch)
+        return paths, modificationTimes
+
+    return batch, None
+
+class BatchedScanResult:
+    """ Scanner output that already comes in batches, like AsyncCommandExecutor.Result in bulk mode """
+    def __init__(self, batches):
+        self._batches = batches
+
+    def iterBatches(self):
+        return iter(self._batches)
+
+    def __iter__(self):
+        for batch in self._batches:
+            for item in batch:
+                yield item
+
+class PathIngester:
+    """
+    Turns raw scanner output into canonical paths and humps in bulk.
+
+    Humps are cached per file name, since large trees repeat the same names over and
+    over (index.js, __init__.py, CMakeLists.txt etc).  Paths are only normalized when
+    they actually need it
+    """
+    def __init__(self, rootPath, processCount):
+        self._rootPath = rootPath
+        self._rootPrefix = os.path.join(rootPath, '')
+        self._humpsCache = {}
+        self._processCount = processCount
+        self._executor = None
+
+    @property
+    def batchSize(self):
+        return ProcessPoolBatchSize if self._processCount > 0 else IngestBatchSize
+
+    def _needsNormalizing(self, path):
+        if os.altsep and os.altsep in path:
+            return True
+
+        if not path.startswith('.') and (os.sep + '.') not in path:
+            return False
+
+        # Only '.' and '..' components matter, hidden files and directories are fine
+        return any(x in ('.', '..') for x in path.split(os.sep))
+
+    def getCanonicalPath(self, path):
+        if self._needsNormalizing(path):
+            return os.path.abspath(os.path.join(self._rootPath, path))
+
+        if os.path.isabs(path):
+            return path
+
+        return self._rootPrefix + path
+
+    def ingest(self, paths):
+        """ Returns a list of (path, humps) for the given batch of scanner output """
+        humpsCache = self._humpsCache
+        getCanonicalPath = self.getCanonicalPath
+        results = []
+
+        for path in paths:
+            path = getCanonicalPath(path)
+            results.append((path, path[path.rfind(os.sep) + 1:]))
+
+        newNames = {name for _, name in results if name not in humpsCache}
+
+        if len(newNames) >= ProcessPoolThreshold and self._processCount > 0:
+            self._addHumpsInOtherProcesses(list(newNames))
+        else:
+            for name in newNames:
+                humpsCache[name] = getFileNameHumps(name)
+
+        return [(path, humpsCache[name]) for path, name in results]
+
+    def _addHumpsInOtherProcesses(self, names):
+        if self._executor is None:
+            # Forking a process with running threads (like the nvim host) is not safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._processCount, mp_context=multiprocessing.get_context('spawn'))
+
+        chunkSize = (len(names) + self._processCount - 1) // self._processCount
+        chunks = [names[i:i + chunkSize] for i in range(0, len(names), chunkSize)]
+
+        for chunk, humps in zip(chunks, self._executor.map(getFileNameHumpsList, chunks)):
+            self._humpsCache.update(zip(chunk, humps))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,134 @@
+
+import os
+import mmap
+import struct
+import hashlib
+from array import array
+
+# Bump this whenever the layout below changes so that stale files are ignored
+CacheVersion = 1
+CacheMagic = b'MMIX'
+
+# magic, version, file count, root length, paths blob length, ids blob length
+HeaderFormat = '<4sIIIQQ'
+HeaderSize = struct.calcsize(HeaderFormat)
+
+class ProjectCacheData:
+    def __init__(self, paths, ids, modificationTimes):
+        self.paths = paths
+        self.ids = ids
+        # Seconds since epoch, 0 when unknown
+        self.modificationTimes = modificationTimes
+
+class ProjectCache:
+    """
+    Stores the file list of a project on disk so that a new session can serve
+    results immediately while the real scan runs in the background.
+
+    Layout (little endian):
+        header | root path | mtimes (float64 * count) | paths blob | ids blob
+
+    The blobs are newline separated so that the whole file can be memory mapped
+    and split in a couple of calls instead of parsing record by record
+    """
+    def __init__(self, cacheDir):
+        self._cacheDir = cacheDir
+
+    def _getCachePath(self, rootPath):
+        key = hashlib.sha1(rootPath.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self._cacheDir, key + '.mmidx')
+
+    def tryLoad(self, rootPath):
+        cachePath = self._getCachePath(rootPath)
+
+        try:
+            with open(cachePath, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    return self._parse(buf, rootPath)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            # Missing, truncated or otherwise corrupt files are treated as a cache miss
+            return None
+
+    def _parse(self, buf, rootPath):
+        magic, version, count, rootLen, pathsLen, idsLen = struct.unpack_from(HeaderFormat, buf, 0)
+
+        if magic != CacheMagic or version != CacheVersion:
+            return None
+
+        offset = HeaderSize
+        cachedRoot = buf[offset:offset + rootLen].decode('utf-8', 'surrogateescape')
+        offset += rootLen
+
+        if cachedRoot != rootPath:
+            return None
+
+        modificationTimes = array('d')
+        modificationTimes.frombytes(buf[offset:offset + 8 * count])
+        offset += 8 * count
+
+        pathsBlob = buf[offset:offset + pathsLen]
+        offset += pathsLen
+
+        idsBlob = buf[offset:offset + idsLen]
+
+        if count == 0:
+            return ProjectCacheData([], [], modificationTimes)
+
+        paths = pathsBlob.decode('utf-8', 'surrogateescape').split('\n')
+        ids = idsBlob.decode('ascii').split('\n')
+
+        if len(paths) != count or len(ids) != count or len(modificationTimes) != count:
+            return None
+
+        return ProjectCacheData(paths, ids, modificationTimes)
+
+    def save(self, rootPath, data):
+        os.makedirs(self._cacheDir, exist_ok=True)
+
+        count = len(data.paths)
+        assert len(data.ids) == count and len(data.modificationTimes) == count
+
+        rootBytes = rootPath.encode('utf-8', 'surrogateescape')
+        pathsBlob = '\n'.join(data.paths).encode('utf-8', 'surrogateescape')
+        idsBlob = '\n'.join(data.ids).encode('ascii')
+
+        modificationTimes = data.modificationTimes
+        if not isinstance(modificationTimes, array):
+            modificationTimes = array('d', modificationTimes)
+
+        cachePath = self._getCachePath(rootPath)
+        tempPath = f'{cachePath}.{os.getpid()}.tmp'
+
+        with open(tempPath, 'wb') as f:
+            f.write(struct.pack(HeaderFormat, CacheMagic, CacheVersion, count, len(rootBytes), len(pathsBlob), len(idsBlob)))
+            f.write(rootBytes)
+            f.write(modificationTimes.tobytes())
+            f.write(pathsBlob)
+            f.write(idsBlob)
+
+        # Atomic so that other neovim instances never see a partially written file
+        os.replace(tempPath, cachePath)
+
+if __name__ == "__main__":
+    import tempfile
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        cache = ProjectCache(tempDir)
+
+        assertIsEqual(cache.tryLoad('/foo'), None)
+
+        cache.save('/foo', ProjectCacheData(['/foo/FooBar.py', '/foo/\udcff.txt'], ['fb', ''], [10.5, 0]))
+
+        data = cache.tryLoad('/foo')
+        assertIsEqual(data.paths, ['/foo/FooBar.py', '/foo/\udcff.txt'])
+        assertIsEqual(data.ids, ['fb', ''])
+        assertIsEqual(list(data.modificationTimes), [10.5, 0])
+
+        cache.save('/bar', ProjectCacheData([], [], []))
+        assertIsEqual(cache.tryLoad('/bar').paths, [])
+
+    print("Tests passed")
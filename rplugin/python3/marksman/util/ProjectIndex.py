@@ -0,0 +1,679 @@
+
+import itertools
+from array import array
+from bisect import bisect_left
+from marksman.util.FileTable import FileTable
+from marksman.util.IdSummaryTree import IdSummaryTree
+
+# Typing and deleting characters only ever visits a handful of prefixes per snapshot,
+# so this is just a safety net
+MaxPrefixSummaries = 256
+# Past this fraction of changed ids it is cheaper to build the summary tree again than
+# to update the one of an older snapshot
+MaxChangedIdsFraction = 0.25
+
+# Every published snapshot gets a new version, so a changed index can be noticed
+# without comparing any contents
+_versionCounter = itertools.count(1)
+# Once this many files have been reordered since the buckets were sorted, they are
+# sorted back into the buckets in one go
+MaxRecentFiles = 4096
+
+class ProjectIndex:
+    """
+    Snapshot of the files of a project.  It is never modified once published, so
+    readers can use it without taking any locks.  The buckets in idMap and nameMap
+    hold indices into fileTable, and idMap[''] holds every file that has humps.
+
+    sortedIds holds every non empty id in order, so that all the ids starting with
+    a given prefix form one contiguous range that can be found with bisect.
+
+    recentIndices holds the files whose open or modification time changed since
+    their buckets were sorted, most recent first.  They keep their old (stale)
+    place in the buckets, which iterBucket skips over while it merges them back in.
+    That way opening a file only touches this short list instead of shifting whole
+    buckets around.
+
+    Prefix summaries come from an IdSummaryTree, which is built the first time one
+    is needed.  If an older snapshot already had one, only the ids that changed
+    since then are updated
+    """
+    def __init__(self, fileTable=None, idMap=None, nameMap=None, totalCount=0, sortedIds=None, version=0, recentIndices=None,
+                 summaryTreeBase=None):
+        self.fileTable = fileTable if fileTable is not None else FileTable()
+        self.idMap = idMap if idMap is not None else {'': array('l')}
+        self.nameMap = nameMap if nameMap is not None else {}
+        self.totalCount = totalCount
+        self.sortedIds = sortedIds if sortedIds is not None else []
+        self.version = version
+        self.recentIndices = recentIndices if recentIndices is not None else array('l')
+        # Derived from the snapshot, so it is fine to fill in lazily
+        self._prefixSummaries = {}
+        self._recentFilesByIds = None
+        self._summaryTree = None
+        # (tree of an older snapshot, ids changed since) to build _summaryTree from
+        self._summaryTreeBase = summaryTreeBase
+
+    def findFileIndex(self, path):
+        return self.fileTable.findFile(path)
+
+    def _getRecentFiles(self, id):
+        """ Returns (list, set) of the recent files in the bucket of id, or None if there aren't any """
+        recentFilesByIds = self._recentFilesByIds
+
+        if recentFilesByIds is None:
+            recentFilesByIds = {}
+
+            if self.recentIndices:
+                ids = self.fileTable.ids
+                recentFilesByIds[''] = list(self.recentIndices)
+
+                for fileIndex in self.recentIndices:
+                    recentFilesByIds.setdefault(ids[fileIndex], []).append(fileIndex)
+
+                recentFilesByIds = dict((x, (y, set(y))) for x, y in recentFilesByIds.items())
+
+            self._recentFilesByIds = recentFilesByIds
+
+        return recentFilesByIds.get(id)
+
+    def iterBucket(self, id, offset=0):
+        """ Yields the files in the bucket of id in order, most recently changed first, starting at offset """
+        fileList = self.idMap.get(id)
+
+        if not fileList:
+            return
+
+        recentFiles = self._getRecentFiles(id)
+
+        if recentFiles is None:
+            for i in range(offset, len(fileList)):
+                yield fileList[i]
+
+            return
+
+        recentList, recentSet = recentFiles
+        getChangeTime = self.fileTable.getChangeTime
+        fileCount = len(fileList)
+        recentCount = len(recentList)
+        position = 0
+        i = 0
+        j = 0
+
+        while i < fileCount or j < recentCount:
+            if i < fileCount and fileList[i] in recentSet:
+                # The stale place of a recent file
+                i += 1
+                continue
+
+            if j < recentCount and (i == fileCount or getChangeTime(recentList[j]) >= getChangeTime(fileList[i])):
+                fileIndex = recentList[j]
+                j += 1
+            else:
+                fileIndex = fileList[i]
+                i += 1
+
+            if position >= offset:
+                yield fileIndex
+
+            position += 1
+
+    def getFirstFile(self, id):
+        """ The most recently changed file with the given humps, or None """
+        return next(self.iterBucket(id), None)
+
+    def getPrefixSummary(self, prefix):
+        """
+        Returns (count, continuations) for the files whose humps start with prefix but
+        are longer than it.  continuations is a list of (letter, count, fileIndex) for
+        each letter that can follow the prefix, where fileIndex is the most recent file
+        under prefix + letter.  Computed once per prefix, since the same search is
+        redrawn over and over
+        """
+        summary = self._prefixSummaries.get(prefix)
+
+        if summary is None:
+            summary = self._computePrefixSummary(prefix)
+
+            if len(self._prefixSummaries) >= MaxPrefixSummaries:
+                self._prefixSummaries.clear()
+
+            self._prefixSummaries[prefix] = summary
+
+        return summary
+
+    def buildSummaryTree(self):
+        """ Builds what getPrefixSummary needs ahead of time, eg. on a background thread """
+        self._getSummaryTree()
+
+    def _getSummaryTree(self):
+        tree = self._summaryTree
+
+        if tree is not None:
+            return tree
+
+        base = self._summaryTreeBase
+        idMap = self.idMap
+        getCount = lambda id: len(idMap[id])
+        getFirstFile = self.getFirstFile
+
+        fileTable = self.fileTable
+        # Like in sortBuckets, going through getChangeTime is only needed once files have been opened
+        getChangeTime = fileTable.getChangeTime if fileTable.openTimes else fileTable.modificationTimes.__getitem__
+
+        if not self.recentIndices:
+            # Then the buckets are in order as they are
+            getFirstFile = lambda id: idMap[id][0] if idMap[id] else None
+
+        if base is not None and base[0].sortedIds is self.sortedIds:
+            tree = base[0].withChanges(base[1], getCount, getFirstFile, getChangeTime)
+        else:
+            # New ids shift the positions of the others, so start over
+            tree = IdSummaryTree(self.sortedIds, getCount, getFirstFile, getChangeTime)
+
+        self._summaryTree = tree
+        # Lets go of the older tree
+        self._summaryTreeBase = None
+        return tree
+
+    def _getSummaryTreeBase(self):
+        """ What a builder for the next snapshot starts from, as (tree, changed ids) """
+        tree = self._summaryTree
+
+        if tree is not None:
+            return tree, set()
+
+        base = self._summaryTreeBase
+        return (base[0], set(base[1])) if base is not None else (None, set())
+
+    def _computePrefixSummary(self, prefix):
+        sortedIds = self.sortedIds
+        tree = self._getSummaryTree()
+        depth = len(prefix)
+        # Humps are always lower case ascii letters, and '{' sorts right after 'z'
+        start = bisect_left(sortedIds, prefix)
+        end = bisect_left(sortedIds, prefix + '{', start)
+
+        # The exact matches aren't part of the summary
+        if start < end and sortedIds[start] == prefix:
+            start += 1
+
+        totalCount = tree.getRange(start, end)[0]
+        continuations = []
+
+        # One range per letter that can follow the prefix
+        while start < end:
+            letter = sortedIds[start][depth]
+            letterEnd = bisect_left(sortedIds, prefix + letter + '{', start, end)
+            count, fileIndex = tree.getRange(start, letterEnd)
+
+            if count > 0:
+                continuations.append((letter, count, fileIndex))
+
+            start = letterEnd
+
+        return totalCount, continuations
+
+class ProjectIndexBuilder:
+    """
+    Applies changes to a private copy of a ProjectIndex and publishes the result as
+    a new snapshot.  The maps, and the buckets in them, are copied the first time
+    they are written to after a publish, so an edit only costs as much as what it
+    touches.  Reordering a file only touches the list of recent files.
+
+    Only one builder should be editing a given file table at a time
+    """
+    def __init__(self, snapshot=None):
+        if snapshot is None:
+            snapshot = ProjectIndex()
+
+        self.fileTable = snapshot.fileTable
+        self.totalCount = snapshot.totalCount
+        # Shared with the snapshot until the first write
+        self._idMap = snapshot.idMap
+        self._nameMap = snapshot.nameMap
+        self._recentIndices = snapshot.recentIndices
+        self._ownsIdMap = False
+        self._ownsNameMap = False
+        self._ownsRecentIndices = False
+        self._sortedIds = snapshot.sortedIds
+        # Ids that are not in _sortedIds yet.  Merged in on publish rather than one
+        # at a time, since a scan can add tens of thousands of them
+        self._newIds = []
+        # Keys of the buckets that have been copied since the last publish
+        self._ownedIds = set()
+        self._ownedNames = set()
+        # Id buckets that may be out of order since they were last sorted
+        self._unsortedIds = set()
+        # Ids whose file count or most recent file may have changed since the summary
+        # tree in _summaryTreeBase was built.  Only tracked while there is one
+        self._summaryTreeBase, self._changedIds = snapshot._getSummaryTreeBase()
+
+    def _getMutableIdMap(self):
+        if not self._ownsIdMap:
+            self._idMap = dict(self._idMap)
+            self._ownsIdMap = True
+
+        return self._idMap
+
+    def _getMutableNameMap(self):
+        if not self._ownsNameMap:
+            self._nameMap = dict(self._nameMap)
+            self._ownsNameMap = True
+
+        return self._nameMap
+
+    def _getMutableRecentIndices(self):
+        if not self._ownsRecentIndices:
+            self._recentIndices = self._recentIndices[:]
+            self._ownsRecentIndices = True
+
+        return self._recentIndices
+
+    def _getMutableBucket(self, bucketMap, ownedKeys, key):
+        if key not in ownedKeys:
+            bucket = bucketMap.get(key)
+            bucketMap[key] = array('l') if bucket is None else bucket[:]
+            ownedKeys.add(key)
+
+        return bucketMap[key]
+
+    def _markChanged(self, id):
+        if self._summaryTreeBase is not None:
+            self._changedIds.add(id)
+
+    def _getMutableIdBuckets(self, id):
+        self._markChanged(id)
+        idMap = self._getMutableIdMap()
+
+        if id not in idMap:
+            self._newIds.append(id)
+
+        return [self._getMutableBucket(idMap, self._ownedIds, id),
+                self._getMutableBucket(idMap, self._ownedIds, '')]
+
+    def _getMutableNameBucket(self, name):
+        return self._getMutableBucket(self._getMutableNameMap(), self._ownedNames, name)
+
+    def findFileIndex(self, path):
+        return self.fileTable.findFile(path)
+
+    def addFile(self, path, id, modificationTime=0.0):
+        """ Appends the file to the end of its buckets.  Call sortBuckets once done adding """
+        fileIndex = self.fileTable.add(path, id, modificationTime)
+        self._getMutableNameBucket(self.fileTable.names[fileIndex]).append(fileIndex)
+
+        if len(id) > 0:
+            for fileList in self._getMutableIdBuckets(id):
+                fileList.append(fileIndex)
+
+            self._unsortedIds.add(id)
+            self._unsortedIds.add('')
+            self.totalCount += 1
+
+        return fileIndex
+
+    def addFiles(self, entries, modificationTimes=None):
+        """
+        Bulk version of addFile for (path, humps) pairs straight from the scanner, with
+        an optional list of modification times to go with them (None where unknown).
+        Returns the indices of the added files that have humps but no modification time
+        """
+        fileTable = self.fileTable
+        addToTable = fileTable.add
+        names = fileTable.names
+        nameMap = self._getMutableNameMap()
+        idMap = self._getMutableIdMap()
+        ownedNames = self._ownedNames
+        ownedIds = self._ownedIds
+        getMutableBucket = self._getMutableBucket
+        allFilesList = getMutableBucket(idMap, ownedIds, '')
+        addedCount = 0
+        missingTimeIndices = []
+
+        if modificationTimes is None:
+            modificationTimes = itertools.repeat(None)
+
+        for (path, id), modificationTime in zip(entries, modificationTimes):
+            fileIndex = addToTable(path, id, modificationTime or 0.0)
+            name = names[fileIndex]
+
+            nameFileList = nameMap[name] if name in ownedNames else getMutableBucket(nameMap, ownedNames, name)
+            nameFileList.append(fileIndex)
+
+            if len(id) == 0:
+                continue
+
+            if id in ownedIds:
+                idFileList = idMap[id]
+            else:
+                if id not in idMap:
+                    self._newIds.append(id)
+
+                idFileList = getMutableBucket(idMap, ownedIds, id)
+
+            idFileList.append(fileIndex)
+            allFilesList.append(fileIndex)
+            self._unsortedIds.add(id)
+            addedCount += 1
+
+            if modificationTime is None:
+                missingTimeIndices.append(fileIndex)
+
+        if addedCount > 0:
+            self._unsortedIds.add('')
+            self.totalCount += addedCount
+
+        return missingTimeIndices
+
+    def insertFile(self, path, id, modificationTime=0.0):
+        """ Like addFile but keeps the buckets in order """
+        fileIndex = self.fileTable.add(path, id, modificationTime)
+        self._getMutableNameBucket(self.fileTable.names[fileIndex]).append(fileIndex)
+
+        if len(id) > 0:
+            for fileList in self._getMutableIdBuckets(id):
+                fileList.append(fileIndex)
+
+            self.totalCount += 1
+            # Its place at the end of the buckets is skipped over like any other recent file's
+            self.reorderFile(fileIndex)
+
+        return fileIndex
+
+    def removeFile(self, fileIndex):
+        fileTable = self.fileTable
+        self._getMutableNameBucket(fileTable.names[fileIndex]).remove(fileIndex)
+
+        id = fileTable.ids[fileIndex]
+
+        if len(id) > 0:
+            for fileList in self._getMutableIdBuckets(id):
+                fileList.remove(fileIndex)
+
+            if fileIndex in self._recentIndices:
+                self._getMutableRecentIndices().remove(fileIndex)
+
+            self.totalCount -= 1
+
+        fileTable.remove(fileIndex)
+
+    def removeFiles(self, fileIndices):
+        """
+        Removes every file in the set fileIndices.  Each bucket that has any of them is
+        filtered once, rather than removing them one by one, which would shift the
+        bucket of all files once per file
+        """
+        fileTable = self.fileTable
+        names = set()
+        ids = set()
+
+        for fileIndex in fileIndices:
+            names.add(fileTable.names[fileIndex])
+            id = fileTable.ids[fileIndex]
+
+            if len(id) > 0:
+                ids.add(id)
+                self.totalCount -= 1
+
+        if not names:
+            return
+
+        nameMap = self._getMutableNameMap()
+
+        for name in names:
+            nameMap[name] = array('l', [x for x in nameMap[name] if x not in fileIndices])
+            self._ownedNames.add(name)
+
+        if ids:
+            idMap = self._getMutableIdMap()
+            ids.add('')
+
+            for id in ids:
+                idMap[id] = array('l', [x for x in idMap[id] if x not in fileIndices])
+                self._ownedIds.add(id)
+                self._markChanged(id)
+
+        if any(x in fileIndices for x in self._recentIndices):
+            self._recentIndices = array('l', [x for x in self._recentIndices if x not in fileIndices])
+            self._ownsRecentIndices = True
+
+        for fileIndex in fileIndices:
+            fileTable.remove(fileIndex)
+
+    def setModificationTime(self, fileIndex, modificationTime):
+        """ Marks the buckets of the file for sortBuckets instead of moving it right away """
+        fileTable = self.fileTable
+
+        if fileTable.modificationTimes[fileIndex] == modificationTime:
+            return
+
+        fileTable.modificationTimes[fileIndex] = modificationTime
+        self._markUnsorted(fileIndex)
+
+    def setOpenTime(self, fileIndex, openTime):
+        """ Marks the buckets of the file for sortBuckets instead of moving it right away """
+        self.fileTable.openTimes[fileIndex] = openTime
+        self._markUnsorted(fileIndex)
+
+    def _markUnsorted(self, fileIndex):
+        id = self.fileTable.ids[fileIndex]
+
+        if len(id) > 0:
+            self._unsortedIds.add(id)
+            self._unsortedIds.add('')
+
+            # Its place in the recent files would go stale, while sorting puts it right anyway
+            if fileIndex in self._recentIndices:
+                self._getMutableRecentIndices().remove(fileIndex)
+
+    def reorderFile(self, fileIndex):
+        """
+        Call after changing the modification time or open time of a file.  This only
+        moves the file within the list of recent files, so it is O(log n) to find its
+        new place plus a short memmove, no matter how big its buckets are
+        """
+        fileTable = self.fileTable
+
+        if len(fileTable.ids[fileIndex]) == 0:
+            return
+
+        self._markChanged(fileTable.ids[fileIndex])
+        recentIndices = self._getMutableRecentIndices()
+
+        if fileIndex in recentIndices:
+            recentIndices.remove(fileIndex)
+
+        getChangeTime = fileTable.getChangeTime
+        changeTime = getChangeTime(fileIndex)
+        low = 0
+        high = len(recentIndices)
+
+        # Goes after the files that changed at the same time, like sorting does
+        while low < high:
+            middle = (low + high) // 2
+
+            if getChangeTime(recentIndices[middle]) >= changeTime:
+                low = middle + 1
+            else:
+                high = middle
+
+        recentIndices.insert(low, fileIndex)
+
+        if len(recentIndices) > MaxRecentFiles:
+            self._foldRecentFiles()
+
+    def _foldRecentFiles(self):
+        """ Sorts the recent files back into their buckets """
+        ids = self.fileTable.ids
+
+        for fileIndex in self._recentIndices:
+            self._unsortedIds.add(ids[fileIndex])
+
+        self._unsortedIds.add('')
+        self._recentIndices = array('l')
+        self._ownsRecentIndices = True
+        self.sortBuckets()
+
+    def sortBuckets(self, includeAllFiles=True):
+        """
+        Sorts the buckets that changed since they were last sorted.  The bucket with
+        every file is by far the most expensive, so it can be left for the final pass
+        """
+        fileTable = self.fileTable
+        # Most of the time nothing has been opened yet, and then indexing the array
+        # directly is several times faster than going through getChangeTime
+        getChangeTime = fileTable.getChangeTime if fileTable.openTimes else fileTable.modificationTimes.__getitem__
+        idMap = self._getMutableIdMap() if self._unsortedIds else self._idMap
+
+        for id in list(self._unsortedIds):
+            if len(id) == 0 and not includeAllFiles:
+                continue
+
+            idMap[id] = array('l', sorted(idMap[id], reverse=True, key=getChangeTime))
+            self._ownedIds.add(id)
+            self._unsortedIds.discard(id)
+            self._markChanged(id)
+
+    def publish(self):
+        # From here on the snapshot shares our buckets, so they need to be copied
+        # again before the next write
+        self._ownedIds.clear()
+        self._ownedNames.clear()
+        self._ownsIdMap = False
+        self._ownsNameMap = False
+        self._ownsRecentIndices = False
+
+        if self._newIds:
+            # Always a new list, since older snapshots share the current one.  The sort
+            # just merges the two sorted runs
+            self._newIds.sort()
+            self._sortedIds = self._sortedIds + self._newIds
+            self._sortedIds.sort()
+            self._newIds = []
+
+        summaryTreeBase = None
+
+        if self._summaryTreeBase is not None:
+            self._changedIds.update(self._unsortedIds)
+
+            if self._summaryTreeBase.sortedIds is not self._sortedIds or \
+                    len(self._changedIds) > len(self._sortedIds) * MaxChangedIdsFraction:
+                # The next snapshot builds its own tree anyway, so stop tracking
+                self._summaryTreeBase = None
+                self._changedIds = set()
+            else:
+                summaryTreeBase = (self._summaryTreeBase, self._changedIds)
+                # The snapshot keeps this set, so later changes go into a copy
+                self._changedIds = set(self._changedIds)
+
+        return ProjectIndex(
+            self.fileTable, self._idMap, self._nameMap, self.totalCount, self._sortedIds, next(_versionCounter),
+            self._recentIndices, summaryTreeBase)
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    builder = ProjectIndexBuilder()
+    first = builder.addFile('/foo/FooBar.py', 'fb', 10.0)
+    second = builder.addFile('/foo/fooBar.cpp', 'fb', 20.0)
+    builder.addFile('/foo/123.txt', '')
+    assertIsEqual(builder.addFiles([('/foo/Other.py', 'o'), ('/foo/456', '')]), [3])
+    assertIsEqual(builder.addFiles([('/foo/Known.py', 'k'), ('/foo/Unknown.py', 'u')], [5.0, None]), [6])
+    assertIsEqual(builder.fileTable.modificationTimes[5], 5.0)
+    builder.removeFile(5)
+    builder.removeFile(6)
+    builder.removeFile(3)
+    builder.sortBuckets()
+
+    builder.setModificationTime(first, 30.0)
+    builder.sortBuckets(includeAllFiles=False)
+    assertIsEqual(list(builder.publish().idMap['']), [second, first])
+
+    builder.sortBuckets()
+    builder.setModificationTime(first, 10.0)
+    builder.sortBuckets()
+
+    snapshot = builder.publish()
+    assertIsEqual(list(snapshot.idMap['fb']), [second, first])
+    assertIsEqual(snapshot.totalCount, 2)
+    assertIsEqual(snapshot.findFileIndex('/foo/FooBar.py'), first)
+
+    editor = ProjectIndexBuilder(snapshot)
+    third = editor.insertFile('/foo/bar/FooBar.py', 'fb', 30.0)
+    editor.removeFile(second)
+    edited = editor.publish()
+
+    # The original snapshot must not see any of the edits
+    assertIsEqual(list(snapshot.idMap['fb']), [second, first])
+    assertIsEqual(list(edited.iterBucket('fb')), [third, first])
+    assertIsEqual(list(edited.iterBucket('fb', 1)), [first])
+    assertIsEqual(list(edited.nameMap['FooBar.py']), [first, third])
+    assertIsEqual(edited.totalCount, 2)
+
+    fooBarQux = editor.addFile('/foo/FooBarQux.py', 'fbq', 40.0)
+    fooCar = editor.addFile('/foo/FooCar.py', 'fc', 50.0)
+    editor.addFile('/foo/FooCarBaz.py', 'fcb', 10.0)
+    editor.sortBuckets()
+    edited = editor.publish()
+
+    # Ids stay listed after their last file is removed, their buckets are just empty
+    assertIsEqual(edited.sortedIds, ['fb', 'fbq', 'fc', 'fcb', 'k', 'o', 'u'])
+    assertIsEqual(edited.getPrefixSummary('f'), (5, [('b', 3, fooBarQux), ('c', 2, fooCar)]))
+    assertIsEqual(edited.getPrefixSummary('fb')[0], 1)
+    assertIsEqual(edited.getPrefixSummary('x'), (0, []))
+    assertIsEqual(snapshot.sortedIds, ['fb', 'k', 'o', 'u'])
+    assertIsEqual(edited.version > snapshot.version, True)
+
+    # Reordering only touches the recent files, which reads merge back in
+    editor.fileTable.openTimes[first] = 60.0
+    editor.reorderFile(first)
+    reordered = editor.publish()
+    assertIsEqual(reordered.idMap is edited.idMap, True)
+    assertIsEqual(list(reordered.recentIndices), [first, third])
+    assertIsEqual(list(reordered.iterBucket('fb')), [first, third])
+    assertIsEqual(list(reordered.iterBucket(''))[:2], [first, fooCar])
+    assertIsEqual(reordered.getPrefixSummary('f')[1][0], ('b', 3, first))
+
+    # Later snapshots update the summary tree instead of building it again
+    opener = ProjectIndexBuilder(reordered)
+    opener.fileTable.openTimes[fooCar] = 65.0
+    opener.reorderFile(fooCar)
+    opened = opener.publish()
+    assertIsEqual(opened._summaryTreeBase[1], {'fc'})
+    assertIsEqual(opened.getPrefixSummary('f'), (5, [('b', 3, first), ('c', 2, fooCar)]))
+    assertIsEqual(opened.getPrefixSummary('f'), ProjectIndex(
+        opened.fileTable, opened.idMap, opened.nameMap, opened.totalCount, opened.sortedIds, 0,
+        opened.recentIndices).getPrefixSummary('f'))
+
+    editor.removeFile(third)
+    assertIsEqual(list(editor.publish().iterBucket('fb')), [first])
+
+    MaxRecentFiles = 4096
+    remover = ProjectIndexBuilder(editor.publish())
+    removedFiles = [remover.addFile(f'/bar/Baz{i}.py', 'b', float(i)) for i in range(3)]
+    remover.sortBuckets()
+    remover.fileTable.openTimes[removedFiles[0]] = 80.0
+    remover.reorderFile(removedFiles[0])
+    assertIsEqual(removedFiles[0] in remover.publish().recentIndices, True)
+    totalCount = remover.totalCount
+    remover.removeFiles({removedFiles[0], removedFiles[2]})
+    removed = remover.publish()
+    assertIsEqual(list(removed.iterBucket('b')), [removedFiles[1]])
+    assertIsEqual(removedFiles[0] in removed.idMap[''] or removedFiles[2] in removed.idMap[''], False)
+    assertIsEqual(removedFiles[0] in removed.recentIndices, False)
+    assertIsEqual(removed.totalCount, totalCount - 2)
+    assertIsEqual(removed.findFileIndex('/bar/Baz0.py'), None)
+
+    MaxRecentFiles = 0
+    editor.fileTable.openTimes[fooCar] = 70.0
+    editor.reorderFile(fooCar)
+    folded = editor.publish()
+    assertIsEqual(len(folded.recentIndices), 0)
+    assertIsEqual(list(folded.idMap['']), list(folded.iterBucket('')))
+    assertIsEqual(list(folded.idMap[''])[:2], [fooCar, first])
+
+    print("Tests passed")
@@ -0,0 +1,153 @@
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+ScanPhases = ('scan', 'ingest', 'stat', 'sort')
+# Upper bounds of the lookup latency histogram buckets, in milliseconds.  Anything
+# slower goes in a last bucket
+LookupHistogramBounds = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+
+class ScanMetrics:
+    """
+    Splits the time of one scan between its phases, and counts the files it had to
+    stat.  Starting a phase ends whichever one was running before, so the phases
+    always add up to the whole
+    """
+    def __init__(self):
+        self.seconds = dict((x, 0.0) for x in ScanPhases)
+        self.statCount = 0
+        self._phase = None
+        self._startTime = None
+
+    def startPhase(self, phase):
+        now = time.perf_counter()
+
+        if self._phase is not None:
+            self.seconds[self._phase] += now - self._startTime
+
+        self._phase = phase
+        self._startTime = now
+
+    def stop(self):
+        self.startPhase(None)
+
+class ProjectStats:
+    """
+    Counters and timings for one project, for MarksmanStats.  Written from the scan,
+    file watcher and rpc threads, so everything goes through one lock.  Recording
+    is cheap enough to always be on
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lastSearchType = None
+        self._lastScan = None
+        self._scanCount = 0
+        self._cancelledScanCount = 0
+        self._lockWaitCount = 0
+        self._lockWaitSeconds = 0.0
+        self._maxLockWaitSeconds = 0.0
+        self._lookupCount = 0
+        self._lookupSeconds = 0.0
+        self._lookupHistogram = [0] * (len(LookupHistogramBounds) + 1)
+
+    def addScan(self, scanMetrics, totalSeconds, scannedCount, wasCancelled):
+        with self._lock:
+            self._scanCount += 1
+
+            if wasCancelled:
+                self._cancelledScanCount += 1
+                return
+
+            self._lastScan = {
+                'searchType': self.lastSearchType,
+                'totalSeconds': totalSeconds,
+                'phaseSeconds': dict(scanMetrics.seconds),
+                'scannedCount': scannedCount,
+                'statCount': scanMetrics.statCount,
+                'finishTime': time.time(),
+            }
+
+    def addLookup(self, seconds):
+        milliseconds = seconds * 1000.0
+
+        with self._lock:
+            self._lookupCount += 1
+            self._lookupSeconds += seconds
+            self._lookupHistogram[bisect.bisect_left(LookupHistogramBounds, milliseconds)] += 1
+
+    @contextmanager
+    def acquire(self, lock):
+        """ Holds lock for the duration, and records how long it took to get it """
+        startTime = time.perf_counter()
+
+        with lock:
+            waitSeconds = time.perf_counter() - startTime
+
+            with self._lock:
+                self._lockWaitCount += 1
+                self._lockWaitSeconds += waitSeconds
+                self._maxLockWaitSeconds = max(self._maxLockWaitSeconds, waitSeconds)
+
+            yield
+
+    def _getHistogram(self):
+        labels = [f'<{x}ms' for x in LookupHistogramBounds] + [f'>={LookupHistogramBounds[-1]}ms']
+        return dict(zip(labels, self._lookupHistogram))
+
+    def toDictionary(self):
+        with self._lock:
+            return {
+                'lastScan': dict(self._lastScan) if self._lastScan else None,
+                'scanCount': self._scanCount,
+                'cancelledScanCount': self._cancelledScanCount,
+                'lockWait': {
+                    'count': self._lockWaitCount,
+                    'totalSeconds': self._lockWaitSeconds,
+                    'maxSeconds': self._maxLockWaitSeconds,
+                },
+                'lookups': {
+                    'count': self._lookupCount,
+                    'totalSeconds': self._lookupSeconds,
+                    'histogram': self._getHistogram(),
+                },
+            }
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    stats = ProjectStats()
+    stats.addLookup(0.00005)
+    stats.addLookup(0.0003)
+    stats.addLookup(1.0)
+
+    histogram = stats.toDictionary()['lookups']['histogram']
+    assertIsEqual(histogram['<0.1ms'], 1)
+    assertIsEqual(histogram['<0.5ms'], 1)
+    assertIsEqual(histogram['>=100ms'], 1)
+
+    with stats.acquire(threading.Lock()):
+        pass
+
+    assertIsEqual(stats.toDictionary()['lockWait']['count'], 1)
+
+    metrics = ScanMetrics()
+    metrics.startPhase('scan')
+    metrics.startPhase('sort')
+    metrics.stop()
+    metrics.statCount = 5
+    stats.addScan(metrics, 1.0, 10, False)
+    stats.addScan(metrics, 1.0, 10, True)
+
+    result = stats.toDictionary()
+    assertIsEqual(result['scanCount'], 2)
+    assertIsEqual(result['cancelledScanCount'], 1)
+    assertIsEqual(result['lastScan']['scannedCount'], 10)
+    assertIsEqual(result['lastScan']['statCount'], 5)
+    assertIsEqual(sorted(result['lastScan']['phaseSeconds']), ['ingest', 'scan', 'sort', 'stat'])
+
+    print("Tests passed")
@@ -0,0 +1,121 @@
+
+import threading
+from collections import OrderedDict
+
+class RefreshScheduler:
+    """
+    Project roots waiting to be scanned, shared by a pool of scan threads.
+
+    A root is only ever queued once, so asking for the same refresh again is free.
+    Roots that someone is waiting on can be promoted, in which case they are taken
+    before anything else that is queued (the most recently promoted first).  A root
+    is never handed out while another thread is still scanning it
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Root path -> promotion stamp, in the order they were queued.  Zero means
+        # not promoted
+        self._queued = OrderedDict()
+        self._running = set()
+        self._nextStamp = 1
+        self._isClosed = False
+
+    def push(self, rootPath):
+        """ Returns False if the root was already queued """
+        with self._condition:
+            if rootPath in self._queued:
+                return False
+
+            self._queued[rootPath] = 0
+            self._condition.notify()
+            return True
+
+    def promote(self, rootPath):
+        with self._condition:
+            if rootPath in self._queued:
+                self._queued[rootPath] = self._nextStamp
+                self._nextStamp += 1
+
+    def pop(self):
+        """
+        Blocks until there is a root to scan.  Call taskDone with it once finished.
+        Returns None once the scheduler is closed
+        """
+        with self._condition:
+            while True:
+                if self._isClosed:
+                    return None
+
+                rootPath = self._tryPop()
+
+                if rootPath is not None:
+                    return rootPath
+
+                self._condition.wait()
+
+    def _tryPop(self):
+        best = None
+
+        # Ties go to whatever was queued first
+        for rootPath, stamp in self._queued.items():
+            if rootPath not in self._running and (best is None or stamp > self._queued[best]):
+                best = rootPath
+
+        if best is not None:
+            del self._queued[best]
+            self._running.add(best)
+
+        return best
+
+    def taskDone(self, rootPath):
+        with self._condition:
+            self._running.discard(rootPath)
+            # The root might have been queued again while it was running
+            self._condition.notify_all()
+
+    def close(self):
+        """ Wakes up every thread in pop, so that they can exit """
+        with self._condition:
+            self._isClosed = True
+            self._condition.notify_all()
+
+    def getQueuedCount(self):
+        with self._condition:
+            return len(self._queued)
+
+    def isPending(self, rootPath):
+        """ True while rootPath is queued or still being scanned """
+        with self._condition:
+            return rootPath in self._queued or rootPath in self._running
+
+if __name__ == "__main__":
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    scheduler = RefreshScheduler()
+    assertIsEqual(scheduler.push('/a'), True)
+    assertIsEqual(scheduler.push('/b'), True)
+    assertIsEqual(scheduler.push('/c'), True)
+    assertIsEqual(scheduler.push('/a'), False)
+
+    scheduler.promote('/c')
+    assertIsEqual(scheduler.pop(), '/c')
+    assertIsEqual(scheduler.pop(), '/a')
+
+    # Can't be handed out again until the running scan is done
+    scheduler.push('/a')
+    assertIsEqual(scheduler.pop(), '/b')
+    assertIsEqual(scheduler.getQueuedCount(), 1)
+    scheduler.taskDone('/a')
+    assertIsEqual(scheduler.pop(), '/a')
+    assertIsEqual(scheduler.isPending('/a'), True)
+    scheduler.taskDone('/a')
+    assertIsEqual(scheduler.isPending('/a'), False)
+
+    scheduler.push('/d')
+    scheduler.close()
+    assertIsEqual(scheduler.pop(), None)
+
+    print("Tests passed")
@@ -5,9 +5,26 @@ import re
 import os
 import os.path
 import fnmatch
+import subprocess
 
 SearchTypes = ["rg", "hg", "git", "pt", "find", "ag"]
 
+_findSupportsPrintf = None
+
+def _getFindSupportsPrintf():
+    # Only GNU find has -printf, the BSD and busybox versions don't
+    global _findSupportsPrintf
+
+    if _findSupportsPrintf is None:
+        try:
+            _findSupportsPrintf = subprocess.call(
+                ['find', os.curdir, '-maxdepth', '0', '-printf', ''],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+        except OSError:
+            _findSupportsPrintf = False
+
+    return _findSupportsPrintf
+
 class SearchExternalCommandBuilder:
     def __init__(self, vimSettings):
         self._vimSettings = vimSettings
@@ -36,6 +53,13 @@ class SearchExternalCommandBuilder:
 
         assert False, f'Invalid search type "{searchType}"'
 
+    def outputsModificationTimes(self, searchType):
+        """
+        True if the command for searchType prints '<modificationTime> <path>' lines
+        instead of bare paths.  See parseModificationTimeRecords
+        """
+        return searchType == "find" and _getFindSupportsPrintf()
+
     def _exists(self, path, dirPath):
         """
         return True if `dirPath` exists in `path` or its ancestor path,
@@ -95,10 +119,7 @@ class SearchExternalCommandBuilder:
 
         return 'hg files %s "%s"' % (ignore, dirPath)
 
-    def _gitSearch(self, dirPath, noIgnore):
-        if not self._exists(dirPath, ".git"):
-            return None
-
+    def _getGitOthersArgs(self, noIgnore):
         wildignoreDir = self._vimSettings["g:Mm_IgnoreDirectoryPatterns"]
         wildignoreFile = self._vimSettings["g:Mm_IgnoreFilePatterns"]
 
@@ -117,12 +138,107 @@ class SearchExternalCommandBuilder:
         else:
             no_ignore = "--exclude-standard"
 
+        return "%s %s" % (no_ignore, ignore)
+
+    def _gitSearch(self, dirPath, noIgnore):
+        if not self._exists(dirPath, ".git"):
+            return None
+
         if self._vimSettings["get(g:, 'Mm_RecurseSubmodules', 0)"]:
             recurse_submodules = "--recurse-submodules"
         else:
             recurse_submodules = ""
 
-        return "git ls-files %s && git ls-files --others %s %s" % (recurse_submodules, no_ignore, ignore)
+        # Otherwise git escapes and quotes any path with non-ascii characters in it
+        git = "git -c core.quotepath=off"
+
+        return "%s ls-files %s && %s ls-files --others %s" % (
+            git, recurse_submodules, git, self._getGitOthersArgs(noIgnore))
+
+    def _findGitRoot(self, dirPath):
+        path = os.path.abspath(dirPath)
+
+        while True:
+            if os.path.exists(os.path.join(path, ".git")):
+                return path
+
+            parent = os.path.dirname(path)
+
+            if parent == path:
+                return None
+
+            path = parent
+
+    def _getSubmodulePaths(self, dirPath):
+        """
+        Returns the paths of the checked out submodules under dirPath, relative to it.
+        Nested submodules are left to the listing of their parent submodule
+        """
+        gitRoot = self._findGitRoot(dirPath)
+
+        if not gitRoot:
+            return []
+
+        try:
+            with open(os.path.join(gitRoot, ".gitmodules"), encoding="utf-8", errors="surrogateescape") as f:
+                contents = f.read()
+        except OSError:
+            return []
+
+        dirPath = os.path.abspath(dirPath)
+        results = []
+
+        for path in re.findall(r'^\s*path\s*=\s*(.+?)\s*$', contents, re.MULTILINE):
+            fullPath = os.path.normpath(os.path.join(gitRoot, path))
+
+            # Submodules that were never initialized are just empty directories
+            if not os.path.exists(os.path.join(fullPath, ".git")):
+                continue
+
+            if fullPath.startswith(os.path.join(dirPath, "")):
+                results.append(os.path.relpath(fullPath, dirPath))
+
+        return results
+
+    def tryBuildGitUntrackedSearchCommand(self, dirPath, noIgnore):
+        """ Lists only the files that git doesn't track, relative to dirPath """
+        if not self._exists(dirPath, ".git"):
+            return None
+
+        return "git -c core.quotepath=off ls-files --others %s" % self._getGitOthersArgs(noIgnore)
+
+    def tryBuildGitSearchCommands(self, dirPath, noIgnore):
+        """
+        Lists the same files as the 'git' search type, but split into commands that can
+        run at the same time: tracked files, untracked files, and the tracked files of
+        each submodule when Mm_RecurseSubmodules is set.
+
+        Returns a list of (cmd, subDirectory, excludedLines), or None if dirPath isn't
+        in a git repo.  Each command has to run in os.path.join(dirPath, subDirectory),
+        and its output is relative to that.  excludedLines should be dropped from its
+        output
+        """
+        if not self._exists(dirPath, ".git"):
+            return None
+
+        # Otherwise git escapes and quotes any path with non-ascii characters in it
+        git = "git -c core.quotepath=off"
+
+        if self._vimSettings["get(g:, 'Mm_RecurseSubmodules', 0)"]:
+            submodulePaths = self._getSubmodulePaths(dirPath)
+        else:
+            submodulePaths = []
+
+        # Without recursing, ls-files lists each submodule as if it was a file
+        commands = [
+            ("%s ls-files" % git, "", set(x.replace(os.sep, "/") for x in submodulePaths)),
+            (self.tryBuildGitUntrackedSearchCommand(dirPath, noIgnore), "", set()),
+        ]
+
+        for path in submodulePaths:
+            commands.append(("%s ls-files --recurse-submodules" % git, path, set()))
+
+        return commands
 
     def _ptSearch(self, dirPath, noIgnore):
         # there is bug on Windows
@@ -196,8 +312,15 @@ class SearchExternalCommandBuilder:
         else:
             show_hidden = ""
 
-        return 'find %s "%s" -name "." -o %s %s %s -type f -print %s %s' % (
-            followlinks, dirPath, ignore_dir, ignore_file, show_hidden, redir_err, strip)
+        # find already has the modification time of every file it lists, so it might as
+        # well print it
+        if self.outputsModificationTimes("find"):
+            print_action = "-printf '%T@ %p\\n'"
+        else:
+            print_action = "-print"
+
+        return 'find %s "%s" -name "." -o %s %s %s -type f %s %s %s' % (
+            followlinks, dirPath, ignore_dir, ignore_file, show_hidden, print_action, redir_err, strip)
 
     def _agSearch(self, dirPath, noIgnore):
         # TODO - Is it worth getting this working on windows?
@@ -0,0 +1,116 @@
+
+import os
+import json
+import hashlib
+import threading
+
+# Bump this whenever the format below changes so that stale files are ignored
+BenchmarkVersion = 1
+# Projects are benchmarked again once their file count grows or shrinks by this factor
+RebenchmarkFactor = 1.5
+
+class SearchTypeBenchmark:
+    def __init__(self, searchType, fileCount, timings, fileCounts):
+        # The fastest search type that lists the same files as the preferred one
+        self.searchType = searchType
+        self.fileCount = fileCount
+        # Search type -> seconds, and search type -> number of files listed
+        self.timings = timings
+        self.fileCounts = fileCounts
+
+    def isStale(self, fileCount):
+        return fileCount > self.fileCount * RebenchmarkFactor or fileCount * RebenchmarkFactor < self.fileCount
+
+class SearchTypeBenchmarks:
+    """
+    The results of benchmarking the search types for each project root.  These are
+    kept in memory, and also saved as small json files next to the project caches
+    when there is a cache directory, so that they carry over to new sessions
+    """
+    def __init__(self, cacheDir):
+        self._cacheDir = cacheDir
+        self._lock = threading.Lock()
+        # Root path -> SearchTypeBenchmark, or None if there is nothing saved
+        self._benchmarks = {}
+
+    def _getBenchmarkPath(self, rootPath):
+        key = hashlib.sha1(rootPath.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self._cacheDir, key + '.mmbench')
+
+    def tryGet(self, rootPath):
+        with self._lock:
+            if rootPath not in self._benchmarks:
+                self._benchmarks[rootPath] = self._tryLoad(rootPath)
+
+            return self._benchmarks[rootPath]
+
+    def _tryLoad(self, rootPath):
+        if not self._cacheDir:
+            return None
+
+        try:
+            with open(self._getBenchmarkPath(rootPath), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            if data['version'] != BenchmarkVersion or data['rootPath'] != rootPath:
+                return None
+
+            return SearchTypeBenchmark(data['searchType'], data['fileCount'], data['timings'], data['fileCounts'])
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing or corrupt files just mean it gets benchmarked again
+            return None
+
+    def save(self, rootPath, benchmark):
+        with self._lock:
+            self._benchmarks[rootPath] = benchmark
+
+        if not self._cacheDir:
+            return
+
+        os.makedirs(self._cacheDir, exist_ok=True)
+
+        data = {
+            'version': BenchmarkVersion,
+            'rootPath': rootPath,
+            'searchType': benchmark.searchType,
+            'fileCount': benchmark.fileCount,
+            'timings': benchmark.timings,
+            'fileCounts': benchmark.fileCounts,
+        }
+
+        benchmarkPath = self._getBenchmarkPath(rootPath)
+        tempPath = f'{benchmarkPath}.{os.getpid()}.tmp'
+
+        # surrogateescape, since json can't write lone surrogates as utf-8
+        with open(tempPath, 'w', encoding='utf-8', errors='surrogateescape') as f:
+            json.dump(data, f)
+
+        # Atomic so that other neovim instances never see a partially written file
+        os.replace(tempPath, benchmarkPath)
+
+if __name__ == "__main__":
+    import tempfile
+
+    def assertIsEqual(left, right):
+        if left != right:
+            raise Exception(f'Expected "{left}" to be equal to "{right}"')
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        benchmarks = SearchTypeBenchmarks(tempDir)
+        assertIsEqual(benchmarks.tryGet('/foo'), None)
+
+        benchmarks.save('/foo', SearchTypeBenchmark('rg', 100, {'rg': 0.5, 'find': 1.0}, {'rg': 100, 'find': 100}))
+
+        benchmark = SearchTypeBenchmarks(tempDir).tryGet('/foo')
+        assertIsEqual(benchmark.searchType, 'rg')
+        assertIsEqual(benchmark.timings, {'rg': 0.5, 'find': 1.0})
+        assertIsEqual(benchmark.isStale(120), False)
+        assertIsEqual(benchmark.isStale(151), True)
+        assertIsEqual(benchmark.isStale(50), True)
+
+        # Only kept in memory without a cache directory
+        benchmarks = SearchTypeBenchmarks(None)
+        benchmarks.save('/foo', benchmark)
+        assertIsEqual(benchmarks.tryGet('/foo').searchType, 'rg')
+
+    print("Tests passed")
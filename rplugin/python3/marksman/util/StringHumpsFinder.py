@@ -1,38 +1,26 @@
 
 import re
 
-def getStringHumps(value):
-    if len(value) == 0:
-        return ''
-
-    value = re.sub('[^a-zA-Z]+', '_', value)
-
-    if value[0] == '_':
-        value = value[1:]
-
-    if len(value) == 0:
-        return ''
-
-    if value[len(value) - 1] == '_':
-        value = value[:-1]
+# A hump is the first letter of every run of letters, plus every upper case letter.
+# Anything that isn't an ascii letter separates runs
+_humpsPattern = re.compile(r'(?<![a-zA-Z])[a-zA-Z]|[A-Z]')
 
-    result = value[0].lower()
-    i = 1
-
-    while i < len(value):
-        c = value[i]
+def getStringHumps(value):
+    return ''.join(_humpsPattern.findall(value)).lower()
 
-        if c == '_':
-            result += value[i+1].lower()
-            i += 2
-            continue
+def getFileNameHumps(fileName):
+    """ Same as getStringHumps(os.path.splitext(fileName)[0]) for a base name, just cheaper """
+    i = fileName.rfind('.')
 
-        if c.isupper():
-            result += c.lower()
+    # Like splitext, leading dots do not start an extension
+    if i > 0 and fileName[:i].lstrip('.'):
+        fileName = fileName[:i]
 
-        i += 1
+    return ''.join(_humpsPattern.findall(fileName)).lower()
 
-    return result
+def getFileNameHumpsList(fileNames):
+    # Used as the unit of work when ingesting in other processes
+    return [getFileNameHumps(x) for x in fileNames]
 
 if __name__ == "__main__":
 
@@ -49,6 +37,14 @@ if __name__ == "__main__":
     assertIsEqual(getStringHumps("this.is.a.test"), "tiat")
     assertIsEqual(getStringHumps("this.is.a.test"), "tiat")
     assertIsEqual(getStringHumps("_31./"), "")
+    assertIsEqual(getStringHumps(""), "")
 
-    print("Tests passed")
+    assertIsEqual(getFileNameHumps("FooBar.py"), "fb")
+    assertIsEqual(getFileNameHumps("foo_bar.tar.gz"), "fbt")
+    assertIsEqual(getFileNameHumps(".bashrc"), "b")
+    assertIsEqual(getFileNameHumps("..foo"), "f")
+    assertIsEqual(getFileNameHumps(".foo.txt"), "f")
+    assertIsEqual(getFileNameHumps("Makefile"), "m")
+    assertIsEqual(getFileNameHumpsList(["a.b", "c"]), ["a", "c"])
 
+    print("Tests passed")